@@ -0,0 +1,91 @@
+"""Compares processing a drop shipped as archives directly (zip, tar.gz, gzip'd documents) with unpacking it to
+scratch disk first, and checks that the records are the same.
+
+Run from the project root:
+    python -m benchmarks.bench_archives [--documents 500] [--rows 200]
+"""
+import argparse
+from datetime import datetime
+import gzip
+import logging
+from pathlib import Path
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import common
+from benchmarks.corpus import generate_corpus
+from db.memory_handler import InMemoryDbHandler
+from processing.document_processor import DocumentProcessor
+from processing.scanner import Scanner
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+
+
+def process(document_types: dict, folder: Path) -> tuple:
+    db_handler = InMemoryDbHandler()
+    processor = DocumentProcessor(document_types, {}, PARAMS, db_handler=db_handler)
+    for document in Scanner(document_types).scan(folder):
+        processor.process_file(document)
+    return sorted((document["name"], document["status"]) for document in db_handler.documents.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive sources benchmark")
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    document_types = common.ConfigLoader("config.json").get_document_types()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp = Path(tmp_dir)
+        generate_corpus(str(tmp / "corpus"), args.documents, rows=args.rows, invalid_ratio=0.2)
+        file_paths = sorted((tmp / "corpus").iterdir())
+        size = sum(file_path.stat().st_size for file_path in file_paths)
+
+        drops = {name: tmp / name for name in ("zip", "tar.gz", "gz")}
+        for drop in drops.values():
+            drop.mkdir()
+        with zipfile.ZipFile(drops["zip"] / "drop.zip", "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for file_path in file_paths:
+                zip_file.write(file_path, f"drop/{file_path.name}")
+        with tarfile.open(drops["tar.gz"] / "drop.tar.gz", "w:gz") as tar:
+            for file_path in file_paths:
+                tar.add(file_path, f"drop/{file_path.name}")
+        for file_path in file_paths:
+            with open(file_path, "rb") as f, gzip.open(drops["gz"] / f"{file_path.name}.gz", "wb") as gz:
+                shutil.copyfileobj(f, gz)
+
+        print(f"{args.documents} documents, {size / 2 ** 20:.1f} MiB unpacked")
+        expected = None
+        for name, drop in drops.items():
+            start = time.perf_counter()
+            scratch = tmp / f"scratch-{name.replace('.', '-')}"
+            scratch.mkdir()
+            for archive in drop.iterdir():
+                if name == "gz":
+                    with gzip.open(archive, "rb") as gz, open(scratch / archive.stem, "wb") as f:
+                        shutil.copyfileobj(gz, f)
+                else:
+                    shutil.unpack_archive(archive, scratch)
+            unpacking = time.perf_counter() - start
+            unpacked_records = process(document_types, scratch)
+            unpacked = time.perf_counter() - start
+            shutil.rmtree(scratch)
+
+            start = time.perf_counter()
+            records = process(document_types, drop)
+            direct = time.perf_counter() - start
+
+            expected = expected or unpacked_records
+            assert records == unpacked_records == expected and len(records) == args.documents, \
+                f"The records of the {name} drop differ"
+            print(f"{name:8} unpacked first {unpacked:7.2f} s (unpacking {unpacking:.2f} s), "
+                  f"read directly {direct:7.2f} s, {size / 2 ** 20:.1f} MiB less written to disk")
+
+
+if __name__ == "__main__":
+    main()
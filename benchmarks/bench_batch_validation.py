@@ -0,0 +1,53 @@
+"""Compares DocumentValidator.validate_batch (columnar, NumPy) with per-document validation.
+
+Both paths must produce the same statuses and discrepancies, the benchmark fails otherwise.
+Run from the project root:
+    python -m benchmarks.bench_batch_validation [--documents 100000] [--repeat 3]
+"""
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import timeit
+
+from benchmarks.bench_validation import generate_field_values
+from templates.html_table_template import HTMLTableTemplate
+from validation import columnar
+from validation.doc_validator import DocumentValidator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch validation benchmark")
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    template = HTMLTableTemplate("HTMLTableTemplate", N=5, D=datetime(2020, 3, 10), SUM=1000)
+    documents = generate_field_values(args.documents)
+    # Values of the wrong type must give the same errors on both paths
+    documents[0]["first_row_sum"] = 12
+    documents[1]["title"] = 7
+
+    def run_scalar():
+        return [DocumentValidator(Path("1_table.html"), template, None, values).validate() for values in documents]
+
+    def run_batch():
+        return DocumentValidator.validate_batch(template, documents)
+
+    scalar_results, batch_results = run_scalar(), run_batch()
+    assert len(scalar_results) == len(batch_results)
+    for i, (expected, actual) in enumerate(zip(scalar_results, batch_results)):
+        assert expected == actual, f"Document {i}: {expected} != {actual}"
+
+    scalar = min(timeit.repeat(run_scalar, number=1, repeat=args.repeat)) / args.documents
+    batch = min(timeit.repeat(run_batch, number=1, repeat=args.repeat)) / args.documents
+
+    print(f"{args.documents} documents, NumPy {'available' if columnar.np is not None else 'not installed'}, "
+          f"results identical")
+    print(f"per document   {scalar * 1e6:8.2f} us/document")
+    print(f"batch          {batch * 1e6:8.2f} us/document, {scalar / batch:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
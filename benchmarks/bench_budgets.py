@@ -0,0 +1,89 @@
+"""Processes a corpus with pathological documents mixed in (a huge table, a huge cell) without and with per-document
+time and memory budgets, and reports the tail latency of the documents.
+
+The records of the normal documents must be the same in both runs, the pathological ones must be recorded with the
+ERROR status and a budget discrepancy. Run from the project root:
+    python -m benchmarks.bench_budgets [--documents 200] [--huge-rows 100000] [--time-budget 1] [--memory-budget 64]
+"""
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import statistics
+import tempfile
+import time
+
+import common
+from benchmarks.corpus import generate_corpus, write_table
+from db.memory_handler import InMemoryDbHandler
+from processing import supervisor
+from processing.document_processor import DocumentProcessor
+from processing.scanner import Scanner
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+
+
+def write_pathological(folder: Path, first: int, huge_rows: int) -> dict:
+    """Writes the pathological documents and returns the budget discrepancy type expected for each one."""
+    with open(folder / f"{first}_table.html", "w", encoding="utf-8") as f:
+        write_table(f, huge_rows, 8)
+    with open(folder / f"{first + 1}_table.html", "w", encoding="utf-8") as f:
+        f.write("<html><body><table>\n<caption>Quarterly revenue report</caption>\n<tbody>\n<tr><td>")
+        f.write("x" * 40 * 2 ** 20)
+        f.write("</td></tr>\n</tbody>\n<tfoot><tr><td>Creation: 10Mar2010 Cayman Islands</td></tr></tfoot>\n")
+        f.write("</table></body></html>\n")
+    return {f"{first}_table.html": supervisor.TIME_BUDGET_EXCEEDED,
+            f"{first + 1}_table.html": supervisor.MEMORY_BUDGET_EXCEEDED}
+
+
+def process(document_types: dict, folder: Path, options: dict) -> tuple:
+    db_handler = InMemoryDbHandler()
+    processor = DocumentProcessor(document_types, {}, PARAMS, options, db_handler=db_handler)
+    latencies = []
+    for document in Scanner(document_types).scan(folder):
+        start = time.perf_counter()
+        processor.process_file(document)
+        latencies.append(time.perf_counter() - start)
+    processor.close()
+    return db_handler, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-document budgets benchmark")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--huge-rows", type=int, default=100000)
+    parser.add_argument("--time-budget", type=float, default=1)
+    parser.add_argument("--memory-budget", type=float, default=64)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    document_types = common.ConfigLoader("config.json").get_document_types()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        folder = Path(tmp_dir)
+        generate_corpus(tmp_dir, args.documents, rows=args.rows, invalid_ratio=0.2)
+        pathological = write_pathological(folder, args.documents, args.huge_rows)
+
+        print(f"{args.documents} documents of {args.rows} rows, a {args.huge_rows} rows one and a 40 MiB cell one")
+        print(f"{'budgets':32} {'total':>8} {'p50':>9} {'p99':>9} {'max':>9}")
+        runs = {"none": {}, f"{args.time_budget} s, {args.memory_budget} MiB": {
+            "time_budget": args.time_budget, "memory_budget": args.memory_budget}}
+        records = {}
+        for label, options in runs.items():
+            db_handler, latencies = process(document_types, folder, options)
+            print(f"{label:32} {sum(latencies):7.2f}s {statistics.median(latencies) * 1000:7.1f}ms "
+                  f"{latencies[int(len(latencies) * 0.99)] * 1000:7.1f}ms {latencies[-1] * 1000:7.1f}ms")
+            records[label] = {document["name"]: document["status"] for document in db_handler.documents.values()}
+            over_budget = {discrepancy["discrepancy_type"] for discrepancy in db_handler.discrepancies.values()
+                           if discrepancy["discrepancy_type"] in pathological.values()}
+            assert over_budget == (set(pathological.values()) if options else set()), \
+                f"{label}: the budget discrepancies are {over_budget}"
+
+        unbudgeted, budgeted = records.values()
+        for name, status in budgeted.items():
+            expected = "ValidationStatus.ERROR" if name in pathological else unbudgeted[name]
+            assert status == expected, f"{name}: {status} != {expected}"
+
+
+if __name__ == "__main__":
+    main()
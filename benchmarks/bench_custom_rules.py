@@ -0,0 +1,63 @@
+"""Measures the per-document cost of compiled custom document rules against evaluating their source every time.
+
+Run from the project root:
+    python -m benchmarks.bench_custom_rules [--documents 20000] [--rules 24] [--repeat 3]
+"""
+import argparse
+import timeit
+
+from benchmarks.bench_validation import generate_field_values
+from validation.custom_rules import FUNCTIONS
+from validation.validation_rules import DocRuleBuilder
+
+RULE_CODES = (
+    "title is None or len(title) >= N",
+    "first_row_sum is None or int(first_row_sum) <= SUM",
+    "title is None or first_row_sum is None or len(title) * 100 >= int(first_row_sum) - SUM",
+    "creation_date is None or creation_date[-4:] >= YEAR",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Custom document rules benchmark")
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--rules", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = {"N": 5, "SUM": 1000, "YEAR": "2012"}
+    rule_codes = [RULE_CODES[i % len(RULE_CODES)] for i in range(args.rules)]
+    builder = DocRuleBuilder()
+    for rule_code in rule_codes:
+        builder.add_custom_rule(rule_code, **params)
+    rules = builder.get_validation_rules()
+    documents = generate_field_values(args.documents)
+
+    def evaluate(rule_code: str, field_values: dict) -> bool:
+        # The source is parsed again for every document, like the former eval() based rules
+        return bool(eval(rule_code, {"__builtins__": {}}, {**FUNCTIONS, **field_values, **params}))
+
+    for values in documents:
+        assert [rule(values)[0] for rule in rules] == [evaluate(code, values) for code in rule_codes], \
+            "Custom rule results differ"
+
+    def run_eval():
+        for values in documents:
+            for rule_code in rule_codes:
+                evaluate(rule_code, values)
+
+    def run_compiled():
+        for values in documents:
+            for rule in rules:
+                rule(values)
+
+    evaluated = min(timeit.repeat(run_eval, number=1, repeat=args.repeat)) / args.documents
+    compiled = min(timeit.repeat(run_compiled, number=1, repeat=args.repeat)) / args.documents
+
+    print(f"{args.documents} documents, {args.rules} custom rules")
+    print(f"eval per document    {evaluated * 1e6:8.2f} us/document")
+    print(f"compiled rules       {compiled * 1e6:8.2f} us/document, {evaluated / compiled:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compares the single-pass HTMLTableTemplate extraction with the former BeautifulSoup implementation.
+
+Run from the project root:
+    python -m benchmarks.bench_html_extraction [--rows 20000] [--columns 12] [--repeat 3]
+"""
+import argparse
+from datetime import datetime
+from pathlib import Path
+import re
+import tempfile
+import timeit
+
+from benchmarks.corpus import write_table
+from templates.html_table_template import HTMLTableTemplate
+
+
+def legacy_extract_field_values(file_path: Path) -> dict:
+    # The BeautifulSoup based implementation HTMLTableTemplate used before the single-pass extractor
+    from bs4 import BeautifulSoup
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    title = soup.find('caption').get_text(strip=True) if soup.find('caption') else None
+    header = [th.get_text(strip=True) for th in soup.find('thead').find_all('th')] if soup.find('thead') else []
+    body = []
+    for row in soup.find('tbody').find_all('tr'):
+        body.append([td.get_text(strip=True) for td in row.find_all('td')])
+    footer = soup.find('tfoot').get_text(strip=True) if soup.find('tfoot') else ""
+
+    creation_info = re.search(r'Creation: (\d+\w+\d{4}) (.+)$', footer)
+    creation_date = creation_info.group(1) if creation_info else None
+    creation_country = creation_info.group(2) if creation_info else None
+
+    first_row_sum = 0
+    for value in body[0][1:]:
+        try:
+            first_row_sum += int(re.sub(r'\D', '', value))
+        except ValueError:
+            pass
+
+    return {"title": title, "header": header, "body": body, "footer": footer,
+            "creation_date": creation_date, "creation_country": creation_country,
+            "first_row_sum": str(first_row_sum)}
+
+
+def best_time(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML table extraction benchmark")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+    full_template = HTMLTableTemplate("HTMLTableTemplate", **params)
+    no_body_template = HTMLTableTemplate("HTMLTableTemplate", parse_body=False, **params)
+    # The body is neither validated nor saved, the lazy extraction skips it
+    not_saved_template = HTMLTableTemplate("HTMLTableTemplate", fields_to_save=["title", "creation_date"], **params)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = Path(tmp_dir) / "1_table.html"
+        with open(file_path, 'w', encoding='utf-8') as f:
+            write_table(f, args.rows, args.columns)
+        print(f"Table: {args.rows} rows x {args.columns} columns, {file_path.stat().st_size / 2 ** 20:.1f} MiB")
+
+        results = {
+            "single-pass, full body": best_time(lambda: full_template.extract_field_values(file_path), args.repeat),
+            "single-pass, no body": best_time(lambda: no_body_template.extract_field_values(file_path), args.repeat),
+            "required fields only": best_time(lambda: not_saved_template.extract_required_fields(file_path),
+                                              args.repeat),
+        }
+        try:
+            expected = legacy_extract_field_values(file_path)
+        except ImportError:
+            print("BeautifulSoup is not installed, the legacy implementation is skipped")
+        else:
+            assert full_template.extract_field_values(file_path) == expected, "Extraction results differ"
+            no_body = no_body_template.extract_field_values(file_path)
+            assert {**no_body, "body": expected["body"]} == expected, "Extraction results differ"
+            required = not_saved_template.extract_required_fields(file_path)
+            assert required == {k: expected[k] for k in ("title", "creation_date", "first_row_sum")}, \
+                "Extraction results differ"
+            results["BeautifulSoup (legacy)"] = best_time(lambda: legacy_extract_field_values(file_path), args.repeat)
+
+    baseline = results.get("BeautifulSoup (legacy)")
+    for name, seconds in results.items():
+        speedup = f", {baseline / seconds:.1f}x faster than legacy" if baseline and name != "BeautifulSoup (legacy)" else ""
+        print(f"{name:<26} {seconds * 1000:10.1f} ms{speedup}")
+
+
+if __name__ == "__main__":
+    main()
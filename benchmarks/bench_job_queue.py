@@ -0,0 +1,110 @@
+"""Simulates the distributed mode on the in-memory stand-in of the job queue and checks the exactly-once recording.
+
+One worker dies after claiming a batch and another one stalls on a document past its lease, the other workers
+claim their jobs again once the leases expire. The records must be the same as those of a serial run, every
+document recorded once. Run from the project root:
+    python -m benchmarks.bench_job_queue [--documents 200] [--workers 4] [--claim-batch 8] [--lease 1.0]
+"""
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+import common
+from benchmarks.corpus import generate_corpus
+from db.db_handlers import JOB_DONE, JOB_FAILED
+from db.memory_handler import InMemoryDbHandler
+from processing import job_queue
+from processing.document_processor import DocumentProcessor, ProcessingOutcome
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 300}
+
+
+class StallingProcessor:
+    """Stalls on its first document past the lease, as a worker stuck on I/O would."""
+
+    def __init__(self, processor: DocumentProcessor, stall: float):
+        self._processor = processor
+        self._stall = stall
+        self.db_handler = processor.db_handler
+
+    def process_file(self, file_path: Path, document_id: str = None) -> ProcessingOutcome:
+        if self._stall:
+            time.sleep(self._stall)
+            self._stall = 0
+        return self._processor.process_file(file_path, document_id)
+
+    def flush(self):
+        self._processor.flush()
+
+
+def records(db_handler: InMemoryDbHandler) -> tuple:
+    documents = sorted((d["name"], d["status"]) for d in db_handler.documents.values())
+    discrepancies = sorted((db_handler.documents[d["document_id"]]["name"], d["discrepancy_type"])
+                           for d in db_handler.discrepancies.values())
+    return documents, discrepancies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job queue simulation")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--claim-batch", dest="claim_batch", type=int, default=8)
+    parser.add_argument("--lease", type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    document_types = common.ConfigLoader("config.json").get_document_types()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generate_corpus(tmp_dir, args.documents, rows=20, invalid_ratio=0.3, malformed_ratio=0.1)
+        file_paths = sorted(Path(tmp_dir).iterdir())
+
+        serial = InMemoryDbHandler()
+        processor = DocumentProcessor(document_types, {}, PARAMS, db_handler=serial)
+        start = time.perf_counter()
+        failed = sum(processor.process_file(file_path) == ProcessingOutcome.FAILED for file_path in file_paths)
+        serial_time = time.perf_counter() - start
+
+        queue = InMemoryDbHandler()
+        total, added = job_queue.enqueue(queue, file_paths)
+        assert (total, added) == (args.documents, args.documents) and job_queue.enqueue(queue, file_paths)[1] == 0, \
+            "Enqueueing is not idempotent"
+        # The dead worker never releases its batch
+        lost = queue.claim_jobs("dead-worker", args.claim_batch, args.lease)
+
+        start = time.perf_counter()
+        outcomes = []
+        def work(i: int):
+            worker_processor = DocumentProcessor(document_types, {}, PARAMS, db_handler=queue)
+            if i == 0:
+                worker_processor = StallingProcessor(worker_processor, args.lease * 2)
+            outcomes.append(job_queue.QueueWorker(worker_processor, args.claim_batch, args.lease,
+                                                  worker_id=f"worker-{i}").run())
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(args.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queue_time = time.perf_counter() - start
+
+    assert records(queue) == records(serial), "The queue records differ from the serial ones"
+    assert len(queue.documents) == len(serial.documents), "Documents recorded more than once"
+    assert queue.job_counts() == {JOB_DONE: args.documents - failed, JOB_FAILED: failed}, \
+        f"Jobs not done: {queue.job_counts()}"
+    assert all(queue.jobs[job["_id"]]["attempts"] == 2 for job in lost), "The lost jobs were not claimed again"
+    processed = sum(worker_outcomes[ProcessingOutcome.PROCESSED] for worker_outcomes in outcomes)
+    claimed_again = sum(job["attempts"] - 1 for job in queue.jobs.values())
+
+    print(f"{args.documents} documents, {args.workers} worker threads, batches of {args.claim_batch}, "
+          f"{args.lease} s leases")
+    print(f"serial            {serial_time:8.2f} s")
+    print(f"job queue         {queue_time:8.2f} s, {claimed_again} job(s) claimed again after their lease expired, "
+          f"{processed - len(serial.documents)} processed twice, {len(queue.documents)} documents recorded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Measures the logging cost per document: synchronous handlers with every per-document line (the former setup),
+the queue-based logging with every line, and the queue-based logging with the run summaries only.
+
+The documents are validated from field values extracted beforehand and saved to the in-process DB handler, so
+that the logging is a noticeable part of the time. Run from the project root:
+    python -m benchmarks.bench_logging [--documents 20000]
+"""
+import argparse
+from contextlib import redirect_stderr
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+
+import common
+from benchmarks.bench_validation import generate_field_values
+from db.memory_handler import InMemoryDbHandler
+from templates.html_table_template import HTMLTableTemplate
+from validation.doc_validator import DocumentValidator
+
+
+def run(template: HTMLTableTemplate, documents: list) -> float:
+    db_handler = InMemoryDbHandler()
+    start = time.perf_counter()
+    for i, values in enumerate(documents):
+        name = f"{i}_table.html"
+        if common.run_summary.sampled(name):
+            logging.info(f"Start processing {name}")
+        DocumentValidator(Path(name), template, db_handler, values).process()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logging benchmark")
+    parser.add_argument("--documents", type=int, default=20000)
+    args = parser.parse_args()
+
+    template = HTMLTableTemplate("HTMLTableTemplate", N=5, D=datetime(2020, 3, 10), SUM=1000)
+    documents = generate_field_values(args.documents, invalid_ratio=0.3)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, "w") as devnull, redirect_stderr(devnull):
+        log_files = [str(Path(tmp_dir) / f"{i}.log") for i in range(3)]
+
+        logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, force=True,
+                            handlers=[logging.StreamHandler(), logging.FileHandler(log_files[0])])
+        common.run_summary.sample_rate = 1.0
+        results.append(("synchronous, every line", run(template, documents)))
+
+        for log_file, sample_rate, label in ((log_files[1], 1.0, "queue, every line"),
+                                             (log_files[2], 0.0, "queue, summaries only")):
+            common.setup_logging({"file": log_file, "document_sample_rate": sample_rate, "summary_interval": 0},
+                                 force=True)
+            results.append((label, run(template, documents)))
+            common.run_summary.log(final=True)
+        # Stops the last listener, the queued records are written
+        logging.basicConfig(handlers=[logging.NullHandler()], force=True)
+        common.setup_logging({"file": os.devnull}, force=True)
+        lines = [sum(1 for _ in open(log_file, encoding="utf-8")) for log_file in log_files]
+
+    print(f"{args.documents} documents")
+    for (label, elapsed), line_count in zip(results, lines):
+        print(f"{label:26} {elapsed / args.documents * 1e6:8.2f} us/document, {line_count} lines logged, "
+              f"{results[0][1] / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compares the storage layouts of the table header and body: the text layout (str() of the lists, the former
+format), arrays, and deduplicated compressed blobs. Every distinct document is submitted several times.
+
+The documents are saved to the SQLite handler, the size of the database and the time to save them are reported, and
+the saved bodies are read back through the handler API. Run from the project root:
+    python -m benchmarks.bench_payloads [--documents 100] [--submissions 5] [--rows 500] [--columns 12]
+"""
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+from db.sqlite_handler import SQLiteDbHandler
+from templates.html_table_template import HTMLTableTemplate
+from validation.doc_validator import DocumentValidator
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+FIELDS = ("title", "header", "body", "footer", "creation_country", "creation_date")
+LAYOUTS = {
+    "text": {},
+    "header and body arrays": {"header": "array", "body": "array"},
+    "body blob": {"header": "array", "body": "blob"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload storage layouts benchmark")
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--submissions", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--columns", type=int, default=12)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = Path(tmp_dir) / "corpus"
+        generate_corpus(str(corpus), args.documents, rows=args.rows, columns=args.columns)
+        extractor = HTMLTableTemplate("HTMLTableTemplate", **PARAMS)
+        documents = [(file_path, extractor.extract_required_fields(file_path))
+                     for file_path in sorted(corpus.iterdir())]
+
+        print(f"{args.documents} documents of {args.rows} rows x {args.columns} columns, "
+              f"submitted {args.submissions} times")
+        print(f"{'layout':24} {'database':>10} {'save':>12}")
+        baseline = None
+        for label, layouts in LAYOUTS.items():
+            template = HTMLTableTemplate("HTMLTableTemplate", fields_to_save={field: layouts.get(field, "text")
+                                                                              for field in FIELDS}, **PARAMS)
+            db_path = Path(tmp_dir) / f"{len(label)}-{label.replace(' ', '_')}.db"
+            db_handler = SQLiteDbHandler({"path": str(db_path), "batch_size": 1000})
+            start = time.perf_counter()
+            for _ in range(args.submissions):
+                for file_path, field_values in documents:
+                    DocumentValidator(file_path, template, db_handler, field_values).process()
+            db_handler.flush()
+            elapsed = time.perf_counter() - start
+
+            # The bodies read back through the handler API are the extracted ones
+            expected = {file_path.name: field_values["body"] for file_path, field_values in documents}
+            for document in db_handler.find_documents(limit=args.documents * args.submissions):
+                body = db_handler.load_payloads(document)["body"]
+                assert body == (str(expected[document["name"]]) if not layouts else expected[document["name"]]), \
+                    f"{label}: the body of {document['name']} differs"
+            db_handler.close()
+
+            size = db_path.stat().st_size
+            baseline = baseline or size
+            print(f"{label:24} {size / 2 ** 20:8.1f}MiB {elapsed / (args.documents * args.submissions) * 1e6:8.0f}us/doc"
+                  f"  {baseline / size:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Times the reporting queries on a large seeded SQLite database, with the indexes the handler creates and with
+them dropped (full table scans, as the queries ran before), and checks their results against the in-memory handler.
+
+Run from the project root:
+    python -m benchmarks.bench_reporting [--documents 200000] [--repeat 5]
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from db.memory_handler import InMemoryDbHandler
+from db.sqlite_handler import SQLiteDbHandler
+from validation.doc_validator import ValidationStatus
+
+TEMPLATES = ["HTMLTableTemplate", "InvoiceTemplate", "ReceiptTemplate", "OrderTemplate"]
+DISCREPANCY_TYPES = ["length_mismatch", "missing_field", "threshold_exceeded", "invalid_date", "sum_mismatch",
+                     "duplicate_row", "custom_rule"]
+DAYS = 30
+
+
+def seed(handlers: list, documents: int, now: datetime):
+    rng = random.Random(0)
+    statuses = [str(status) for status in (ValidationStatus.VALID, ValidationStatus.INVALID, ValidationStatus.ERROR)]
+    for i in range(documents):
+        template = rng.choice(TEMPLATES)
+        status = rng.choices(statuses, weights=(6, 3, 1))[0]
+        processed_at = now - timedelta(seconds=rng.uniform(0, DAYS * 86400))
+        document = {"_id": f"d{i}", "name": f"{i}_table.html", "template": template, "status": status,
+                    "processed_at": processed_at}
+        discrepancies = [] if status == statuses[0] else [
+            {"_id": f"d{i}-{j}", "document_id": f"d{i}", "template": template, "processed_at": processed_at,
+             "discrepancy_type": rng.choice(DISCREPANCY_TYPES)} for j in range(rng.randint(1, 5))]
+        for handler in handlers:
+            handler.insert_document(document)
+            handler.insert_discrepancies(discrepancies)
+    for handler in handlers:
+        handler.flush()
+
+
+def timed(query, repeat: int) -> tuple:
+    result = query()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        query()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporting queries benchmark")
+    parser.add_argument("--documents", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    week = now - timedelta(days=7)
+    invalid = str(ValidationStatus.INVALID)
+    queries = [
+        ("status counts", lambda h: h.status_counts()),
+        ("status counts, template, week", lambda h: h.status_counts(template=TEMPLATES[1], since=week)),
+        ("invalid documents, template, week", lambda h: h.find_documents(invalid, TEMPLATES[1], since=week, limit=100)),
+        ("document by name", lambda h: h.find_documents(name=f"{args.documents // 2}_table.html")),
+        ("discrepancies of a document", lambda h: h.document_discrepancies(f"d{args.documents // 3}")),
+        ("top discrepancy types, week", lambda h: h.discrepancy_counts(since=week, limit=5)),
+        ("top discrepancy types, template", lambda h: h.discrepancy_counts(template=TEMPLATES[2], limit=5)),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite = SQLiteDbHandler({"path": str(Path(tmp_dir) / "report.db"), "batch_size": 10000})
+        memory = InMemoryDbHandler()
+        start = time.perf_counter()
+        seed([sqlite, memory], args.documents, now)
+        print(f"{args.documents} documents, {len(memory.discrepancies)} discrepancies seeded in "
+              f"{time.perf_counter() - start:.1f} s")
+
+        indexed = []
+        for label, query in queries:
+            result, elapsed = timed(lambda: query(sqlite), args.repeat)
+            expected = query(memory)
+            # The order of equal counts and of the records processed at the same time may differ
+            if isinstance(result, dict) or (result and isinstance(result[0], tuple)):
+                assert dict(result) == dict(expected) or [n for _, n in result] == [n for _, n in expected], \
+                    f"{label}: {result} != {expected}"
+            else:
+                assert sorted(r["_id"] for r in result) == sorted(r["_id"] for r in expected), f"{label} differs"
+            indexed.append(elapsed)
+
+        for (index,) in sqlite._connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                "AND tbl_name IN ('documents', 'discrepancies')").fetchall():
+            sqlite._connection.execute(f"DROP INDEX {index}")
+        print(f"{'query':36} {'indexed':>10} {'scan':>10}")
+        for (label, query), elapsed in zip(queries, indexed):
+            _, scan = timed(lambda: query(sqlite), args.repeat)
+            print(f"{label:36} {elapsed * 1000:8.2f}ms {scan * 1000:8.2f}ms {scan / elapsed:8.1f}x")
+        sqlite.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Compares the os.scandir based Scanner with the former rglob('*') + is_file() folder walk.
+
+The tree mixes documents with files no document type matches. The shards are checked to split the documents
+without overlap. Run from the project root:
+    python -m benchmarks.bench_scanner [--folders 200] [--files 200] [--shards 4] [--repeat 3]
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import timeit
+
+import common
+from processing.scanner import Scanner
+
+
+def write_tree(root: Path, folders: int, files: int):
+    for f in range(folders):
+        folder = root / f"batch{f // 20}" / f"folder{f}"
+        folder.mkdir(parents=True)
+        for i in range(files):
+            # Every other file is an attachment no document type matches
+            (folder / (f"{f * files + i}_table.html" if i % 2 == 0 else f"{i}_attachment.pdf")).touch()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Folder scanner benchmark")
+    parser.add_argument("--folders", type=int, default=200)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    document_types = common.ConfigLoader("config.json").get_document_types()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        write_tree(root, args.folders, args.files)
+
+        documents = set(Scanner(document_types).scan(root))
+        assert len(documents) == args.folders * ((args.files + 1) // 2), "Wrong number of documents"
+        shards = [set(Scanner(document_types, (i, args.shards)).scan(root)) for i in range(args.shards)]
+        assert set().union(*shards) == documents and sum(map(len, shards)) == len(documents), "Shards overlap"
+
+        legacy = min(timeit.repeat(lambda: [p for p in root.rglob('*') if p.is_file()], number=1, repeat=args.repeat))
+        scanner = min(timeit.repeat(lambda: list(Scanner(document_types).scan(root)), number=1, repeat=args.repeat))
+        sharded = min(timeit.repeat(lambda: list(Scanner(document_types, (0, args.shards)).scan(root)), number=1,
+                                    repeat=args.repeat))
+
+    print(f"{args.folders * args.files} files in {args.folders} folders, {len(documents)} documents, "
+          f"shard sizes {[len(shard) for shard in shards]}")
+    print(f"rglob + is_file (legacy)  {legacy * 1000:8.1f} ms")
+    print(f"scanner                   {scanner * 1000:8.1f} ms, {legacy / scanner:.1f}x faster")
+    print(f"scanner, 1 of {args.shards} shards     {sharded * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Measures the startup time of main.py runs on small drops, and reports the heavy modules each run imports.
+
+The runs use a copy of config.json with the in-process DB handler and the log file in a temporary folder. Run from
+the project root:
+    python -m benchmarks.bench_startup [--repeat 10]
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import write_table
+
+HEAVY_MODULES = ("numpy", "pymongo", "asyncio", "bs4", "sqlite3")
+TEMPLATE_ARGS = ["--N", "5", "--D", "10Mar2020", "--SUM", "1000"]
+
+
+def run(args: list, cwd: str, env: dict, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=cwd, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def imported_modules(args: list, cwd: str, env: dict) -> list:
+    # -X importtime lists every imported module on stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, env=env, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = {line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time")}
+    return [module for module in HEAVY_MODULES if module in modules]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    root = Path(__file__).resolve().parent.parent
+    with open(root / "config.json") as f:
+        config = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp = Path(tmp_dir)
+        config["database"] = {"handler_class": "db.memory_handler.InMemoryDbHandler"}
+        config["logging"] = {**config.get("logging", {}), "file": str(tmp / "app.log")}
+        with open(tmp / "config.json", "w") as f:
+            json.dump(config, f)
+        (tmp / "empty").mkdir()
+        (tmp / "one").mkdir()
+        with open(tmp / "one" / "1_table.html", "w", encoding="utf-8") as f:
+            write_table(f, 10, 6)
+        env = {**os.environ, "PYTHONPATH": str(root)}
+        main_py = str(root / "main.py")
+
+        cases = [("python -c pass", ["-c", "pass"]),
+                 ("main.py --help", [main_py, "--help"]),
+                 ("main.py, empty drop", [main_py, "empty", *TEMPLATE_ARGS]),
+                 ("main.py, one document", [main_py, "one", *TEMPLATE_ARGS])]
+        print(f"median of {args.repeat} runs")
+        for label, case_args in cases:
+            duration = run(case_args, tmp_dir, env, args.repeat)
+            heavy = imported_modules(case_args, tmp_dir, env)
+            print(f"{label:24} {duration * 1000:8.1f} ms, imports {', '.join(heavy) or 'none'} of {', '.join(HEAVY_MODULES)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Measures the peak memory of the HTMLTableTemplate extraction of one large document per body mode.
+
+Every mode runs in a fresh process, the peak RSS of the process is reported. Run from the project root:
+    python -m benchmarks.bench_streaming [--rows 200000] [--columns 12]
+"""
+import argparse
+from datetime import datetime
+import multiprocessing
+from pathlib import Path
+import resource
+import tempfile
+import time
+
+from benchmarks.corpus import write_table
+from templates.html_table_template import HTMLTableTemplate
+
+
+def extract(file_path: Path, body_mode: str, results):
+    template = HTMLTableTemplate("HTMLTableTemplate", body_mode=body_mode, N=5, D=datetime(2020, 3, 10), SUM=1000)
+    start = time.perf_counter()
+    field_values = template.extract_field_values(file_path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                 {k: v for k, v in field_values.items() if k != "body"}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming extraction memory benchmark")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--columns", type=int, default=12)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = Path(folder) / "1_table.html"
+        with open(file_path, 'w', encoding='utf-8') as f:
+            write_table(f, args.rows, args.columns)
+        print(f"{args.rows} rows x {args.columns} columns, {file_path.stat().st_size / 2 ** 20:.1f} MB")
+
+        results = {}
+        for body_mode in HTMLTableTemplate.BODY_MODES:
+            queue = context.Queue()
+            process = context.Process(target=extract, args=(file_path, body_mode, queue))
+            process.start()
+            results[body_mode] = queue.get()
+            process.join()
+            elapsed, peak_rss, _ = results[body_mode]
+            print(f"{body_mode:8} {elapsed:8.3f} s   peak RSS {peak_rss / 2 ** 20:8.1f} MB")
+
+        full, summary = results["full"][2], results["summary"][2]
+        assert {k: v for k, v in summary.items() if not k.startswith("body_")} == full, "Field values differ"
+        assert summary["body_rows"] == args.rows, "Wrong body row count"
+
+
+if __name__ == "__main__":
+    main()
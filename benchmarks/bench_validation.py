@@ -0,0 +1,106 @@
+"""Measures the per-document validation cost of the compiled field rule pipelines against the former rule loop.
+
+Run from the project root:
+    python -m benchmarks.bench_validation [--documents 20000] [--repeat 3]
+"""
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import random
+import timeit
+
+from templates.html_table_template import HTMLTableTemplate
+from validation import validation_rules
+from validation.doc_validator import DocumentValidator
+from validation.validation_rules import Discrepancy, FieldContext, FieldRuleBuilder
+
+
+def generate_field_values(count: int, invalid_ratio: float = 0.1, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    documents = []
+    for _ in range(count):
+        if rnd.random() < invalid_ratio:
+            documents.append({
+                "title": rnd.choice(["Q1", "", None]),
+                "creation_date": rnd.choice([f"{rnd.randint(1, 28)}{rnd.choice(months)}2023", "not a date", None]),
+                "first_row_sum": str(rnd.randint(1001, 5000)),
+            })
+        else:
+            documents.append({
+                "title": rnd.choice(["Annual revenue report", "Quarterly figures", "Balance sheet"]),
+                "creation_date": f"{rnd.randint(1, 28)}{rnd.choice(months)}{rnd.randint(2010, 2019)}",
+                "first_row_sum": str(rnd.randint(0, 1000)),
+            })
+    return documents
+
+
+def legacy_rules(params: dict) -> dict:
+    return {
+        "title": FieldRuleBuilder().add_mandatory_check().add_min_length_check(params["N"]).get_validation_rules(),
+        "creation_date": FieldRuleBuilder().add_mandatory_check().add_type_check("date%d%b%Y")
+            .add_max_check(params["D"]).get_validation_rules(),
+        "first_row_sum": FieldRuleBuilder().add_mandatory_check().add_type_check("int")
+            .add_max_check(params["SUM"]).get_validation_rules(),
+    }
+
+
+def legacy_validate(field_validation_rules: dict, field_values: dict) -> list:
+    # The rule loop DocumentValidator.validate used before the rule chains were compiled
+    discrepancies = []
+    for field_name, rules in field_validation_rules.items():
+        field_context = FieldContext(field_name, field_values.get(field_name, None))
+        for rule in rules:
+            valid = False
+            discrepancy = Discrepancy(f"{rule.__name__} error", field_context.field_name)
+            try:
+                valid, discrepancy = rule(field_context)
+            except Exception as e:
+                discrepancy.message = str(e)
+            if not valid:
+                logging.warning(f"Discrepancy: {discrepancy.to_dict()}")
+                discrepancies.append(discrepancy.to_dict())
+    return discrepancies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Field validation benchmark")
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    params = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+    template = HTMLTableTemplate("HTMLTableTemplate", **params)
+    rules = legacy_rules(params)
+    documents = generate_field_values(args.documents)
+    validators = [DocumentValidator(Path("1_table.html"), template, None, values) for values in documents]
+
+    for validator, values in zip(validators, documents):
+        assert validator.validate()[1]["discrepancies"] == legacy_validate(rules, values), "Validation results differ"
+
+    def run_legacy():
+        # The former type check converted every value again
+        validation_rules.convert_value = validation_rules.convert_value.__wrapped__
+        try:
+            for values in documents:
+                legacy_validate(rules, values)
+        finally:
+            validation_rules.convert_value = cached_convert_value
+
+    def run_compiled():
+        for validator in validators:
+            validator.validate()
+
+    cached_convert_value = validation_rules.convert_value
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=args.repeat)) / args.documents
+    compiled = min(timeit.repeat(run_compiled, number=1, repeat=args.repeat)) / args.documents
+
+    print(f"{args.documents} documents")
+    print(f"rule loop (legacy)   {legacy * 1e6:8.2f} us/document")
+    print(f"compiled pipelines   {compiled * 1e6:8.2f} us/document, {legacy / compiled:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
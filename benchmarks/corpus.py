@@ -0,0 +1,90 @@
+"""Synthetic corpus of HTML table documents matching the "HTML Table" name mask (\\d+_table\\.html).
+
+Run from the project root to write a corpus to a folder:
+    python -m benchmarks.corpus test-data/ --documents 1000 --rows 50 --columns 8 --invalid-ratio 0.2
+"""
+import argparse
+from pathlib import Path
+import random
+from typing import TextIO
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+COUNTRIES = ["Cayman Islands", "Luxembourg", "Ireland", "Singapore", "Switzerland"]
+MALFORMED_KINDS = ["no_body", "no_rows", "truncated", "not_html", "bad_footer"]
+
+
+def write_table(f: TextIO, rows: int, columns: int, title: str = "Quarterly revenue report",
+                creation: str = "10Mar2010 Cayman Islands", row_values=None):
+    f.write(f"<html><body><table>\n<caption>{title}</caption>\n<thead><tr>")
+    f.write("".join(f"<th>Column {c}</th>" for c in range(columns)))
+    f.write("</tr></thead>\n<tbody>\n")
+    for r in range(rows):
+        values = row_values(r) if row_values else [(r * c) % 1000 for c in range(1, columns)]
+        f.write(f"<tr><td>Row {r}</td>")
+        f.write("".join(f"<td>{value:,}</td>" for value in values))
+        f.write("</tr>\n")
+    f.write(f"</tbody>\n<tfoot><tr><td>Creation: {creation}</td></tr></tfoot>\n")
+    f.write("</table></body></html>\n")
+
+
+def write_malformed(f: TextIO, kind: str, rows: int, columns: int):
+    if kind == "no_body":
+        f.write("<html><table><caption>No body</caption><thead><tr><th>A</th></tr></thead></table></html>")
+    elif kind == "no_rows":
+        f.write("<html><table><caption>No rows</caption><tbody></tbody></table></html>")
+    elif kind == "truncated":
+        f.write("<html><body><table>\n<caption>Truncated</caption>\n<tbody>\n<tr><td>Row 0</td><td>1")
+    elif kind == "not_html":
+        f.write("This is not an HTML document.\n" * max(1, rows))
+    else:
+        write_table(f, rows, columns, creation="sometime somewhere")
+
+
+def generate_corpus(folder: str, documents: int, rows: int = 50, columns: int = 8, invalid_ratio: float = 0.1,
+                    malformed_ratio: float = 0.0, seed: int = 42) -> dict:
+    """Writes the documents to folder and returns the description of the corpus."""
+    rnd = random.Random(seed)
+    folder_path = Path(folder)
+    folder_path.mkdir(parents=True, exist_ok=True)
+    kinds = {"valid": 0, "invalid": 0, "malformed": 0}
+
+    for i in range(documents):
+        with open(folder_path / f"{i}_table.html", 'w', encoding='utf-8') as f:
+            draw = rnd.random()
+            if draw < malformed_ratio:
+                write_malformed(f, rnd.choice(MALFORMED_KINDS), rows, columns)
+                kinds["malformed"] += 1
+            elif draw < malformed_ratio + invalid_ratio:
+                # Too short title, too late creation date and too big first row
+                write_table(f, rows, columns, title="Q1",
+                            creation=f"{rnd.randint(1, 28)}{rnd.choice(MONTHS)}2030 {rnd.choice(COUNTRIES)}",
+                            row_values=lambda r: [rnd.randint(500, 5000) for _ in range(1, columns)])
+                kinds["invalid"] += 1
+            else:
+                write_table(f, rows, columns, title=f"Revenue report {i}",
+                            creation=f"{rnd.randint(1, 28)}{rnd.choice(MONTHS)}{rnd.randint(2010, 2019)} "
+                                     f"{rnd.choice(COUNTRIES)}",
+                            row_values=lambda r: [rnd.randint(0, 1000 // columns) for _ in range(1, columns)])
+                kinds["valid"] += 1
+
+    return {"documents": documents, "rows": rows, "columns": columns, "invalid_ratio": invalid_ratio,
+            "malformed_ratio": malformed_ratio, "seed": seed, **kinds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic HTML table corpus generator")
+    parser.add_argument("folder", type=str)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--invalid-ratio", dest="invalid_ratio", type=float, default=0.1)
+    parser.add_argument("--malformed-ratio", dest="malformed_ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(generate_corpus(args.folder, args.documents, args.rows, args.columns, args.invalid_ratio,
+                          args.malformed_ratio, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Throughput benchmark of the document processing stages on a synthetic corpus.
+
+Times TemplateFactory.get_template, extract_field_values, validate and _save_to_db separately (against the in-process
+InMemoryDbHandler) and writes the results as JSON, so that releases can be compared with each other.
+Run from the project root:
+    python -m benchmarks.run_benchmarks --documents 2000 --rows 50 --output results.json [--baseline old.json]
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+from pathlib import Path
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import common
+from benchmarks.corpus import generate_corpus
+from db.memory_handler import InMemoryDbHandler
+from templates import factory
+from validation.doc_validator import DocumentValidator
+
+STAGES = ["get_template", "extract_field_values", "validate", "save_to_db"]
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+
+
+def run_stages(folder: str, document_types: dict) -> dict:
+    template_factory = factory.TemplateFactory(document_types, **PARAMS)
+    db_handler = InMemoryDbHandler()
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    errors = 0
+
+    started = time.perf_counter()
+    for file_path in sorted(Path(folder).iterdir()):
+        t0 = time.perf_counter()
+        template = template_factory.get_template(file_path)
+        t1 = time.perf_counter()
+        timings["get_template"].append(t1 - t0)
+        try:
+            field_values = template.extract_required_fields(file_path)  # As DocumentValidator.process does
+        except Exception:
+            errors += 1  # Malformed documents
+            continue
+        t2 = time.perf_counter()
+        validator = DocumentValidator(file_path, template, db_handler, field_values)
+        status, result = validator.validate()
+        t3 = time.perf_counter()
+        validator._save_to_db(status, result["discrepancies"])
+        t4 = time.perf_counter()
+        timings["extract_field_values"].append(t2 - t1)
+        timings["validate"].append(t3 - t2)
+        timings["save_to_db"].append(t4 - t3)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "stages": {stage: summarize(values) for stage, values in timings.items()},
+        "total_seconds": elapsed,
+        "documents_per_second": len(timings["get_template"]) / elapsed if elapsed else 0.0,
+        "extraction_errors": errors,
+        "documents_saved": len(db_handler.documents),
+        "discrepancies_saved": len(db_handler.discrepancies),
+    }
+
+
+def summarize(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(values),
+        "total_seconds": sum(values),
+        "mean_us": statistics.fmean(values) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p95_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1e6,
+        "max_us": ordered[-1] * 1e6,
+    }
+
+
+def compare(results: dict, baseline: dict):
+    print(f"{'stage':<22}{'baseline us':>14}{'current us':>14}{'ratio':>8}")
+    for stage in STAGES:
+        old = baseline.get("stages", {}).get(stage, {}).get("mean_us")
+        new = results["stages"][stage].get("mean_us")
+        if old and new:
+            print(f"{stage:<22}{old:14.1f}{new:14.1f}{new / old:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Document processing stages benchmark")
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--invalid-ratio", dest="invalid_ratio", type=float, default=0.1)
+    parser.add_argument("--malformed-ratio", dest="malformed_ratio", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--config", type=str, default="config.json")
+    parser.add_argument("--output", type=str, default=None, help="The JSON file to write the results to")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare with")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    document_types = common.ConfigLoader(args.config).get_document_types()
+
+    with tempfile.TemporaryDirectory() as folder:
+        corpus = generate_corpus(folder, args.documents, args.rows, args.columns, args.invalid_ratio,
+                                 args.malformed_ratio, args.seed)
+        results = run_stages(folder, document_types)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "corpus": corpus,
+        **results,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+    if args.baseline:
+        compare(results, json.loads(Path(args.baseline).read_text()))
+
+
+if __name__ == "__main__":
+    main()
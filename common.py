@@ -1,5 +1,20 @@
+from datetime import datetime
+from functools import lru_cache
+import hashlib
 import importlib
 import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+from multiprocessing import util
+import os
+from pathlib import Path
+import queue
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple, Union
+import zlib
 
 class TemplateError(Exception):
     pass
@@ -7,10 +22,87 @@ class TemplateError(Exception):
 class FatalError(Exception):
     pass
 
+# The template parameter types, see param_converter()
+PARAM_TYPES: Dict[str, Callable[[str], Any]] = {"int": int, "float": float, "str": str}
+_STRPTIME_LAMBDA = re.compile(r"lambda\s+(\w+)\s*:\s*(?:datetime\.)?datetime\.strptime\(\s*\1\s*,\s*(['\"])(.*?)\2\s*\)")
+
+
+class DateConverter:
+    """The converter of a date parameter, a class rather than a closure so that it can be pickled."""
+    __slots__ = ("date_format",)
+    __name__ = "date"  # Named in the errors of argparse
+
+    def __init__(self, date_format: str):
+        self.date_format = date_format
+
+    def __call__(self, value: str) -> datetime:
+        return datetime.strptime(value, self.date_format)
+
+
+@lru_cache(maxsize=None)
+def param_converter(type_name: str) -> Callable[[str], Any]:
+    """The converter of a template parameter from its configured type, which is not evaluated.
+
+    The type is one of the PARAM_TYPES, a date in the lambda form "lambda d: datetime.strptime(d, '%d%b%Y')" or the
+    "module.function" name of a converter.
+    """
+    type_name = type_name.strip()
+    if type_name in PARAM_TYPES:
+        return PARAM_TYPES[type_name]
+    match = _STRPTIME_LAMBDA.fullmatch(type_name)
+    if match:
+        return DateConverter(match.group(3))
+    if re.fullmatch(r"\w+(\.\w+)+", type_name):
+        try:
+            return get_class(type_name)
+        except (ImportError, AttributeError) as e:
+            raise FatalError(f"Template parameter type '{type_name}' not found: {e}") from e
+    raise FatalError(f"Unsupported template parameter type '{type_name}', expected one of {', '.join(PARAM_TYPES)}, "
+                     f"a strptime lambda or a module.function name")
+
+
+class DocumentType:
+    """A document type of the configuration, validated, with its name mask and parameter converters compiled."""
+    __slots__ = ("name", "name_mask", "template_class", "options", "params")
+
+    def __init__(self, name: str, type_params: dict):
+        if not type_params or not isinstance(type_params, dict) or \
+                "name_mask" not in type_params or "template_class" not in type_params:
+            raise FatalError("Document type params not configured properly")
+        self.name = name
+        try:
+            self.name_mask: Pattern = re.compile(type_params["name_mask"])
+        except re.error as e:
+            raise FatalError(f"Invalid name mask of the document type '{name}': {e}") from e
+        self.template_class: str = type_params["template_class"]
+        self.options: dict = type_params.get("options", {})
+        # (name, converter, help) of the parameters
+        self.params: List[Tuple[str, Callable[[str], Any], str]] = [
+            (param["name"], param_converter(param["type"]), param.get("help"))
+            for param in type_params.get("params_required", [])]
+
+
+# The document types as configured, or compiled by compile_document_types()
+DocumentTypes = Union[dict, List[DocumentType]]
+
+
+def compile_document_types(document_types: DocumentTypes) -> List[DocumentType]:
+    """The document types of the configuration validated and compiled, the compiled ones are returned as they are."""
+    if isinstance(document_types, list) and document_types and \
+            all(isinstance(document_type, DocumentType) for document_type in document_types):
+        return document_types
+    if not document_types or not isinstance(document_types, dict):
+        raise FatalError("Document types not configured properly")
+    return [DocumentType(name, type_params) for name, type_params in document_types.items()]
+
+
 class ConfigLoader:
     def __init__(self, config_path: str):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
+        # Validated and compiled once at startup, a configuration error shows before any document is processed. The
+        # compiled types are passed on to the workers, the scanner and the template factories
+        self.document_types: List[DocumentType] = compile_document_types(self.get_document_types())
 
     def get_db_config(self):
         return self.config.get("database", {})
@@ -22,6 +114,120 @@ class ConfigLoader:
         return self.config.get("logging", {})
 
 
+class RunSummary:
+    """The number of documents per status and of discrepancies per type, logged every interval seconds and at exit.
+
+    The per-document lines (start, end and discrepancies) are logged for a sample_rate fraction of the documents
+    only. The sample is chosen by document name, so that the lines logged by different processes match.
+    """
+
+    def __init__(self):
+        self.sample_rate: float = 1.0
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._reset()
+
+    def configure(self, sample_rate: float, interval: Optional[float]):
+        with self._lock:
+            self.sample_rate = sample_rate
+            if self._pid == os.getpid():
+                return
+            # The counts inherited from the parent process (fork) are not the ones of this process
+            self._pid = os.getpid()
+            self._reset()
+        if interval:
+            threading.Thread(target=self._log_periodically, args=(interval,), name="run-summary", daemon=True).start()
+        util.Finalize(None, self.log, args=(True,), exitpriority=1)
+
+    def sampled(self, name: str) -> bool:
+        rate = self.sample_rate
+        return rate >= 1.0 or (rate > 0.0 and zlib.crc32(name.encode("utf-8", "surrogateescape")) < rate * 2 ** 32)
+
+    def record(self, status: str, discrepancies: List[dict]):
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            self._documents += 1
+            self._statuses[status] = self._statuses.get(status, 0) + 1
+            for discrepancy in discrepancies:
+                discrepancy_type = discrepancy.get("discrepancy_type")
+                self._discrepancies[discrepancy_type] = self._discrepancies.get(discrepancy_type, 0) + 1
+
+    def log(self, final: bool = False):
+        with self._lock:
+            if not self._documents or self._documents == (self._final_logged if final else self._logged):
+                return
+            self._logged = self._documents
+            if final:
+                self._final_logged = self._documents
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            statuses = ", ".join(f"{status} {count}" for status, count in sorted(self._statuses.items()))
+            discrepancies = ", ".join(f"{discrepancy_type} {count}" for discrepancy_type, count
+                                      in sorted(self._discrepancies.items(), key=lambda item: -item[1])) or "none"
+            documents = self._documents
+        process = f" of process {os.getpid()}" if multiprocessing.parent_process() else ""
+        logging.info(f"{'Final summary' if final else 'Summary'}{process}: {documents} document(s) in {elapsed:.1f} s "
+                     f"({documents / elapsed:.1f}/s), {statuses}. Discrepancies: {discrepancies}")
+
+    def _reset(self):
+        self._documents: int = 0
+        self._statuses: Dict[str, int] = {}
+        self._discrepancies: Dict[str, int] = {}
+        self._started: Optional[float] = None
+        self._logged: int = 0
+        self._final_logged: int = 0
+
+    def _log_periodically(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.log()
+
+
+run_summary = RunSummary()
+
+class _LocalQueueHandler(QueueHandler):
+    # The queue is read by a thread of this process, the records are not pickled and are formatted by the listener
+    # (the arguments of a log call must not be changed afterwards)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# The listener writing the log records of this process, see setup_logging()
+_listener: Optional[util.Finalize] = None
+_listener_pid: Optional[int] = None
+
+
+def setup_logging(logging_config: dict, force: bool = False):
+    """Logs through a queue, the records are formatted and written by a listener thread instead of the caller.
+
+    Like logging.basicConfig, it does nothing if the root logger has handlers already, unless force is set.
+    """
+    global _listener, _listener_pid
+    run_summary.configure(logging_config.get("document_sample_rate", 0.0), logging_config.get("summary_interval", 60))
+
+    root = logging.getLogger()
+    inherited = _listener is not None and _listener_pid != os.getpid()
+    if root.handlers and not inherited and not force:
+        return
+    if _listener is not None and not inherited:
+        _listener()  # Stops the listener once its records are written
+    # The listener thread of the parent process (fork) does not run in this one
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler(), logging.FileHandler(logging_config.get("file", "app.log"))]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    root.addHandler(_LocalQueueHandler(log_queue))
+    root.setLevel(getattr(logging, logging_config.get("level", "INFO").upper(), logging.INFO))
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    # Stopped after the other finalizers (e.g. the final summary), so that their records are written
+    _listener, _listener_pid = util.Finalize(None, listener.stop, exitpriority=0), os.getpid()
+
+
 def get_class(class_name: str):
     # Split the string "module_name.class_name"
     module_name, class_name = class_name.rsplit(".", 1)
@@ -35,3 +241,10 @@ def get_class(class_name: str):
     return handler_class
 
 
+def file_digest(file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+    # SHA-256 of the file content (decompressed for an archive member), read in chunks to keep the memory bounded
+    digest = hashlib.sha256()
+    with file_path.open('rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,4 +1,18 @@
 from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import common
+from db import payloads
+
+# The statuses of the jobs of the job queue (see processing/job_queue.py)
+JOB_QUEUED = "queued"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# The limit of the records returned by the reporting queries
+REPORT_LIMIT = 1000
 
 class AbstractDatabaseHandler(ABC):
 
@@ -22,6 +36,11 @@ class AbstractDatabaseHandler(ABC):
         """Inserts a discrepancy into the database and returns the discrepancy ID."""
         pass
 
+    def insert_discrepancies(self, discrepancies: List[dict]):
+        """Inserts several discrepancies into the database."""
+        for discrepancy in discrepancies:
+            self.insert_discrepancy(discrepancy)
+
     @abstractmethod
     def update_discrepancy(self, discrepancy_id, update_data):
         """Updates a discrepancy by its ID."""
@@ -32,3 +51,107 @@ class AbstractDatabaseHandler(ABC):
         """Deletes a discrepancy by its ID."""
         pass
 
+    def flush(self):
+        """Writes the buffered records (if any) to the database."""
+        pass
+
+    def close(self):
+        """Flushes the buffered records and releases the database resources."""
+        self.flush()
+
+    # The payload store of the blob layout (see db/payloads.py). Handlers without it raise NotImplementedError
+
+    def insert_payloads(self, blobs: Dict[str, bytes]):
+        """Stores the payloads (digest -> JSON) compressed, the ones already stored are kept."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the blob layout")
+
+    def get_payload(self, digest: str) -> Any:
+        """The value of a stored payload, None if it is not stored."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the blob layout")
+
+    def load_payloads(self, record: dict) -> dict:
+        """The record with the references of its blob fields replaced by the field values."""
+        values = {name: self.get_payload(value["payload"]) for name, value in record.items()
+                  if payloads.is_reference(value)}
+        return {**record, **values} if values else record
+
+    # The job queue of the distributed mode, a job is a document path. Handlers without it raise NotImplementedError
+
+    def enqueue_jobs(self, paths: List[str], versions: Optional[List[str]] = None) -> int:
+        """Queues a job for each path not queued yet and returns the number of jobs added.
+
+        With the versions of the documents (e.g. their size and mtime), a job queued before is queued again, with
+        its attempts reset, if the version of its document changed since. Without them, it is kept as it is.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support the job queue")
+
+    def claim_jobs(self, worker_id: str, count: int, lease_seconds: float) -> List[dict]:
+        """Leases up to count queued jobs, or jobs whose lease expired, to the worker.
+
+        Returns the jobs as {"_id", "path", "attempts"} dicts, attempts counting this claim.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support the job queue")
+
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease_seconds: float) -> int:
+        """Extends the leases the worker still holds and returns their number."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the job queue")
+
+    def release_jobs(self, worker_id: str, job_ids: List[str], status: str = JOB_DONE) -> int:
+        """Ends the leases the worker still holds with the status (done, failed, or queued to hand the jobs back).
+
+        Returns the number of jobs released, the others were claimed by another worker after their lease expired.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support the job queue")
+
+    def job_counts(self) -> Dict[str, int]:
+        """The number of jobs per status, the jobs whose lease expired count as queued."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the job queue")
+
+    def delete_document_discrepancies(self, document_id):
+        """Deletes the discrepancies of a document, before the ones of a document processed again replace them.
+
+        Buffering handlers buffer the deletion with the inserts, so that it is written before the new discrepancies.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support the job queue")
+
+    # The reporting API. The documents and their discrepancies are stamped with processed_at (UTC), the time windows
+    # are [since, until). Handlers without it raise NotImplementedError
+
+    def status_counts(self, template: str = None, since: datetime = None, until: datetime = None) -> Dict[str, int]:
+        """The number of documents per status."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the reporting queries")
+
+    def find_documents(self, status: str = None, template: str = None, name: str = None, since: datetime = None,
+                       until: datetime = None, limit: int = REPORT_LIMIT) -> List[dict]:
+        """The documents matching all the given criteria, the latest processed first."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the reporting queries")
+
+    def document_discrepancies(self, document_id) -> List[dict]:
+        """The discrepancies of a document."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the reporting queries")
+
+    def discrepancy_counts(self, template: str = None, since: datetime = None, until: datetime = None,
+                           limit: int = REPORT_LIMIT) -> List[Tuple[str, int]]:
+        """The number of discrepancies per type, the most frequent first."""
+        raise NotImplementedError(f"{type(self).__name__} does not support the reporting queries")
+
+
+def timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Seconds since the epoch of a datetime, naive datetimes are taken as UTC (as MongoDB does)."""
+    if value is None:
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def supports_payloads(db_handler: AbstractDatabaseHandler) -> bool:
+    """Whether the handler has the payload store of the blob layout."""
+    return type(db_handler).insert_payloads is not AbstractDatabaseHandler.insert_payloads
+
+
+def create_db_handler(db_config: dict) -> AbstractDatabaseHandler:
+    db_config = dict(db_config)
+    db_handler_class_name = db_config.pop("handler_class", None)
+    db_handler_class = common.get_class(db_handler_class_name)
+    if not db_handler_class:
+        raise ValueError(f"Handler class '{db_handler_class_name}' not found.")
+    return db_handler_class(db_config)
@@ -0,0 +1,176 @@
+import base64
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+import uuid
+
+from common import FatalError
+from db import db_handlers, payloads
+import metrics
+
+
+class JsonlDbHandler(db_handlers.AbstractDatabaseHandler):
+    """Append-only JSON lines storage in segment files, e.g. documents-<pid>-00001.jsonl.
+
+    Inserts, updates and deletes are all appended as operations (a "_op" key), the current records are rebuilt by
+    replaying the segments (see records()). The lines are buffered and written in batches, a new segment is started
+    when the current one exceeds segment_size bytes. Every process writes its own segments, so that several
+    workers can share the folder.
+
+    The payloads of the blob layout are appended to their own segments (base64 of the compressed JSON), once per
+    process. get_payload() finds them through an index of the payload segments, extended as they grow.
+    """
+
+    def __init__(self, config: dict):
+        self._folder = Path(config.get("path", "document_validation"))
+        self._tables: Dict[str, str] = {"documents": config.get("documents_table", "documents"),
+                                        "discrepancies": config.get("discrepancies_table", "discrepancies"),
+                                        "payloads": config.get("payloads_table", "payloads")}
+        self._batch_size: int = config.get("batch_size", 1000)
+        self._flush_interval: float = config.get("flush_interval", 5.0)
+        self._segment_size: int = config.get("segment_size", 256 * 1024 * 1024)
+        try:
+            self._folder.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise FatalError from e
+
+        self._pending: Dict[str, List[bytes]] = {table: [] for table in self._tables.values()}
+        self._pending_count: int = 0
+        self._files: Dict[str, BinaryIO] = {}
+        self._writer: str = str(os.getpid())
+        self._last_flush: float = time.monotonic()
+        self._payload_digests: Set[str] = set()  # The payloads written by this process
+        self._payload_locations: Dict[str, Tuple[Path, int]] = {}  # Digest -> (segment, offset of its line)
+        self._indexed: Dict[Path, int] = {}  # The bytes of each payload segment in the index
+        self._lock = threading.RLock()
+
+    def insert_document(self, document_info: dict) -> str:
+        return self._append(self._tables["documents"], "insert", document_info)
+
+    def update_document(self, document_id, update_data: dict) -> bool:
+        self._append(self._tables["documents"], "update", {**update_data, "_id": document_id})
+        return True
+
+    def delete_document(self, document_id) -> bool:
+        self._append(self._tables["documents"], "delete", {"_id": document_id, "_deleted": True})
+        return True
+
+    def insert_discrepancy(self, discrepancy: dict) -> str:
+        return self._append(self._tables["discrepancies"], "insert", discrepancy)
+
+    def insert_discrepancies(self, discrepancies: List[dict]):
+        for discrepancy in discrepancies:
+            self._append(self._tables["discrepancies"], "insert", discrepancy)
+
+    def update_discrepancy(self, discrepancy_id, update_data: dict) -> bool:
+        self._append(self._tables["discrepancies"], "update", {**update_data, "_id": discrepancy_id})
+        return True
+
+    def delete_discrepancy(self, discrepancy_id) -> bool:
+        self._append(self._tables["discrepancies"], "delete", {"_id": discrepancy_id, "_deleted": True})
+        return True
+
+    def insert_payloads(self, blobs: Dict[str, bytes]):
+        with self._lock:
+            for digest, data in blobs.items():
+                # The payloads written by other processes too are only read once, by the index
+                if digest not in self._payload_digests:
+                    self._payload_digests.add(digest)
+                    self._append(self._tables["payloads"], "insert",
+                                 {"_id": digest, "data": base64.b64encode(payloads.compress(data)).decode("ascii")})
+
+    def get_payload(self, digest: str) -> Any:
+        self.flush()
+        with self._lock:
+            if digest not in self._payload_locations:
+                self._index_payloads()
+            location = self._payload_locations.get(digest)
+        if location is None:
+            return None
+        segment, offset = location
+        with open(segment, 'rb') as f:
+            f.seek(offset)
+            return payloads.decompress(base64.b64decode(json.loads(f.readline())["data"]))
+
+    def records(self, table: str = "documents") -> Iterator[dict]:
+        """Replays the segments of a table ("documents" or "discrepancies") and yields its current records."""
+        self.flush()
+        records: Dict[str, dict] = {}
+        changes: List[dict] = []
+        for segment in sorted(self._folder.glob(f"{self._tables[table]}-*.jsonl")):
+            with open(segment, 'rb') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record.pop("_op") == "insert":
+                        records[record["_id"]] = record
+                    else:
+                        changes.append(record)
+
+        # The changes may be in the segments of another process than the inserts, they are applied afterwards
+        for change in changes:
+            if change.get("_deleted"):
+                records.pop(change["_id"], None)
+            elif change["_id"] in records:
+                records[change["_id"]].update(change)
+        yield from records.values()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            for table, lines in self._pending.items():
+                if lines:
+                    with metrics.registry.timer("db_write_seconds", handler="jsonl"):
+                        f = self._segment(table)
+                        f.write(b"".join(lines))
+                        f.flush()
+                    self._pending[table] = []
+            self._pending_count = 0
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+    def _append(self, table: str, operation: str, record: dict) -> str:
+        record_id = record.get("_id") or uuid.uuid4().hex
+        line = json.dumps({"_op": operation, **record, "_id": record_id}, default=str, separators=(",", ":"))
+        with self._lock:
+            self._pending[table].append(line.encode("utf-8") + b"\n")
+            self._pending_count += 1
+            if (self._pending_count >= self._batch_size or
+                    time.monotonic() - self._last_flush >= self._flush_interval):
+                self.flush()
+        return record_id
+
+    def _index_payloads(self):
+        # Each segment is read from where the previous lookup stopped, the processes append to their own segments
+        for segment in sorted(self._folder.glob(f"{self._tables['payloads']}-*.jsonl")):
+            with open(segment, 'rb') as f:
+                offset = self._indexed.get(segment, 0)
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Being written
+                    self._payload_locations.setdefault(json.loads(line)["_id"], (segment, offset))
+                    offset += len(line)
+            self._indexed[segment] = offset
+
+    def _segment(self, table: str) -> BinaryIO:
+        # The current segment of the table, a new one is started when it is full
+        f: Optional[BinaryIO] = self._files.get(table)
+        if f is not None and f.tell() < self._segment_size:
+            return f
+        if f is not None:
+            f.close()
+        segments = sorted(self._folder.glob(f"{table}-{self._writer}-*.jsonl"))
+        number = int(segments[-1].stem.rsplit("-", 1)[1]) if segments else 1
+        if segments and segments[-1].stat().st_size >= self._segment_size:
+            number += 1
+        f = open(self._folder / f"{table}-{self._writer}-{number:05d}.jsonl", 'ab', buffering=1024 * 1024)
+        self._files[table] = f
+        return f
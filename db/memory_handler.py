@@ -0,0 +1,167 @@
+from collections import Counter
+from datetime import datetime
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
+
+from db import db_handlers, payloads
+from db.db_handlers import JOB_DONE, JOB_LEASED, JOB_QUEUED, REPORT_LIMIT
+
+
+class InMemoryDbHandler(db_handlers.AbstractDatabaseHandler):
+    """Keeps the records in process memory, for benchmarks and tests (nothing is persisted).
+
+    The job queue is a local stand-in of the database one, shared by the threads of the process. The reporting
+    queries scan the records.
+    """
+
+    def __init__(self, config: dict = None):
+        self.documents: Dict[str, dict] = {}
+        self.discrepancies: Dict[str, dict] = {}
+        self.jobs: Dict[str, dict] = {}
+        self.payloads: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def insert_document(self, document_info: dict) -> str:
+        return self._insert(self.documents, document_info)
+
+    def update_document(self, document_id, update_data: dict) -> bool:
+        return self._update(self.documents, document_id, update_data)
+
+    def delete_document(self, document_id) -> bool:
+        return self._delete(self.documents, document_id)
+
+    def insert_discrepancy(self, discrepancy: dict) -> str:
+        return self._insert(self.discrepancies, discrepancy)
+
+    def insert_discrepancies(self, discrepancies: List[dict]):
+        for discrepancy in discrepancies:
+            self._insert(self.discrepancies, discrepancy)
+
+    def update_discrepancy(self, discrepancy_id, update_data: dict) -> bool:
+        return self._update(self.discrepancies, discrepancy_id, update_data)
+
+    def delete_discrepancy(self, discrepancy_id) -> bool:
+        return self._delete(self.discrepancies, discrepancy_id)
+
+    def insert_payloads(self, blobs: Dict[str, bytes]):
+        with self._lock:
+            for digest, data in blobs.items():
+                if digest not in self.payloads:
+                    self.payloads[digest] = payloads.compress(data)
+
+    def get_payload(self, digest: str) -> Any:
+        data = self.payloads.get(digest)
+        return payloads.decompress(data) if data is not None else None
+
+    def enqueue_jobs(self, paths: List[str], versions: Optional[List[str]] = None) -> int:
+        added = 0
+        with self._lock:
+            for path, version in zip(paths, versions or [None] * len(paths)):
+                job = self.jobs.get(path)
+                if job is not None and job["version"] is None:
+                    job["version"] = version
+                elif job is None or version not in (None, job["version"]):
+                    self.jobs[path] = {"_id": path, "path": path, "status": JOB_QUEUED, "worker": None,
+                                       "lease_expires": 0.0, "attempts": 0, "version": version}
+                    added += 1
+        return added
+
+    def claim_jobs(self, worker_id: str, count: int, lease_seconds: float) -> List[dict]:
+        now = time.time()
+        claimed = []
+        with self._lock:
+            for job in self.jobs.values():
+                if len(claimed) == count:
+                    break
+                if job["status"] == JOB_QUEUED or (job["status"] == JOB_LEASED and job["lease_expires"] < now):
+                    job.update(status=JOB_LEASED, worker=worker_id, lease_expires=now + lease_seconds,
+                               attempts=job["attempts"] + 1)
+                    claimed.append({"_id": job["_id"], "path": job["path"], "attempts": job["attempts"]})
+        return claimed
+
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease_seconds: float) -> int:
+        with self._lock:
+            jobs = self._leased_jobs(worker_id, job_ids)
+            for job in jobs:
+                job["lease_expires"] = time.time() + lease_seconds
+        return len(jobs)
+
+    def release_jobs(self, worker_id: str, job_ids: List[str], status: str = JOB_DONE) -> int:
+        with self._lock:
+            jobs = self._leased_jobs(worker_id, job_ids)
+            for job in jobs:
+                job["status"] = status
+        return len(jobs)
+
+    def job_counts(self) -> Dict[str, int]:
+        now = time.time()
+        counts = {}
+        with self._lock:
+            for job in self.jobs.values():
+                status = JOB_QUEUED if job["status"] == JOB_LEASED and job["lease_expires"] < now else job["status"]
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def delete_document_discrepancies(self, document_id):
+        with self._lock:
+            for discrepancy_id in [discrepancy_id for discrepancy_id, discrepancy in self.discrepancies.items()
+                                   if discrepancy.get("document_id") == document_id]:
+                del self.discrepancies[discrepancy_id]
+
+    def status_counts(self, template: str = None, since: datetime = None, until: datetime = None) -> Dict[str, int]:
+        return dict(Counter(document.get("status") for document in
+                            self._select(self.documents, {"template": template}, since, until)))
+
+    def find_documents(self, status: str = None, template: str = None, name: str = None, since: datetime = None,
+                       until: datetime = None, limit: int = REPORT_LIMIT) -> List[dict]:
+        documents = self._select(self.documents, {"status": status, "template": template, "name": name}, since, until)
+        documents.sort(key=lambda document: db_handlers.timestamp(document.get("processed_at")) or 0, reverse=True)
+        return documents[:limit]
+
+    def document_discrepancies(self, document_id) -> List[dict]:
+        return self._select(self.discrepancies, {"document_id": document_id})
+
+    def discrepancy_counts(self, template: str = None, since: datetime = None, until: datetime = None,
+                           limit: int = REPORT_LIMIT) -> List[Tuple[str, int]]:
+        return Counter(discrepancy.get("discrepancy_type") for discrepancy in
+                       self._select(self.discrepancies, {"template": template}, since, until)).most_common(limit)
+
+    def _select(self, records: Dict[str, dict], criteria: dict, since: datetime = None,
+                until: datetime = None) -> List[dict]:
+        criteria = {key: value for key, value in criteria.items() if value is not None}
+        since, until = db_handlers.timestamp(since), db_handlers.timestamp(until)
+        with self._lock:
+            selected = [record for record in records.values()
+                        if all(record.get(key) == value for key, value in criteria.items())]
+        if since is None and until is None:
+            return selected
+        return [record for record in selected if self._in_window(record.get("processed_at"), since, until)]
+
+    @staticmethod
+    def _in_window(processed_at: datetime, since: float, until: float) -> bool:
+        processed_at = db_handlers.timestamp(processed_at)
+        return (processed_at is not None and (since is None or processed_at >= since) and
+                (until is None or processed_at < until))
+
+    def _leased_jobs(self, worker_id: str, job_ids: List[str]) -> List[dict]:
+        jobs = (self.jobs.get(job_id) for job_id in job_ids)
+        return [job for job in jobs if job and job["status"] == JOB_LEASED and job["worker"] == worker_id]
+
+    def _insert(self, records: Dict[str, dict], record: dict) -> str:
+        record_id = record.get("_id") or uuid.uuid4().hex
+        with self._lock:
+            records[record_id] = {**record, "_id": record_id}
+        return record_id
+
+    def _update(self, records: Dict[str, dict], record_id, update_data: dict) -> bool:
+        with self._lock:
+            if record_id not in records:
+                return False
+            records[record_id].update(update_data)
+            return True
+
+    def _delete(self, records: Dict[str, dict], record_id) -> bool:
+        with self._lock:
+            return records.pop(record_id, None) is not None
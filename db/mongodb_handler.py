@@ -1,10 +1,21 @@
+from datetime import datetime
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, ReturnDocument, UpdateOne
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from common import FatalError
-from db import db_handlers
+from db import db_handlers, payloads
+from db.db_handlers import JOB_DONE, JOB_LEASED, JOB_QUEUED, REPORT_LIMIT
+import metrics
+
+DUPLICATE_KEY = 11000  # The error code of the inserts of an existing _id
 
 
 class MongoDbHandler(db_handlers.AbstractDatabaseHandler):
@@ -14,23 +25,261 @@ class MongoDbHandler(db_handlers.AbstractDatabaseHandler):
             self._db: Database = self._client[config.get("name", "document_validation")]
             self._documents: Collection = self._db[config.get("documents_table", "documents")]
             self._discrepancies: Collection = self._db[config.get("discrepancies_table", "discrepancies")]
+            self._jobs: Collection = self._db[config.get("jobs_table", "jobs")]
+            self._payloads: Collection = self._db[config.get("payloads_table", "payloads")]
+            self._create_indexes()
         except Exception as e:
             raise FatalError from e
 
+        # Records are buffered and written with insert_many when batch_size > 1
+        self._batch_size: int = config.get("batch_size", 1)
+        self._flush_interval: float = config.get("flush_interval", 5.0)
+        self._pending_documents: List[dict] = []
+        self._pending_discrepancies: List[dict] = []
+        self._pending_payloads: Dict[str, bytes] = {}
+        self._pending_deletions: List[Any] = []  # The documents whose former discrepancies are deleted
+        self._last_flush: float = time.monotonic()
+        self._lock = threading.RLock()
+
     def insert_document(self, document_info: dict) -> ObjectId:
-        return self._documents.insert_one(document_info).inserted_id
+        if self._batch_size <= 1:
+            try:
+                with metrics.registry.timer("db_write_seconds", handler="mongodb"):
+                    return self._documents.insert_one(document_info).inserted_id
+            except DuplicateKeyError:
+                # A document with a given ID that is already recorded, e.g. its job was processed again
+                logging.debug(f"The document {document_info['_id']} is already recorded, replacing it")
+                self._documents.replace_one({"_id": document_info["_id"]}, document_info)
+                return document_info["_id"]
+
+        # The ID is generated client-side, so discrepancies can refer to a document that is not written yet
+        document_info = {"_id": ObjectId(), **document_info}
+        self._buffer(documents=[document_info])
+        return document_info["_id"]
 
     def insert_discrepancy(self, discrepancy: dict) -> ObjectId:
-        return self._discrepancies.insert_one(discrepancy).inserted_id
+        if self._batch_size <= 1:
+            with metrics.registry.timer("db_write_seconds", handler="mongodb"):
+                return self._discrepancies.insert_one(discrepancy).inserted_id
+
+        discrepancy = {"_id": ObjectId(), **discrepancy}
+        self._buffer(discrepancies=[discrepancy])
+        return discrepancy["_id"]
+
+    def insert_discrepancies(self, discrepancies: List[dict]):
+        if not discrepancies:
+            return
+        if self._batch_size <= 1:
+            try:
+                with metrics.registry.timer("db_write_seconds", handler="mongodb"):
+                    self._discrepancies.insert_many(discrepancies, ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                    raise
+                self._replace_duplicates(self._discrepancies, e)
+            return
+
+        self._buffer(discrepancies=[{"_id": ObjectId(), **d} for d in discrepancies])
+
+    def update_document(self, document_id, update_data: dict) -> bool:
+        self.flush()
+        return self._documents.update_one({"_id": document_id}, {"$set": update_data}).matched_count > 0
+
+    def update_discrepancy(self, discrepancy_id, update_data: dict) -> bool:
+        self.flush()
+        return self._discrepancies.update_one({"_id": discrepancy_id}, {"$set": update_data}).matched_count > 0
+
+    def delete_document(self, document_id) -> bool:
+        self.flush()
+        return self._documents.delete_one({"_id": document_id}).deleted_count > 0
+
+    def delete_discrepancy(self, discrepancy_id) -> bool:
+        self.flush()
+        return self._discrepancies.delete_one({"_id": discrepancy_id}).deleted_count > 0
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            # Payloads and documents go first so that records never refer to a missing payload or document. The
+            # records stay pending until all of them are written: a failed flush raises, the next one writes them
+            # again (the ones written already are replaced)
+            self._insert_payloads(self._pending_payloads)
+            self._insert_many(self._documents, self._pending_documents, replace=True)
+            if self._pending_deletions:
+                self._discrepancies.delete_many({"document_id": {"$in": self._pending_deletions}})
+            self._insert_many(self._discrepancies, self._pending_discrepancies, replace=True)
+            self._pending_documents = []
+            self._pending_discrepancies = []
+            self._pending_payloads = {}
+            self._pending_deletions = []
+
+    def close(self):
+        self.flush()
+        self._client.close()
+
+    def insert_payloads(self, blobs: Dict[str, bytes]):
+        if self._batch_size <= 1:
+            self._insert_payloads(blobs)
+            return
+        with self._lock:
+            self._pending_payloads.update(blobs)
+
+    def get_payload(self, digest: str) -> Any:
+        self.flush()
+        payload = self._payloads.find_one({"_id": digest}, {"data": True})
+        return payloads.decompress(payload["data"]) if payload else None
 
-    def update_document(self, document_id, update_data):
-        pass
+    def enqueue_jobs(self, paths: List[str], versions: Optional[List[str]] = None) -> int:
+        if not paths:
+            return 0
+        self._jobs.create_index([("status", ASCENDING), ("lease_expires", ASCENDING)])
+        jobs = [{"_id": path, "path": path, "status": JOB_QUEUED, "worker": None, "lease_expires": 0.0, "attempts": 0,
+                 "version": version} for path, version in zip(paths, versions or [None] * len(paths))]
+        try:
+            return len(self._jobs.insert_many(jobs, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+            added = e.details.get("nInserted", 0)
+            queued = [error["op"] for error in e.details["writeErrors"] if error["op"]["version"] is not None]
+        # The other paths were queued already, their jobs are queued again if their document changed since. The jobs
+        # queued before the versions were recorded take the version of their document as it is
+        if queued:
+            self._jobs.bulk_write([UpdateOne({"_id": job["_id"], "version": None}, {"$set": {"version": job["version"]}})
+                                   for job in queued], ordered=False)
+            added += self._jobs.bulk_write(
+                [UpdateOne({"_id": job.pop("_id"), "version": {"$ne": job["version"]}}, {"$set": job})
+                 for job in queued], ordered=False).modified_count
+        return added
+
+    def claim_jobs(self, worker_id: str, count: int, lease_seconds: float) -> List[dict]:
+        now = time.time()
+        claimed = []
+        # One atomic update per job, the workers racing for a job get different ones
+        for _ in range(count):
+            job = self._jobs.find_one_and_update(
+                {"$or": [{"status": JOB_QUEUED}, {"status": JOB_LEASED, "lease_expires": {"$lt": now}}]},
+                {"$set": {"status": JOB_LEASED, "worker": worker_id, "lease_expires": now + lease_seconds},
+                 "$inc": {"attempts": 1}},
+                projection={"path": True, "attempts": True}, return_document=ReturnDocument.AFTER)
+            if job is None:
+                break
+            claimed.append(job)
+        return claimed
+
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease_seconds: float) -> int:
+        return self._update_leased_jobs(worker_id, job_ids, {"lease_expires": time.time() + lease_seconds})
+
+    def release_jobs(self, worker_id: str, job_ids: List[str], status: str = JOB_DONE) -> int:
+        return self._update_leased_jobs(worker_id, job_ids, {"status": status})
+
+    def job_counts(self) -> Dict[str, int]:
+        counts = {group["_id"]: group["count"]
+                  for group in self._jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])}
+        expired = self._jobs.count_documents({"status": JOB_LEASED, "lease_expires": {"$lt": time.time()}})
+        if expired:
+            counts[JOB_LEASED] -= expired
+            counts[JOB_QUEUED] = counts.get(JOB_QUEUED, 0) + expired
+        return counts
+
+    def delete_document_discrepancies(self, document_id):
+        if self._batch_size <= 1:
+            self._discrepancies.delete_many({"document_id": document_id})
+            return
+        with self._lock:
+            # The discrepancies buffered before are the former ones too
+            self._pending_discrepancies = [discrepancy for discrepancy in self._pending_discrepancies
+                                           if discrepancy.get("document_id") != document_id]
+            self._pending_deletions.append(document_id)
+
+    def status_counts(self, template: str = None, since: datetime = None, until: datetime = None) -> Dict[str, int]:
+        self.flush()
+        return {group["_id"]: group["count"] for group in self._documents.aggregate([
+            {"$match": self._filter({"template": template}, since, until)},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}])}
+
+    def find_documents(self, status: str = None, template: str = None, name: str = None, since: datetime = None,
+                       until: datetime = None, limit: int = REPORT_LIMIT) -> List[dict]:
+        self.flush()
+        return list(self._documents.find(self._filter({"status": status, "template": template, "name": name},
+                                                      since, until)).sort("processed_at", DESCENDING).limit(limit))
 
-    def update_discrepancy(self, document_id, update_data):
-        pass
+    def document_discrepancies(self, document_id) -> List[dict]:
+        self.flush()
+        return list(self._discrepancies.find({"document_id": document_id}))
 
-    def delete_document(self, document_id):
-        pass
+    def discrepancy_counts(self, template: str = None, since: datetime = None, until: datetime = None,
+                           limit: int = REPORT_LIMIT) -> List[Tuple[str, int]]:
+        self.flush()
+        return [(group["_id"], group["count"]) for group in self._discrepancies.aggregate([
+            {"$match": self._filter({"template": template}, since, until)},
+            {"$group": {"_id": "$discrepancy_type", "count": {"$sum": 1}}},
+            {"$sort": {"count": DESCENDING}}, {"$limit": limit}])]
+
+    def _create_indexes(self):
+        # Idempotent, every process creating the handler ensures them
+        self._documents.create_index([("name", ASCENDING)])
+        self._documents.create_index([("status", ASCENDING), ("processed_at", DESCENDING)])
+        self._documents.create_index([("template", ASCENDING), ("status", ASCENDING), ("processed_at", DESCENDING)])
+        self._documents.create_index([("processed_at", DESCENDING)])
+        self._discrepancies.create_index([("document_id", ASCENDING)])
+        # The type completes the indexes, the counts per type are computed from the index entries only
+        self._discrepancies.create_index([("processed_at", DESCENDING), ("discrepancy_type", ASCENDING)])
+        self._discrepancies.create_index([("template", ASCENDING), ("processed_at", DESCENDING),
+                                          ("discrepancy_type", ASCENDING)])
+
+    @staticmethod
+    def _filter(criteria: dict, since: datetime, until: datetime) -> dict:
+        query = {field: value for field, value in criteria.items() if value is not None}
+        window = {operator: value for operator, value in (("$gte", since), ("$lt", until)) if value is not None}
+        if window:
+            query["processed_at"] = window
+        return query
+
+    def _update_leased_jobs(self, worker_id: str, job_ids: List[str], update: dict) -> int:
+        if not job_ids:
+            return 0
+        return self._jobs.update_many({"_id": {"$in": list(job_ids)}, "status": JOB_LEASED, "worker": worker_id},
+                                      {"$set": update}).matched_count
+
+    def _buffer(self, documents: List[dict] = (), discrepancies: List[dict] = ()):
+        with self._lock:
+            # The pending lists are looked up under the lock, a flush in another thread replaces them
+            self._pending_documents.extend(documents)
+            self._pending_discrepancies.extend(discrepancies)
+            if (len(self._pending_documents) + len(self._pending_discrepancies) >= self._batch_size or
+                    time.monotonic() - self._last_flush >= self._flush_interval):
+                self.flush()
+
+    def _insert_payloads(self, blobs: Dict[str, bytes]):
+        if not blobs:
+            return
+        # The payloads already stored are neither compressed nor sent again
+        stored = {payload["_id"] for payload in self._payloads.find({"_id": {"$in": list(blobs)}}, {"_id": True})}
+        self._insert_many(self._payloads, [{"_id": digest, "data": payloads.compress(data)}
+                                           for digest, data in blobs.items() if digest not in stored])
+
+    @classmethod
+    def _insert_many(cls, collection: Collection, records: List[dict], replace: bool = False):
+        if not records:
+            return
+        try:
+            with metrics.registry.timer("db_write_seconds", handler="mongodb"):
+                collection.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            # Unordered inserts write all the valid records. The duplicate keys are records with a given ID already
+            # written, e.g. the documents of a job processed again (replaced) or the payloads stored meanwhile by
+            # another process (the same); the other errors are raised, the caller keeps the records
+            if replace:
+                cls._replace_duplicates(collection, e)
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+            if errors:
+                logging.error(f"Failed to write {len(errors)} of {len(records)} record(s) to {collection.name}: {e}")
+                raise
 
-    def delete_discrepancy(self, discrepancy_id):
-        pass
+    @staticmethod
+    def _replace_duplicates(collection: Collection, error: BulkWriteError):
+        duplicates = [ReplaceOne({"_id": write_error["op"]["_id"]}, write_error["op"])
+                      for write_error in error.details.get("writeErrors", []) if write_error.get("code") == DUPLICATE_KEY]
+        if duplicates:
+            collection.bulk_write(duplicates, ordered=False)
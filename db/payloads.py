@@ -0,0 +1,48 @@
+import hashlib
+import json
+from typing import Any, Dict, Tuple
+import zlib
+
+# The storage layouts of the saved fields, chosen per field by the templates (Template.field_layouts):
+#  text  - structured values (e.g. a table body) as their str(), the former format; scalars as they are
+#  array - structured values as nested arrays
+#  blob  - the zlib-compressed JSON of the value in the payload store, keyed by the SHA-256 of the JSON so that
+#          identical values (e.g. the body of a document submitted again) are stored, and compressed, once. The record
+#          keeps a reference to it
+TEXT = "text"
+ARRAY = "array"
+BLOB = "blob"
+LAYOUTS = (TEXT, ARRAY, BLOB)
+
+# The fastest level, the higher ones compress tables a few percent better for several times the time
+COMPRESSION_LEVEL = 1
+
+
+def encode_fields(field_values: dict, layouts: Dict[str, str]) -> Tuple[dict, Dict[str, bytes]]:
+    """The field values to store in the record, and the payloads (digest -> JSON) of the blob fields."""
+    record = {}
+    blobs = {}
+    for name, value in field_values.items():
+        layout = layouts.get(name, TEXT)
+        if layout == BLOB and value is not None:
+            data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+            digest = hashlib.sha256(data).hexdigest()
+            blobs[digest] = data
+            record[name] = {"payload": digest, "size": len(data)}
+        elif isinstance(value, (list, tuple)):
+            record[name] = list(value) if layout == ARRAY else str(value)
+        else:
+            record[name] = value
+    return record, blobs
+
+
+def is_reference(value: Any) -> bool:
+    return isinstance(value, dict) and "payload" in value and len(value) == 2 and "size" in value
+
+
+def compress(data: bytes) -> bytes:
+    return zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decompress(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data))
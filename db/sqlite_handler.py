@@ -0,0 +1,317 @@
+from datetime import datetime, timezone
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
+
+from common import FatalError
+from db import db_handlers, payloads
+from db.db_handlers import JOB_DONE, JOB_LEASED, JOB_QUEUED, REPORT_LIMIT
+import metrics
+
+# The fields stored in their own columns (besides id and data), for the lookups and the reporting queries
+DOCUMENT_COLUMNS = ("name", "template", "status", "processed_at")
+DISCREPANCY_COLUMNS = ("document_id", "discrepancy_type", "template", "processed_at")
+
+
+class SQLiteDbHandler(db_handlers.AbstractDatabaseHandler):
+    """Embedded SQLite database in WAL mode, the inserts are buffered and written in batched transactions.
+
+    The records are stored as JSON, with the fields used for lookups and reports (DOCUMENT_COLUMNS and
+    DISCREPANCY_COLUMNS) in their own indexed columns, processed_at as seconds since the epoch. The payloads of the
+    blob fields are in their own table. The job queue is a table too, claimed in immediate transactions so that
+    the workers sharing the database file never claim the same job.
+    """
+
+    def __init__(self, config: dict):
+        self._documents_table: str = config.get("documents_table", "documents")
+        self._discrepancies_table: str = config.get("discrepancies_table", "discrepancies")
+        self._jobs_table: str = config.get("jobs_table", "jobs")
+        self._payloads_table: str = config.get("payloads_table", "payloads")
+        self._batch_size: int = config.get("batch_size", 1000)
+        self._flush_interval: float = config.get("flush_interval", 5.0)
+        try:
+            self._connection = sqlite3.connect(config.get("path", "document_validation.db"), timeout=60,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_table(self._documents_table, DOCUMENT_COLUMNS,
+                               ("name", "status, processed_at", "template, status, processed_at", "processed_at"))
+            self._create_table(self._discrepancies_table, DISCREPANCY_COLUMNS,
+                               ("document_id", "processed_at, discrepancy_type",
+                                "template, processed_at, discrepancy_type"))
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._payloads_table} (id TEXT PRIMARY KEY, data BLOB)")
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._jobs_table} "
+                f"(id TEXT PRIMARY KEY, status TEXT, worker TEXT, lease_expires REAL, attempts INTEGER, version TEXT)")
+            if "version" not in {row[1] for row in
+                                 self._connection.execute(f"PRAGMA table_info({self._jobs_table})").fetchall()}:
+                # A queue created before the versions of the documents were recorded
+                self._connection.execute(f"ALTER TABLE {self._jobs_table} ADD COLUMN version TEXT")
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self._jobs_table}_status ON {self._jobs_table} (status, lease_expires)")
+            self._connection.commit()
+        except sqlite3.Error as e:
+            raise FatalError from e
+
+        self._pending_documents: List[tuple] = []
+        self._pending_discrepancies: List[tuple] = []
+        self._pending_payloads: Dict[str, bytes] = {}
+        self._pending_deletions: List[str] = []  # The documents whose former discrepancies are deleted
+        self._last_flush: float = time.monotonic()
+        self._lock = threading.RLock()
+
+    def insert_document(self, document_info: dict) -> str:
+        document_info = {**document_info, "_id": document_info.get("_id") or uuid.uuid4().hex}
+        self._buffer(documents=[self._row(document_info, DOCUMENT_COLUMNS)])
+        return document_info["_id"]
+
+    def update_document(self, document_id, update_data: dict) -> bool:
+        return self._update(self._documents_table, document_id, update_data, DOCUMENT_COLUMNS)
+
+    def delete_document(self, document_id) -> bool:
+        return self._delete(self._documents_table, document_id)
+
+    def insert_discrepancy(self, discrepancy: dict) -> str:
+        return self._discrepancy_ids([discrepancy])[0]
+
+    def insert_discrepancies(self, discrepancies: List[dict]):
+        self._discrepancy_ids(discrepancies)
+
+    def update_discrepancy(self, discrepancy_id, update_data: dict) -> bool:
+        return self._update(self._discrepancies_table, discrepancy_id, update_data, DISCREPANCY_COLUMNS)
+
+    def delete_discrepancy(self, discrepancy_id) -> bool:
+        return self._delete(self._discrepancies_table, discrepancy_id)
+
+    def get_document(self, document_id) -> dict:
+        return self._get(self._documents_table, document_id)
+
+    def get_discrepancy(self, discrepancy_id) -> dict:
+        return self._get(self._discrepancies_table, discrepancy_id)
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if (not self._pending_documents and not self._pending_discrepancies and not self._pending_payloads and
+                    not self._pending_deletions):
+                return
+            # Looked up (and compressed) before the transaction: a read inside it would take a shared lock, which
+            # can't be upgraded once another process committed, the inserts would fail with "database is locked"
+            new_payloads = self._new_payloads()
+            # One transaction per batch, the payloads and documents first, the former discrepancies before the new
+            with metrics.registry.timer("db_write_seconds", handler="sqlite"), self._connection:
+                if self._pending_deletions:
+                    self._connection.executemany(f"DELETE FROM {self._discrepancies_table} WHERE document_id = ?",
+                                                 ((document_id,) for document_id in self._pending_deletions))
+                self._connection.executemany(f"INSERT OR IGNORE INTO {self._payloads_table} VALUES (?, ?)",
+                                             new_payloads)
+                self._connection.executemany(self._insert_statement(self._documents_table, DOCUMENT_COLUMNS),
+                                             self._pending_documents)
+                self._connection.executemany(self._insert_statement(self._discrepancies_table, DISCREPANCY_COLUMNS),
+                                             self._pending_discrepancies)
+            self._pending_documents = []
+            self._pending_discrepancies = []
+            self._pending_payloads = {}
+            self._pending_deletions = []
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def insert_payloads(self, blobs: Dict[str, bytes]):
+        with self._lock:
+            self._pending_payloads.update(blobs)
+
+    def get_payload(self, digest: str) -> Any:
+        with self._lock:
+            self.flush()
+            row = self._connection.execute(f"SELECT data FROM {self._payloads_table} WHERE id = ?",
+                                           (digest,)).fetchone()
+        return payloads.decompress(row[0]) if row else None
+
+    def enqueue_jobs(self, paths: List[str], versions: Optional[List[str]] = None) -> int:
+        jobs = list(zip(paths, versions or [None] * len(paths)))
+        with self._lock, self._connection:
+            # The jobs queued before the versions were recorded take the version of their document as it is
+            self._connection.executemany(f"UPDATE {self._jobs_table} SET version = ? WHERE id = ? AND version IS NULL",
+                                         ((version, path) for path, version in jobs if version is not None))
+            return self._connection.executemany(
+                f"INSERT INTO {self._jobs_table} (id, status, worker, lease_expires, attempts, version) "
+                f"VALUES (?, '{JOB_QUEUED}', NULL, 0, 0, ?) ON CONFLICT (id) DO UPDATE SET status = '{JOB_QUEUED}', "
+                f"worker = NULL, lease_expires = 0, attempts = 0, version = excluded.version "
+                f"WHERE excluded.version IS NOT NULL AND version IS NOT excluded.version", jobs).rowcount
+
+    def claim_jobs(self, worker_id: str, count: int, lease_seconds: float) -> List[dict]:
+        now = time.time()
+        with self._lock, self._connection:
+            # Takes the write lock before reading, the claims of the other connections wait for the commit
+            self._connection.execute("BEGIN IMMEDIATE")
+            rows = self._connection.execute(
+                f"SELECT id, attempts FROM {self._jobs_table} WHERE status = '{JOB_QUEUED}' "
+                f"OR (status = '{JOB_LEASED}' AND lease_expires < ?) LIMIT ?", (now, count)).fetchall()
+            self._connection.executemany(
+                f"UPDATE {self._jobs_table} SET status = '{JOB_LEASED}', worker = ?, lease_expires = ?, "
+                f"attempts = attempts + 1 WHERE id = ?", ((worker_id, now + lease_seconds, job_id) for job_id, _ in rows))
+        return [{"_id": job_id, "path": job_id, "attempts": attempts + 1} for job_id, attempts in rows]
+
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease_seconds: float) -> int:
+        return self._update_leased_jobs(worker_id, job_ids, "lease_expires = ?", time.time() + lease_seconds)
+
+    def release_jobs(self, worker_id: str, job_ids: List[str], status: str = JOB_DONE) -> int:
+        return self._update_leased_jobs(worker_id, job_ids, "status = ?", status)
+
+    def job_counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT CASE WHEN status = '{JOB_LEASED}' AND lease_expires < ? THEN '{JOB_QUEUED}' ELSE status END "
+                f"AS job_status, COUNT(*) FROM {self._jobs_table} GROUP BY job_status", (time.time(),)).fetchall()
+        return dict(rows)
+
+    def delete_document_discrepancies(self, document_id):
+        document_id = self._encode_id(document_id)
+        with self._lock:
+            # The discrepancies buffered before are the former ones too
+            self._pending_discrepancies = [row for row in self._pending_discrepancies if row[1] != document_id]
+            self._pending_deletions.append(document_id)
+
+    def status_counts(self, template: str = None, since: datetime = None, until: datetime = None) -> Dict[str, int]:
+        where, params = self._where({"template": template}, since, until)
+        return dict(self._query(f"SELECT status, COUNT(*) FROM {self._documents_table}{where} GROUP BY status", params))
+
+    def find_documents(self, status: str = None, template: str = None, name: str = None, since: datetime = None,
+                       until: datetime = None, limit: int = REPORT_LIMIT) -> List[dict]:
+        where, params = self._where({"status": status, "template": template, "name": name}, since, until)
+        return self._records(self._query(f"SELECT data, processed_at FROM {self._documents_table}{where} "
+                                         f"ORDER BY processed_at DESC LIMIT ?", (*params, limit)))
+
+    def document_discrepancies(self, document_id) -> List[dict]:
+        return self._records(self._query(f"SELECT data, processed_at FROM {self._discrepancies_table} "
+                                         f"WHERE document_id = ?", (self._encode_id(document_id),)))
+
+    def discrepancy_counts(self, template: str = None, since: datetime = None, until: datetime = None,
+                           limit: int = REPORT_LIMIT) -> List[Tuple[str, int]]:
+        where, params = self._where({"template": template}, since, until)
+        return self._query(f"SELECT discrepancy_type, COUNT(*) AS count FROM {self._discrepancies_table}{where} "
+                           f"GROUP BY discrepancy_type ORDER BY count DESC LIMIT ?", (*params, limit))
+
+    def _new_payloads(self) -> List[tuple]:
+        # Only the payloads not stored yet are compressed
+        digests = list(self._pending_payloads)
+        stored = set()
+        for i in range(0, len(digests), 500):
+            chunk = digests[i:i + 500]
+            stored.update(row[0] for row in self._connection.execute(
+                f"SELECT id FROM {self._payloads_table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+        return [(digest, payloads.compress(data)) for digest, data in self._pending_payloads.items()
+                if digest not in stored]
+
+    def _create_table(self, table: str, columns: tuple, indexes: tuple):
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                 f"(id TEXT PRIMARY KEY, {', '.join(columns)}, data TEXT)")
+        # The databases written by the former versions lack the newer columns
+        existing = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+        for column in columns:
+            if column not in existing:
+                self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+        for index in indexes:
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{index.replace(', ', '_')} "
+                                     f"ON {table} ({index})")
+
+    @staticmethod
+    def _insert_statement(table: str, columns: tuple) -> str:
+        return f"INSERT OR REPLACE INTO {table} (id, {', '.join(columns)}, data) VALUES (?, {'?, ' * len(columns)}?)"
+
+    def _where(self, criteria: dict, since: datetime, until: datetime) -> Tuple[str, tuple]:
+        conditions = [(f"{column} = ?", self._encode_id(value)) for column, value in criteria.items()
+                      if value is not None]
+        if since is not None:
+            conditions.append(("processed_at >= ?", db_handlers.timestamp(since)))
+        if until is not None:
+            conditions.append(("processed_at < ?", db_handlers.timestamp(until)))
+        if not conditions:
+            return "", ()
+        return " WHERE " + " AND ".join(condition for condition, _ in conditions), tuple(p for _, p in conditions)
+
+    def _query(self, statement: str, params: tuple) -> List[tuple]:
+        with self._lock:
+            self.flush()
+            return self._connection.execute(statement, params).fetchall()
+
+    @staticmethod
+    def _records(rows: List[tuple]) -> List[dict]:
+        records = []
+        for data, processed_at in rows:
+            record = json.loads(data)
+            if processed_at is not None:
+                record["processed_at"] = datetime.fromtimestamp(processed_at, timezone.utc)
+            records.append(record)
+        return records
+
+    def _update_leased_jobs(self, worker_id: str, job_ids: List[str], assignment: str, value) -> int:
+        with self._lock, self._connection:
+            return self._connection.executemany(
+                f"UPDATE {self._jobs_table} SET {assignment} WHERE id = ? AND status = '{JOB_LEASED}' AND worker = ?",
+                ((value, job_id, worker_id) for job_id in job_ids)).rowcount
+
+    def _discrepancy_ids(self, discrepancies: List[dict]) -> List[str]:
+        rows = [self._row({**discrepancy, "_id": discrepancy.get("_id") or uuid.uuid4().hex}, DISCREPANCY_COLUMNS)
+                for discrepancy in discrepancies]
+        self._buffer(discrepancies=rows)
+        return [row[0] for row in rows]
+
+    def _buffer(self, documents: List[tuple] = (), discrepancies: List[tuple] = ()):
+        with self._lock:
+            # The pending lists are looked up under the lock, a flush in another thread replaces them
+            self._pending_documents.extend(documents)
+            self._pending_discrepancies.extend(discrepancies)
+            if (len(self._pending_documents) + len(self._pending_discrepancies) >= self._batch_size or
+                    time.monotonic() - self._last_flush >= self._flush_interval):
+                self.flush()
+
+    def _get(self, table: str, record_id):
+        with self._lock:
+            self.flush()
+            row = self._connection.execute(f"SELECT data FROM {table} WHERE id = ?", (record_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _update(self, table: str, record_id, update_data: dict, columns: tuple) -> bool:
+        with self._lock:
+            record = self._get(table, record_id)
+            if record is None:
+                return False
+            record.update(update_data)
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            with self._connection:
+                self._connection.execute(f"UPDATE {table} SET {assignments}, data = ? WHERE id = ?",
+                                         (*self._row(record, columns)[1:], record_id))
+            return True
+
+    def _delete(self, table: str, record_id) -> bool:
+        with self._lock:
+            self.flush()
+            with self._connection:
+                return self._connection.execute(f"DELETE FROM {table} WHERE id = ?", (record_id,)).rowcount > 0
+
+    @classmethod
+    def _row(cls, record: dict, columns: tuple) -> tuple:
+        values = []
+        for column in columns:
+            value = record.get(column)
+            if column == "processed_at":
+                # A string once the record went through JSON (e.g. updated records)
+                values.append(db_handlers.timestamp(datetime.fromisoformat(value) if isinstance(value, str) else value))
+            else:
+                values.append(cls._encode_id(value))
+        return (record["_id"], *values, cls._encode(record))
+
+    @staticmethod
+    def _encode(record: dict) -> str:
+        return json.dumps(record, default=str, separators=(",", ":"))
+
+    @staticmethod
+    def _encode_id(value):
+        return value if value is None or isinstance(value, (str, int, float)) else str(value)
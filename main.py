@@ -1,86 +1,445 @@
 import argparse
+from contextlib import contextmanager
 import logging
+import multiprocessing
+import os
 from pathlib import Path
+import queue
+import signal
 import sys
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Tuple
 
 import common
-from datetime import datetime
-from validation.doc_validator import DocumentValidator
-from templates import factory
-
-
-def setup_logging(logging_config: dict):
-    level = getattr(logging, logging_config.get("level", "INFO").upper(), logging.INFO)
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler(logging_config.get("file", "app.log"))
-        ]
-    )
-
-def parse_arguments(document_types: dict) -> dict:
-    parser = argparse.ArgumentParser(description="Document Validator Application")
+from db import db_handlers
+import metrics
+from processing import job_queue, profiler
+from processing.document_processor import (DocumentProcessor, ProcessingOutcome, init_pool_worker,
+                                           process_in_pool_worker)
+from processing.scanner import Scanner
 
-    parser.add_argument("document_folder", type=str, help="The path to the folder containing documents")
+# Command line arguments controlling the run, the other arguments are template parameters
+RUN_OPTIONS = ("workers", "manifest", "cache", "pipeline", "readers", "writers", "queue_size", "metrics",
+               "metrics_interval", "profile", "profile_dir", "watch", "poll_interval", "polling", "shard", "record_unmatched",
+               "enqueue", "queue_worker", "lease", "claim_batch", "max_attempts", "time_budget", "memory_budget")
+WATCH_TICK = 0.5  # Seconds between the checks for a shutdown request in the watch mode
+# The documents submitted to the worker pool and not processed yet, per worker. The submission waits beyond it, so
+# that a large folder or a burst of arrivals isn't queued in memory at once
+PENDING_PER_WORKER = 64
 
-    for doc_type, doc_config in document_types.items():
-        params_required = doc_config.get("params_required", [])
-        for param in params_required:
-            param_name = param["name"]
-            param_type = eval(param["type"])  # Convert string representation of type to actual type
-            param_help = param["help"]
 
+def add_template_arguments(parser: argparse.ArgumentParser, document_types: common.DocumentTypes):
+    for document_type in common.compile_document_types(document_types):
+        for param_name, param_type, param_help in document_type.params:
             # Add arguments to the parser
             parser.add_argument("--" + param_name, dest=param_name, type=param_type, help=param_help)
 
+def shard_argument(value: str) -> Tuple[int, int]:
+    # "i/n" (1 <= i <= n) on the command line, (i - 1, n) internally
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/n, e.g. 1/4")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', i must be between 1 and n")
+    return index - 1, count
+
+def parse_arguments(document_types: common.DocumentTypes) -> dict:
+    parser = argparse.ArgumentParser(description="Document Validator Application")
+
+    parser.add_argument("document_folder", type=str, nargs="?", default=None,
+                        help="The path to the folder containing documents (not used by --queue-worker)")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="The number of worker processes used to process documents (default: 1)")
+    parser.add_argument("--manifest", dest="manifest", type=str, default=None,
+                        help="Incremental mode: the path to the manifest file of the validated documents. "
+                             "Documents unchanged since their validation with the same parameters are skipped")
+    parser.add_argument("--cache", dest="cache", type=str, default=None,
+                        help="The path to the extraction cache file. The extracted field values are cached by "
+                             "content hash, so documents can be re-validated later without parsing them")
+    parser.add_argument("--pipeline", dest="pipeline", action="store_true",
+                        help="Asyncio pipeline mode: file reads, parsing (in --workers processes) and DB writes "
+                             "overlap each other")
+    parser.add_argument("--readers", dest="readers", type=int, default=4,
+                        help="Pipeline mode: the number of concurrent file reads (default: 4)")
+    parser.add_argument("--writers", dest="writers", type=int, default=2,
+                        help="Pipeline mode: the number of concurrent DB writes (default: 2)")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=64,
+                        help="Pipeline mode: the capacity of the queues between the stages (default: 64)")
+    parser.add_argument("--metrics", dest="metrics", type=str, default=None,
+                        help="The path of the metrics file (stage, rule and DB timings, document and discrepancy "
+                             "counts), JSON if it ends with .json, the Prometheus text format otherwise")
+    parser.add_argument("--metrics-interval", dest="metrics_interval", type=float, default=30,
+                        help="The interval in seconds the metrics file is updated at during the run (default: 30)")
+    parser.add_argument("--profile", dest="profile", type=int, default=0,
+                        help="Profile the documents and dump the cProfile data of the N slowest ones")
+    parser.add_argument("--profile-dir", dest="profile_dir", type=str, default="profiles",
+                        help="The folder of the profile files (default: profiles)")
+
+    parser.add_argument("--watch", dest="watch", action="store_true",
+                        help="Daemon mode: after the documents of the folder, process the new and changed ones as "
+                             "they arrive, until SIGINT or SIGTERM")
+    parser.add_argument("--poll-interval", dest="poll_interval", type=float, default=1.0,
+                        help="Watch mode: the interval in seconds the folder is polled at when inotify is not "
+                             "available (default: 1)")
+    parser.add_argument("--polling", dest="polling", action="store_true",
+                        help="Watch mode: poll the folder even if inotify is available (e.g. network file systems)")
+
+    parser.add_argument("--shard", dest="shard", type=shard_argument, default=None,
+                        help="Process the i-th of n disjoint shards of the folder, e.g. 2/4. The files are assigned "
+                             "to the shards by a stable hash of their relative path, so that n hosts can split a tree")
+    parser.add_argument("--record-unmatched", dest="record_unmatched", action="store_true",
+                        help="Save the files no document type matches with the ERROR status, instead of skipping them")
+    parser.add_argument("--time-budget", dest="time_budget", type=float, default=None,
+                        help="The wall-clock budget in seconds of the extraction of a document. The extractions then "
+                             "run in a supervised helper process per worker, a document over its budget is saved "
+                             "with the ERROR status and a time_budget_exceeded discrepancy")
+    parser.add_argument("--memory-budget", dest="memory_budget", type=float, default=None,
+                        help="The memory budget in MiB of the extraction of a document, like --time-budget (a "
+                             "memory_budget_exceeded discrepancy)")
+
+    parser.add_argument("--enqueue", dest="enqueue", action="store_true",
+                        help="Distributed mode, coordinator: add the documents of the folder to the job queue of the "
+                             "database, then exit. The documents are queued by absolute path, the workers must see "
+                             "the folder at the same path")
+    parser.add_argument("--queue-worker", dest="queue_worker", action="store_true",
+                        help="Distributed mode, worker: process the documents of the job queue in --workers "
+                             "processes until the queue is drained. Any number of hosts can share the queue")
+    parser.add_argument("--lease", dest="lease", type=float, default=300,
+                        help="Worker mode: the lease in seconds of the claimed jobs, the jobs of a worker that died "
+                             "are claimed again when their lease expires (default: 300)")
+    parser.add_argument("--claim-batch", dest="claim_batch", type=int, default=16,
+                        help="Worker mode: the number of jobs claimed at once (default: 16)")
+    parser.add_argument("--max-attempts", dest="max_attempts", type=int, default=3,
+                        help="Worker mode: the number of claims after which a job is given up as failed (default: 3)")
+
+    add_template_arguments(parser, document_types)
+
     # Parse arguments
     args = parser.parse_args()
+    if args.document_folder is None and not args.queue_worker:
+        parser.error("the document_folder argument is required")
+    if args.enqueue and args.queue_worker:
+        parser.error("--enqueue can't be combined with --queue-worker")
+    if (args.enqueue or args.queue_worker) and (args.pipeline or args.watch):
+        parser.error("--enqueue and --queue-worker can't be combined with --pipeline or --watch")
+    if args.pipeline and (args.manifest or args.cache):
+        parser.error("--pipeline can't be combined with --manifest or --cache")
+    if args.pipeline and args.watch:
+        parser.error("--pipeline can't be combined with --watch")
 
     # Convert parsed arguments to a dictionary
     parsed_args = vars(args)
     return parsed_args
 
 class Parser:
+    def __init__(self, document_types: common.DocumentTypes, db_config: dict, params: dict, logging_config: dict = None,
+                 options: dict = None):
+        self._document_types = document_types
+        self._db_config = db_config
+        self._params = params
+        self._logging_config = logging_config or {}
+        self._options = options or {}
+        self._workers = max(1, self._options.get("workers") or 1)
+        # The worker processes that failed to write their records, the run then fails
+        self.failed_workers: int = 0
+        # The jobs of the members of a compressed tar would each decompress the archive up to their member
+        self._scanner = Scanner(document_types, self._options.get("shard"),
+                                self._options.get("record_unmatched", False),
+                                compressed_tars=not self._options.get("enqueue"))
+
+    def parse(self, folder: str):
+        folder_path = self._check_folder(folder)
+
+        with self._instrumentation():
+            file_paths = metrics.timed_iter(self._scanner.scan(folder_path), "scan")
+
+            if self._options.get("pipeline"):
+                from processing.pipeline import AsyncPipeline  # Imported when used, asyncio is slow to import
+                outcomes = AsyncPipeline(self._document_types, self._db_config, self._params, self._logging_config,
+                                         readers=self._options.get("readers", 4), parsers=self._workers,
+                                         writers=self._options.get("writers", 2),
+                                         queue_size=self._options.get("queue_size", 64),
+                                         options=self._options).run(file_paths)
+            else:
+                outcomes = {outcome: 0 for outcome in ProcessingOutcome}
+                for outcome in self._process(file_paths):
+                    outcomes[outcome] += 1
+
+        self._log_outcomes(outcomes)
+
+    def watch(self, folder: str):
+        """Daemon mode: processes the documents of the folder, then the new and changed ones as they arrive.
+
+        The templates and the DB connections stay warm between the documents. On SIGINT or SIGTERM the changes
+        already detected are processed and the buffered DB writes are flushed before exiting.
+        """
+        from processing.watcher import create_watcher  # Imported when used, like the pipeline
+        folder_path = self._check_folder(folder)
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        outcomes = {outcome: 0 for outcome in ProcessingOutcome}
+        outcomes_lock = threading.Lock()
+
+        def count(outcome: ProcessingOutcome):
+            with outcomes_lock:
+                outcomes[outcome] += 1
+
+        # Watching starts before the folder is scanned, so that no document arriving meanwhile is missed
+        with self._instrumentation(), \
+                create_watcher(folder_path, self._options.get("poll_interval") or 1.0,
+                               self._options.get("polling", False)) as watcher, \
+                self._watch_processing(count) as (submit, on_idle):
+            logging.info(f"Watching {folder_path} for new and changed documents")
+            for file_path in self._scanner.scan(folder_path):
+                if stop.is_set():
+                    break
+                submit(file_path)
+            while not stop.is_set():
+                changes = watcher.changes(WATCH_TICK)
+                for file_path in changes:
+                    for document in self._scanner.documents(folder_path, file_path):
+                        submit(document)
+                if not changes:
+                    on_idle()
+            logging.info("Shutting down, processing the remaining documents")
+            for file_path in watcher.changes(0):
+                for document in self._scanner.documents(folder_path, file_path):
+                    submit(document)
+
+        self._log_outcomes(outcomes)
+
+    def enqueue(self, folder: str):
+        """Distributed mode, coordinator: adds the documents of the folder to the job queue of the database."""
+        folder_path = self._check_folder(folder)
+        db_handler = db_handlers.create_db_handler(self._db_config)
+        try:
+            self._check_job_queue(db_handler)
+            total, added = job_queue.enqueue(db_handler, metrics.timed_iter(self._scanner.scan(folder_path), "scan"))
+            counts = db_handler.job_counts()
+        finally:
+            db_handler.close()
+        logging.info(f"Queued {added} of {total} document(s), the others were queued before and are unchanged. "
+                     f"Jobs: {counts}")
+
+    def work(self):
+        """Distributed mode, worker: processes the documents of the job queue until it is drained.
+
+        On SIGINT or SIGTERM the workers finish the current document, hand the rest of their batch back to the queue
+        and flush the buffered DB writes before exiting.
+        """
+        db_handler = db_handlers.create_db_handler(self._db_config)
+        try:
+            self._check_job_queue(db_handler)
+        finally:
+            db_handler.close()
+
+        with self._instrumentation():
+            if self._workers == 1:
+                stop = threading.Event()
+                for signum in (signal.SIGINT, signal.SIGTERM):
+                    signal.signal(signum, lambda *_: stop.set())
+                processor = DocumentProcessor(self._document_types, self._db_config, self._params, self._options)
+                try:
+                    outcomes = job_queue.run_worker(processor, self._options, stop)
+                finally:
+                    processor.close()
+            else:
+                outcomes = self._work_in_processes()
+
+        self._log_outcomes(outcomes)
+
+    def _work_in_processes(self) -> dict:
+        results = multiprocessing.Queue()
+        args = (self._document_types, self._db_config, self._params, self._options, self._logging_config, results)
+        processes = [multiprocessing.Process(target=job_queue.run_worker_process, args=args, name=f"queue-worker-{i}")
+                     for i in range(self._workers)]
+        for process in processes:
+            process.start()
+
+        def stop_workers(*_):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop_workers)
+
+        outcomes = {outcome: 0 for outcome in ProcessingOutcome}
+        received = 0
+        while received < len(processes):
+            try:
+                worker_outcomes = results.get(timeout=WATCH_TICK)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes) and results.empty():
+                    break  # A worker died, its jobs are claimed again by the other workers or the next run
+                continue
+            received += 1
+            for outcome, count in worker_outcomes.items():
+                outcomes[outcome] += count
+
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                logging.error(f"The worker {process.name} exited with the code {process.exitcode}")
+                self.failed_workers += 1
+        return outcomes
+
+    @contextmanager
+    def _watch_processing(self, count: Callable[[ProcessingOutcome], None]):
+        # Yields the functions submitting a document and called when idle, waits for the submitted ones on exit
+        if self._workers == 1:
+            processor = DocumentProcessor(self._document_types, self._db_config, self._params, self._options)
+            try:
+                yield (lambda file_path: count(processor.process_file(file_path))), processor.flush
+            finally:
+                processor.close()
+            return
+
+        pending = threading.BoundedSemaphore(self._workers * PENDING_PER_WORKER)
+
+        def processed(outcome: ProcessingOutcome):
+            pending.release()
+            count(outcome)
+
+        def failed(e: BaseException):
+            pending.release()
+            logging.error(f"Failed to process a document: {e}")
+            count(ProcessingOutcome.FAILED)
+
+        def submit(file_path: Path):
+            pending.acquire()
+            pool.apply_async(process_in_pool_worker, (file_path,), callback=processed, error_callback=failed)
+
+        options = {**self._options, "watch": True}
+        close_failures = multiprocessing.Value("i", 0)
+        init_args = (self._document_types, self._db_config, self._params, options, self._logging_config,
+                     close_failures)
+        pool = multiprocessing.Pool(self._workers, initializer=init_pool_worker, initargs=init_args)
+        try:
+            yield submit, (lambda: None)
+        finally:
+            # The workers flush their buffered DB writes periodically and when they exit, also on errors
+            pool.close()
+            pool.join()
+            self.failed_workers += close_failures.value
+
     @staticmethod
-    def parse(folder: str):
+    def _check_folder(folder: str) -> Path:
         folder_path = Path(folder)
         if not folder_path.is_dir():
             logging.error(f"The path {folder} is not a valid directory.")
             sys.exit(1)
+        return folder_path
 
-        for file_path in folder_path.rglob('*'):
-            if file_path.is_file():
-                try:
-                    logging.info(f"Start processing {file_path.name}")
-                    template = template_factory.get_template(file_path)
-                    validator = DocumentValidator(file_path, template, db_handler)
-                    validator.process()
-                except Exception as e:
-                    logging.error(f"Failed to process {file_path}: {e}")
+    @staticmethod
+    def _check_job_queue(db_handler: db_handlers.AbstractDatabaseHandler):
+        try:
+            db_handler.job_counts()
+        except NotImplementedError as e:
+            logging.error(f"{e}, the distributed mode needs a database handler with a job queue (SQLite, MongoDB)")
+            sys.exit(1)
+
+    @contextmanager
+    def _instrumentation(self):
+        self._started = time.monotonic()
+        exporter = None
+        if self._options.get("metrics"):
+            exporter = metrics.MetricsExporter(self._options["metrics"], self._options.get("metrics_interval"),
+                                               collect_workers=True).start()
+        if self._options.get("profile"):
+            profiler.clear_profiles(self._options["profile_dir"])
+        try:
+            yield
+        finally:
+            if exporter:
+                exporter.close()
+            if self._options.get("profile"):
+                profiler.keep_slowest_profiles(self._options["profile_dir"], self._options["profile"])
+
+    def _log_outcomes(self, outcomes: dict):
+        # The counts per status and discrepancy type of the documents saved by this process (the workers log theirs)
+        common.run_summary.log(final=True)
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        logging.info(f"Processed {outcomes[ProcessingOutcome.PROCESSED]} document(s) with {self._workers} worker(s), "
+                     f"{outcomes[ProcessingOutcome.SKIPPED]} skipped as unchanged, "
+                     f"{outcomes[ProcessingOutcome.FAILED]} failed, in {elapsed:.1f} s "
+                     f"({sum(outcomes.values()) / elapsed:.1f} documents/s)")
+        if self._scanner.unmatched:
+            logging.info(f"{self._scanner.unmatched} file(s) matched no document type"
+                         f"{', saved with the ERROR status' if self._options.get('record_unmatched') else ''}")
+        if self.failed_workers:
+            logging.error(f"{self.failed_workers} worker(s) failed to write their records, the documents they "
+                          f"processed may be missing from the database")
+
+    def _process(self, file_paths: Iterable[Path]) -> Iterator[ProcessingOutcome]:
+        if self._workers == 1:
+            processor = DocumentProcessor(self._document_types, self._db_config, self._params, self._options)
+            try:
+                yield from map(processor.process_file, file_paths)
+            finally:
+                processor.close()
+            return
+
+        # The pool submits the documents from a thread of its own, which would drain the scanner (and hold the
+        # content of the compressed tar members) without waiting for the workers
+        pending = threading.Semaphore(self._workers * PENDING_PER_WORKER)
+        stopped = threading.Event()
+
+        def submitted() -> Iterator[Path]:
+            for file_path in file_paths:
+                pending.acquire()
+                if stopped.is_set():
+                    return
+                yield file_path
+
+        close_failures = multiprocessing.Value("i", 0)
+        init_args = (self._document_types, self._db_config, self._params, self._options, self._logging_config,
+                     close_failures)
+        pool = multiprocessing.Pool(self._workers, initializer=init_pool_worker, initargs=init_args)
+        try:
+            # Unordered results with small chunks keep all workers busy regardless of document sizes
+            for outcome in pool.imap_unordered(process_in_pool_worker, submitted(), chunksize=16):
+                pending.release()
+                yield outcome
+        finally:
+            # On errors, no more documents are submitted, the ones submitted are processed
+            stopped.set()
+            pending.release()
+            # Let the workers exit gracefully, also on errors, so that they flush their buffered DB writes
+            # (terminate() would kill them with the records of up to a batch each)
+            pool.close()
+            pool.join()
+            self.failed_workers += close_failures.value
 
 
 if __name__ == "__main__":
     config = common.ConfigLoader("config.json")
 
-    setup_logging(config.get_logging_config())
+    common.setup_logging(config.get_logging_config())
 
-    params = parse_arguments(config.get_document_types())
+    params = parse_arguments(config.document_types)
 
     document_folder = params.pop("document_folder", "")
+    options = {name: params.pop(name) for name in RUN_OPTIONS}
 
-    logging.info(f"Processing document folder {document_folder}. Template parameters - {params}")
-
-    db_config = config.get_db_config()
-    db_handler_class_name = db_config.pop("handler_class", None)
-    db_handler_class = common.get_class(db_handler_class_name)
-    if not db_handler_class:
-        raise ValueError(f"Handler class '{db_handler_class_name}' not found.")
-    db_handler = db_handler_class(db_config)
-
-    template_factory = factory.TemplateFactory(config.get_document_types(), **params)
+    source = f"document folder {document_folder}" if document_folder else "the job queue"
+    logging.info(f"Processing {source}. Template parameters - {params}")
 
-    Parser.parse(document_folder)
+    parser = Parser(config.document_types, config.get_db_config(), params, config.get_logging_config(), options)
+    if options["enqueue"]:
+        parser.enqueue(document_folder)
+    elif options["queue_worker"]:
+        parser.work()
+    elif options["watch"]:
+        parser.watch(document_folder)
+    else:
+        parser.parse(document_folder)
 
-    logging.info(f"Document folder {document_folder} processed successfully.")
\ No newline at end of file
+    if parser.failed_workers:
+        sys.exit(1)
+    logging.info("Done processing the job queue." if options["queue_worker"] else
+                 f"Document folder {document_folder} processed successfully.")
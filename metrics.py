@@ -0,0 +1,246 @@
+import bisect
+from contextlib import nullcontext
+import json
+import logging
+from multiprocessing import util
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+METRIC_PREFIX = "docvalidator_"
+# Histogram buckets in seconds, from sub-millisecond rule calls to slow documents
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+WORKER_SUFFIX = ".worker-"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last one counts the values above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ("_registry", "_key", "_start")
+
+    def __init__(self, registry: "MetricsRegistry", key: tuple):
+        self._registry = registry
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._registry.observe_key(self._key, time.perf_counter() - self._start)
+
+
+class MetricsRegistry:
+    """The histograms and counters of one process.
+
+    Recording does nothing until the registry is enabled, so that the instrumentation costs nothing by default.
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self._histograms: Dict[tuple, Histogram] = {}
+        self._counters: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def timer(self, name: str, **labels):
+        if not self.enabled:
+            return nullcontext()
+        return _Timer(self, (name, tuple(sorted(labels.items()))))
+
+    def observe(self, name: str, value: float, **labels):
+        if self.enabled:
+            self.observe_key((name, tuple(sorted(labels.items()))), value)
+
+    def observe_key(self, key: tuple, value: float):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": list(BUCKETS),
+                "histograms": [{"name": name, "labels": dict(labels), "counts": list(histogram.counts),
+                                "sum": histogram.sum, "count": histogram.count}
+                               for (name, labels), histogram in self._histograms.items()],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self._counters.items()],
+            }
+
+
+# The registry of the current process
+registry = MetricsRegistry()
+
+
+def stage_timer(stage: str):
+    return registry.timer("stage_seconds", stage=stage)
+
+
+def timed_iter(iterable: Iterable, stage: str) -> Iterator:
+    """Yields the items of iterable, the time spent producing them is recorded as a stage."""
+    iterator = iter(iterable)
+    while True:
+        with stage_timer(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def merge_snapshots(snapshots: Iterable[dict]) -> dict:
+    histograms: Dict[Tuple[str, tuple], dict] = {}
+    counters: Dict[Tuple[str, tuple], dict] = {}
+    for snapshot in snapshots:
+        for histogram in snapshot["histograms"]:
+            key = (histogram["name"], tuple(sorted(histogram["labels"].items())))
+            merged = histograms.setdefault(key, {**histogram, "counts": [0] * len(histogram["counts"]),
+                                                 "sum": 0.0, "count": 0})
+            merged["counts"] = [a + b for a, b in zip(merged["counts"], histogram["counts"])]
+            merged["sum"] += histogram["sum"]
+            merged["count"] += histogram["count"]
+        for counter in snapshot["counters"]:
+            key = (counter["name"], tuple(sorted(counter["labels"].items())))
+            merged = counters.setdefault(key, {**counter, "value": 0})
+            merged["value"] += counter["value"]
+    return {"buckets": list(BUCKETS), "histograms": list(histograms.values()), "counters": list(counters.values())}
+
+
+def to_prometheus(snapshot: dict) -> str:
+    """Formats a snapshot in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+
+    def add_type(name: str, metric_type: str):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {metric_type}")
+
+    for histogram in sorted(snapshot["histograms"], key=lambda h: (h["name"], sorted(h["labels"].items()))):
+        name = METRIC_PREFIX + histogram["name"]
+        add_type(name, "histogram")
+        cumulative = 0
+        for bound, count in zip([*snapshot["buckets"], "+Inf"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels({**histogram['labels'], 'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels(histogram['labels'])} {histogram['count']}")
+
+    for counter in sorted(snapshot["counters"], key=lambda c: (c["name"], sorted(c["labels"].items()))):
+        name = METRIC_PREFIX + counter["name"]
+        add_type(name, "counter")
+        lines.append(f"{name}{_labels(counter['labels'])} {counter['value']}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_snapshot(snapshot: dict, path: Path):
+    # JSON for .json files, the Prometheus text format otherwise. Replaced atomically, readers never see a partial file
+    content = json.dumps(snapshot, indent=1) if path.suffix == ".json" else to_prometheus(snapshot)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(content)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """Writes the metrics of the process to a file at a fixed interval and when closed.
+
+    The exporter of the main process merges in the snapshots the worker processes write next to the metrics file.
+    """
+
+    def __init__(self, metrics_path: str, interval: float = None, collect_workers: bool = False):
+        self._path = Path(metrics_path)
+        self._interval = interval
+        self._collect_workers = collect_workers
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "MetricsExporter":
+        registry.enabled = True
+        if self._collect_workers:
+            self._remove_worker_snapshots()  # Left by a previous run
+        if self._interval:
+            self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def export(self):
+        try:
+            snapshot = registry.snapshot()
+            if self._collect_workers:
+                snapshot = merge_snapshots([snapshot, *self._worker_snapshots()])
+            write_snapshot(snapshot, self._path)
+        except Exception as e:
+            logging.error(f"Failed to export the metrics to {self._path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.export()
+        if self._collect_workers:
+            self._remove_worker_snapshots()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.export()
+
+    def _worker_paths(self) -> Iterator[Path]:
+        return self._path.parent.glob(f"{self._path.name}{WORKER_SUFFIX}*.json")
+
+    def _worker_snapshots(self) -> Iterator[dict]:
+        for worker_path in self._worker_paths():
+            try:
+                yield json.loads(worker_path.read_text())
+            except (OSError, ValueError):
+                continue  # Removed by the worker meanwhile
+
+    def _remove_worker_snapshots(self):
+        for worker_path in self._worker_paths():
+            worker_path.unlink(missing_ok=True)
+
+
+def start_worker_exporter(metrics_path: str, interval: float = None):
+    """Exports the metrics of a worker process where the main process collects them, until the worker exits."""
+    registry.reset()  # A forked worker inherits the metrics the main process recorded so far
+    exporter = MetricsExporter(f"{metrics_path}{WORKER_SUFFIX}{os.getpid()}.json", interval).start()
+    # After the finalizers flushing the DB buffers (priority 10), so that the last writes are measured too
+    util.Finalize(None, exporter.close, exitpriority=5)
@@ -0,0 +1,222 @@
+from enum import Enum
+import logging
+from multiprocessing import util
+from pathlib import Path
+import signal
+import threading
+import time
+from typing import Optional
+
+import common
+from common import FatalError
+from db import db_handlers, payloads
+import metrics
+from processing.extraction_cache import ExtractionCache
+from processing.manifest import Manifest, ManifestEntry
+from processing.profiler import SlowestDocumentsProfiler
+from processing.supervisor import BudgetExceeded, ExtractionSupervisor
+from templates import factory
+from validation.doc_validator import DocumentValidator, ValidationStatus
+
+
+class ProcessingOutcome(Enum):
+    PROCESSED = "PROCESSED"
+    SKIPPED = "SKIPPED"
+    FAILED = "FAILED"
+
+
+class DocumentProcessor:
+    """Processes single documents with its own template factory and DB handler (one per process)."""
+
+    def __init__(self, document_types: common.DocumentTypes, db_config: dict, params: dict, options: dict = None,
+                 db_handler: db_handlers.AbstractDatabaseHandler = None):
+        options = options or {}
+        self._template_factory = factory.TemplateFactory(document_types, **params)
+        self._db_config = db_config
+        # Created on the first document, a run without documents doesn't import the DB driver nor connect
+        self._db_handler: Optional[db_handlers.AbstractDatabaseHandler] = db_handler
+        self.flush_interval: float = db_config.get("flush_interval", 5.0)
+        self._manifest: Optional[Manifest] = Manifest(options["manifest"], params) if options.get("manifest") else None
+        self._cache: Optional[ExtractionCache] = ExtractionCache(options["cache"]) if options.get("cache") else None
+        self._profiler: Optional[SlowestDocumentsProfiler] = \
+            SlowestDocumentsProfiler(options["profile"], options["profile_dir"]) if options.get("profile") else None
+        self._supervisor: Optional[ExtractionSupervisor] = create_supervisor(document_types, params, options)
+
+    @property
+    def db_handler(self) -> db_handlers.AbstractDatabaseHandler:
+        if self._db_handler is None:
+            db_handler = db_handlers.create_db_handler(self._db_config)
+            try:
+                check_layouts(self._template_factory, db_handler)
+            except FatalError:
+                db_handler.close()
+                raise
+            self._db_handler = db_handler
+        return self._db_handler
+
+    def process_file(self, file_path: Path, document_id: str = None) -> ProcessingOutcome:
+        with metrics.stage_timer("document"):
+            if self._profiler:
+                return self._profiler.run(file_path.name, self._process_file, file_path, document_id)
+            return self._process_file(file_path, document_id)
+
+    def _process_file(self, file_path: Path, document_id: str = None) -> ProcessingOutcome:
+        db_handler = self.db_handler  # A DB configuration error stops the run, it is not a failure of the document
+        try:
+            template = self._template_factory.get_template(file_path)
+
+            manifest_entry = None
+            if self._manifest:
+                unchanged, manifest_entry = self._manifest.check(file_path, template.name if template else "")
+                if unchanged:
+                    logging.debug(f"Skipping unchanged document {file_path.name}")
+                    return ProcessingOutcome.SKIPPED
+
+            if common.run_summary.sampled(file_path.name):
+                logging.info(f"Start processing {file_path.name}")
+            digest = cached_values = None
+            if self._cache and template:
+                digest = manifest_entry.digest if manifest_entry and manifest_entry.digest else common.file_digest(file_path)
+                if manifest_entry:
+                    manifest_entry.digest = digest
+                cached_values = self._cache.get(digest, template.name)
+
+            field_values = cached_values
+            if self._supervisor and template and field_values is None:
+                try:
+                    with metrics.stage_timer("extract"):
+                        field_values = self._supervisor.extract(template, file_path)
+                except BudgetExceeded as e:
+                    # Saved with the ERROR status and not cached, so that an unchanged document isn't tried again
+                    logging.warning(f"{file_path.name} is over its budget: {e}")
+                    DocumentValidator(file_path, template, db_handler, {}, document_id).save(
+                        ValidationStatus.ERROR, [e.discrepancy()])
+                    if manifest_entry:
+                        self._record(manifest_entry, ValidationStatus.ERROR.value)
+                    return ProcessingOutcome.PROCESSED
+
+            validator = DocumentValidator(file_path, template, db_handler, field_values, document_id)
+            status = validator.process()
+            if status is None:
+                return ProcessingOutcome.FAILED
+
+            if digest:
+                if cached_values is None:
+                    self._cache.put(digest, template.name, file_path.name, validator.field_values)
+                self._cache.record(str(file_path.resolve()), file_path.name, digest, template.name)
+
+            if manifest_entry:
+                self._record(manifest_entry, status.value)
+            return ProcessingOutcome.PROCESSED
+        except Exception as e:
+            logging.error(f"Failed to process {file_path}: {e}")
+            return ProcessingOutcome.FAILED
+
+    def _record(self, manifest_entry: ManifestEntry, status: str):
+        self._manifest.record(manifest_entry, status)
+        if self._manifest.pending >= Manifest.COMMIT_BATCH_SIZE:
+            self.flush_database()
+            self._manifest.flush()
+
+    def flush(self):
+        """Writes the buffered DB records, manifest and cache entries (e.g. when idle in the watch mode)."""
+        # The manifest entries after the records of their documents, a failure in between only repeats the documents
+        self.flush_database()
+        if self._manifest:
+            self._manifest.flush()
+        if self._cache:
+            self._cache.flush()
+
+    def flush_database(self):
+        if self._db_handler is not None:
+            self._db_handler.flush()
+
+    def close(self):
+        if self._profiler:
+            self._profiler.dump()
+        if self._supervisor:
+            self._supervisor.close()
+        if self._cache:
+            self._cache.close()
+        if self._db_handler is not None:
+            self._db_handler.close()
+        # Committed only if the last DB records were written
+        if self._manifest:
+            self._manifest.close()
+
+
+def check_layouts(template_factory: factory.TemplateFactory, db_handler: db_handlers.AbstractDatabaseHandler):
+    """Raises FatalError if a template saves fields with the blob layout and the handler has no payload store, so
+    that the run stops instead of failing every document."""
+    if db_handlers.supports_payloads(db_handler):
+        return
+    for template in template_factory.templates():
+        blob_fields = [name for name, layout in template.field_layouts().items() if layout == payloads.BLOB]
+        if blob_fields:
+            raise FatalError(f"{type(db_handler).__name__} does not support the blob layout of the "
+                             f"{', '.join(blob_fields)} field(s) of {template.name}, configure them as text or array")
+
+
+def create_supervisor(document_types: common.DocumentTypes, params: dict,
+                      options: dict) -> Optional[ExtractionSupervisor]:
+    """The supervisor of the extractions if the run options set per-document budgets, None otherwise."""
+    time_budget, memory_budget = options.get("time_budget"), options.get("memory_budget")
+    if not time_budget and not memory_budget:
+        return None
+    return ExtractionSupervisor(document_types, params, time_budget or None,
+                                int(memory_budget * 2 ** 20) if memory_budget else None)
+
+
+# Per-process state of the pool workers
+_worker_processor: Optional[DocumentProcessor] = None
+_worker_error: Optional[Exception] = None
+
+def init_pool_worker(document_types: common.DocumentTypes, db_config: dict, params: dict, options: dict,
+                     logging_config: dict, close_failures=None):
+    """Creates the processor of a pool worker. close_failures (a shared multiprocessing.Value) counts the workers
+    that failed to write their buffered records when exiting."""
+    global _worker_processor, _worker_error
+    common.setup_logging(logging_config)
+    if options.get("metrics"):
+        metrics.start_worker_exporter(options["metrics"], options.get("metrics_interval"))
+    try:
+        _worker_processor = DocumentProcessor(document_types, db_config, params, options)
+        # Flush the buffered DB writes when the worker exits
+        util.Finalize(None, _close_pool_worker, args=(close_failures,), exitpriority=10)
+        if options.get("watch"):
+            _start_watch_worker(_worker_processor)
+    except Exception as e:
+        # Raising here would make the pool respawn the worker forever, report it on the first task instead
+        _worker_error = e
+
+def _close_pool_worker(close_failures):
+    # The finalizers' exceptions are only printed, the main process is told through the shared counter
+    try:
+        _worker_processor.close()
+    except Exception as e:
+        logging.error(f"Failed to write the buffered DB records when exiting: {e}")
+        if close_failures is not None:
+            with close_failures.get_lock():
+                close_failures.value += 1
+
+def process_in_pool_worker(file_path: Path) -> ProcessingOutcome:
+    if _worker_error is not None:
+        raise FatalError(f"Worker initialization failed: {_worker_error}")
+    return _worker_processor.process_file(file_path)
+
+
+def _start_watch_worker(processor: DocumentProcessor):
+    # The main process drains the queue on SIGINT or SIGTERM, then lets the workers exit gracefully
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    def flush_periodically():
+        # The DB handlers flush on the next insert only, an idle worker must not keep records buffered
+        while True:
+            time.sleep(processor.flush_interval)
+            try:
+                processor.flush_database()
+            except Exception as e:
+                logging.error(f"Failed to flush the buffered DB records: {e}")
+
+    threading.Thread(target=flush_periodically, name="db-flush", daemon=True).start()
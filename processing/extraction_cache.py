@@ -0,0 +1,89 @@
+import json
+import logging
+import sqlite3
+from typing import Iterator, List, Optional, Tuple
+import zlib
+
+
+class ExtractionCache:
+    """On-disk cache of the extracted field values keyed by the document content hash and the template class.
+
+    The field values don't depend on the template parameters, so documents can be re-validated with new parameters
+    without being parsed again. The values are stored once per content, as zlib-compressed JSON, and the documents
+    (by path) refer to them, so that documents with the same content are all re-validated.
+    """
+
+    COMMIT_BATCH_SIZE = 100
+
+    def __init__(self, cache_path: str):
+        self._connection = sqlite3.connect(cache_path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS extractions (digest TEXT, template TEXT, name TEXT, field_values BLOB, "
+                "PRIMARY KEY (digest, template))")
+            if not self._connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents'").fetchone():
+                self._connection.execute("CREATE TABLE documents (path TEXT PRIMARY KEY, name TEXT, digest TEXT, "
+                                         "template TEXT)")
+                # The caches written before knew one name per content
+                self._connection.execute("INSERT OR IGNORE INTO documents SELECT name, name, digest, template "
+                                         "FROM extractions")
+        self._pending: List[tuple] = []
+        self._pending_documents: List[tuple] = []
+
+    def get(self, digest: str, template_name: str) -> Optional[dict]:
+        row = self._connection.execute("SELECT field_values FROM extractions WHERE digest = ? AND template = ?",
+                                       (digest, template_name)).fetchone()
+        return self._decode(row[0]) if row else None
+
+    def put(self, digest: str, template_name: str, name: str, field_values: dict):
+        self._pending.append((digest, template_name, name, self._encode(field_values)))
+        if len(self._pending) >= self.COMMIT_BATCH_SIZE:
+            self.flush()
+
+    def record(self, path: str, name: str, digest: str, template_name: str):
+        """Records the document at the path as having the cached content, whether it was extracted or found."""
+        self._pending_documents.append((path, name, digest, template_name))
+        if len(self._pending_documents) >= self.COMMIT_BATCH_SIZE:
+            self.flush()
+
+    def entries(self, template_name: str = None) -> Iterator[Tuple[str, str, dict]]:
+        """Yields (document name, template class name, field values) of the cached documents."""
+        query = ("SELECT d.name, d.template, d.digest, e.field_values FROM documents d "
+                 "JOIN extractions e ON e.digest = d.digest AND e.template = d.template")
+        args = ()
+        if template_name:
+            query += " WHERE d.template = ?"
+            args = (template_name,)
+        # The field values of the documents with the same content are decoded once
+        last_key = field_values = None
+        for name, template, digest, data in self._connection.execute(query + " ORDER BY d.digest, d.template", args):
+            if (digest, template) != last_key:
+                last_key, field_values = (digest, template), self._decode(data)
+            yield name, template, field_values
+
+    def flush(self):
+        if not self._pending and not self._pending_documents:
+            return
+        try:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?)", self._pending)
+                self._connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                                             self._pending_documents)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update the extraction cache: {e}")
+        self._pending = []
+        self._pending_documents = []
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    @staticmethod
+    def _encode(field_values: dict) -> bytes:
+        return zlib.compress(json.dumps(field_values, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _decode(data: bytes) -> dict:
+        return json.loads(zlib.decompress(data).decode("utf-8"))
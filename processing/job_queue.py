@@ -0,0 +1,149 @@
+import hashlib
+from itertools import islice
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import common
+from common import FatalError
+from db import db_handlers
+from db.db_handlers import JOB_DONE, JOB_FAILED, JOB_LEASED, JOB_QUEUED
+import metrics
+from processing import sources
+from processing.document_processor import DocumentProcessor, ProcessingOutcome
+from processing.sources import Document
+
+ENQUEUE_BATCH_SIZE = 1000
+IDLE_INTERVAL = 1.0  # Seconds between the claims of a worker waiting for the leases of other workers to expire
+
+
+def document_id(job_id: str) -> str:
+    # The same for every claim of a job, a document processed again after its lease expired replaces its records
+    return hashlib.sha1(job_id.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def enqueue(db_handler: db_handlers.AbstractDatabaseHandler, file_paths: Iterable[Document]) -> Tuple[int, int]:
+    """Queues the documents by absolute path (archive!member for the archive members), returns the number of
+    documents and of the jobs added.
+
+    A document queued before is queued again if its size or modification time changed since, e.g. a corrected
+    file dropped again under the same name.
+    """
+    file_paths = iter(file_paths)
+    total = added = 0
+    while True:
+        batch = list(islice(file_paths, ENQUEUE_BATCH_SIZE))
+        if not batch:
+            return total, added
+        paths = [str(file_path.resolve()) if isinstance(file_path, sources.ArchiveMember)
+                 else os.path.abspath(file_path) for file_path in batch]
+        total += len(paths)
+        added += db_handler.enqueue_jobs(paths, [_version(file_path) for file_path in batch])
+
+
+def _version(file_path: Document) -> Optional[str]:
+    try:
+        stat = file_path.stat()
+    except OSError:
+        return None  # Gone meanwhile, its job fails
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class QueueWorker:
+    """Processes the jobs of the job queue in claimed batches until the queue is drained.
+
+    The leases of a batch are renewed while it is processed, and its jobs are released once their records are
+    flushed. The jobs of a worker that died are claimed again when their lease expires. As the document IDs derive
+    from the jobs, every document ends up recorded once, with the discrepancies of its last processing, even if it
+    was processed twice. A job claimed more than max_attempts times (e.g. a document crashing the workers) is
+    released as failed without processing it.
+    """
+
+    def __init__(self, processor: DocumentProcessor, batch_size: int = 16, lease_seconds: float = 300.0,
+                 max_attempts: int = 3, stop: Optional[threading.Event] = None, worker_id: Optional[str] = None):
+        self._processor = processor
+        self._queue: db_handlers.AbstractDatabaseHandler = processor.db_handler
+        self._batch_size = batch_size
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._stop = stop or threading.Event()
+        self.worker_id: str = worker_id or f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+    def run(self) -> Dict[ProcessingOutcome, int]:
+        outcomes = {outcome: 0 for outcome in ProcessingOutcome}
+        while not self._stop.is_set():
+            jobs = self._queue.claim_jobs(self.worker_id, self._batch_size, self._lease_seconds)
+            if jobs:
+                self._process_batch(jobs, outcomes)
+                continue
+            counts = self._queue.job_counts()
+            if not counts.get(JOB_QUEUED) and not counts.get(JOB_LEASED):
+                break
+            # The jobs leased to other workers are claimed again if their lease expires
+            self._stop.wait(IDLE_INTERVAL)
+        return outcomes
+
+    def _process_batch(self, jobs: List[dict], outcomes: Dict[ProcessingOutcome, int]):
+        released = {JOB_DONE: [], JOB_FAILED: []}
+        renewed = time.monotonic()
+        for i, job in enumerate(jobs):
+            if self._stop.is_set():
+                # Handed back to the other workers
+                self._queue.release_jobs(self.worker_id, [job["_id"] for job in jobs[i:]], JOB_QUEUED)
+                break
+            if time.monotonic() - renewed > self._lease_seconds / 3:
+                self._queue.renew_leases(self.worker_id, [job["_id"] for job in jobs[i:]], self._lease_seconds)
+                renewed = time.monotonic()
+
+            if job["attempts"] > self._max_attempts:
+                logging.error(f"Giving up {job['path']} after {self._max_attempts} attempt(s)")
+                outcome = ProcessingOutcome.FAILED
+            else:
+                try:
+                    outcome = self._processor.process_file(sources.parse_document(job["path"]),
+                                                           document_id(job["_id"]))
+                except FatalError:
+                    # The worker can't go on, the jobs not processed are handed back to the other workers
+                    self._queue.release_jobs(self.worker_id, [job["_id"] for job in jobs[i:]], JOB_QUEUED)
+                    raise
+                except Exception as e:
+                    # E.g. a document deleted since it was queued, or a member missing from its archive
+                    logging.error(f"Failed to process {job['path']}: {e}")
+                    outcome = ProcessingOutcome.FAILED
+            outcomes[outcome] += 1
+            released[JOB_FAILED if outcome == ProcessingOutcome.FAILED else JOB_DONE].append(job["_id"])
+
+        # The records are written before the jobs are released, a crash in between only repeats the jobs
+        self._processor.flush()
+        for status, job_ids in released.items():
+            expired = len(job_ids) - (self._queue.release_jobs(self.worker_id, job_ids, status) if job_ids else 0)
+            if expired:
+                logging.warning(f"{expired} job lease(s) expired before the jobs were done, other workers claimed them")
+
+
+def run_worker(processor: DocumentProcessor, options: dict, stop: Optional[threading.Event] = None) \
+        -> Dict[ProcessingOutcome, int]:
+    return QueueWorker(processor, options.get("claim_batch") or 16, options.get("lease") or 300.0,
+                       options.get("max_attempts") or 3, stop).run()
+
+
+def run_worker_process(document_types: common.DocumentTypes, db_config: dict, params: dict, options: dict,
+                       logging_config: dict, results):
+    """The entry point of a worker process, puts the outcome counts to the results queue."""
+    common.setup_logging(logging_config)
+    if options.get("metrics"):
+        metrics.start_worker_exporter(options["metrics"], options.get("metrics_interval"))
+    # The current batch is finished (or handed back) on SIGINT or SIGTERM
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    processor = DocumentProcessor(document_types, db_config, params, options)
+    try:
+        results.put(run_worker(processor, options, stop))
+    finally:
+        processor.close()
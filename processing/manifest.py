@@ -0,0 +1,100 @@
+import hashlib
+import logging
+from pathlib import Path
+import sqlite3
+from typing import List, Optional, Tuple
+
+import common
+from processing.sources import Document
+
+
+class ManifestEntry:
+    def __init__(self, path: str, size: int, mtime_ns: int, template: str, fingerprint: str,
+                 digest: Optional[str] = None, document: Optional[Document] = None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.template = template
+        self.fingerprint = fingerprint
+        self.digest = digest  # Computed only when the size or the modification time changed
+        self.document = document  # The document of the path, e.g. an archive member
+
+
+class Manifest:
+    """Local record of the documents already validated, used to skip the unchanged ones on re-runs.
+
+    A document is unchanged when it was validated with the same template and parameters and either its size and
+    modification time or its content hash are the same. Several processes may share one manifest file. The recorded
+    entries are committed by flush() only, which the owner calls once the DB records of their documents are written:
+    a document must never be skipped as validated when its records were lost.
+    """
+
+    # The entries pending before the owner flushes the DB records and commits them, as many as a default DB batch
+    COMMIT_BATCH_SIZE = 1000
+
+    def __init__(self, manifest_path: str, params: dict):
+        self._fingerprint: str = self.params_fingerprint(params)
+        self._connection = sqlite3.connect(manifest_path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS manifest (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "digest TEXT, template TEXT, fingerprint TEXT, status TEXT)")
+        self._connection.commit()
+        self._pending: List[tuple] = []
+
+    @staticmethod
+    def params_fingerprint(params: dict) -> str:
+        return hashlib.sha256(repr(sorted(params.items())).encode()).hexdigest()
+
+    def check(self, file_path: Document, template_name: str) -> Tuple[bool, ManifestEntry]:
+        """Returns whether the document is unchanged since its last validation, and its current entry."""
+        stat = file_path.stat()
+        entry = ManifestEntry(str(file_path.resolve()), stat.st_size, stat.st_mtime_ns, template_name,
+                              self._fingerprint, document=file_path)
+
+        row = self._connection.execute(
+            "SELECT size, mtime_ns, digest, template, fingerprint, status FROM manifest WHERE path = ?",
+            (entry.path,)).fetchone()
+        if not row:
+            return False, entry
+
+        size, mtime_ns, digest, template, fingerprint, status = row
+        if template != entry.template or fingerprint != entry.fingerprint:
+            return False, entry
+        if size == entry.size and mtime_ns == entry.mtime_ns:
+            entry.digest = digest
+            return True, entry
+
+        entry.digest = common.file_digest(file_path)
+        if entry.digest != digest:
+            return False, entry
+
+        # Touched but not modified, remember the new size and modification time
+        self.record(entry, status)
+        return True, entry
+
+    def record(self, entry: ManifestEntry, status: str):
+        if entry.digest is None:
+            entry.digest = common.file_digest(entry.document or Path(entry.path))
+        self._pending.append((entry.path, entry.size, entry.mtime_ns, entry.digest, entry.template,
+                              entry.fingerprint, status))
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self):
+        if not self._pending:
+            return
+        # One short transaction per batch, so that processes sharing the manifest don't block each other
+        try:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                             self._pending)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update the manifest: {e}")
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._connection.close()
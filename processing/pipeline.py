@@ -0,0 +1,168 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import logging
+from multiprocessing import util
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import common
+from db import db_handlers
+import metrics
+from processing.document_processor import ProcessingOutcome, check_layouts, create_supervisor
+from processing.profiler import SlowestDocumentsProfiler
+from processing.supervisor import BudgetExceeded, ExtractionSupervisor
+from templates import factory
+from validation.doc_validator import DocumentValidator, ValidationStatus
+
+_STOP = object()  # Tells a stage task that there is nothing more to process
+_SCAN_BATCH_SIZE = 256
+
+# Per-process state of the parsing workers
+_parser_factory: Optional[factory.TemplateFactory] = None
+_parser_profiler: Optional[SlowestDocumentsProfiler] = None
+_parser_supervisor: Optional[ExtractionSupervisor] = None
+
+def _init_parser(document_types: common.DocumentTypes, params: dict, logging_config: dict, options: dict):
+    global _parser_factory, _parser_profiler, _parser_supervisor
+    common.setup_logging(logging_config)
+    _parser_factory = factory.TemplateFactory(document_types, **params)
+    _parser_supervisor = create_supervisor(document_types, params, options)
+    if _parser_supervisor:
+        util.Finalize(None, _parser_supervisor.close, exitpriority=10)
+    if options.get("metrics"):
+        metrics.start_worker_exporter(options["metrics"], options.get("metrics_interval"))
+    if options.get("profile"):
+        _parser_profiler = SlowestDocumentsProfiler(options["profile"], options["profile_dir"])
+        util.Finalize(None, _parser_profiler.dump, exitpriority=10)
+
+def _parse_document(file_path: Path, content: bytes) -> Tuple[str, dict, ValidationStatus, List[dict]]:
+    with metrics.stage_timer("parse"):
+        if _parser_profiler:
+            return _parser_profiler.run(file_path.name, _parse, file_path, content)
+        return _parse(file_path, content)
+
+def _parse(file_path: Path, content: bytes) -> Tuple[str, dict, ValidationStatus, List[dict]]:
+    template = _parser_factory.get_template(file_path)
+    if template is None:
+        return "", {}, ValidationStatus.ERROR, []
+    try:
+        with metrics.stage_timer("extract"):
+            if _parser_supervisor:
+                field_values = _parser_supervisor.extract(template, file_path, content)
+            else:
+                field_values = template.extract_required_fields(file_path, content)
+    except BudgetExceeded as e:
+        logging.warning(f"{file_path.name} is over its budget: {e}")
+        return template.name, {}, ValidationStatus.ERROR, [e.discrepancy()]
+    status, result = DocumentValidator(file_path, template, None, field_values).validate()
+    return template.name, field_values, status, result["discrepancies"]
+
+
+class AsyncPipeline:
+    """Processes documents in overlapping stages: file reads, parsing and validation, DB writes.
+
+    File reads and DB writes run in threads, parsing and validation in worker processes. The bounded queues
+    between the stages apply backpressure, so the memory stays flat however many documents the folder holds.
+    """
+
+    def __init__(self, document_types: common.DocumentTypes, db_config: dict, params: dict, logging_config: dict = None,
+                 readers: int = 4, parsers: int = 1, writers: int = 2, queue_size: int = 64, options: dict = None):
+        self._document_types = document_types
+        self._db_config = db_config
+        self._params = params
+        self._logging_config = logging_config or {}
+        self._readers = max(1, readers)
+        self._parsers = max(1, parsers)
+        self._writers = max(1, writers)
+        self._queue_size = max(1, queue_size)
+        self._options = options or {}  # Passed on to the parsing workers (metrics and profiling)
+
+    def run(self, file_paths: Iterable[Path]) -> Dict[ProcessingOutcome, int]:
+        return asyncio.run(self._run(iter(file_paths)))
+
+    async def _run(self, file_paths: Iterator[Path]) -> Dict[ProcessingOutcome, int]:
+        outcomes = {outcome: 0 for outcome in ProcessingOutcome}
+        read_queue = asyncio.Queue(self._queue_size)
+        parse_queue = asyncio.Queue(self._queue_size)
+        write_queue = asyncio.Queue(self._queue_size)
+
+        db_handler = db_handlers.create_db_handler(self._db_config)
+        template_factory = factory.TemplateFactory(self._document_types, **self._params)
+        init_args = (self._document_types, self._params, self._logging_config, self._options)
+        try:
+            check_layouts(template_factory, db_handler)
+            with ProcessPoolExecutor(self._parsers, initializer=_init_parser, initargs=init_args) as executor:
+                readers = [asyncio.create_task(self._read(read_queue, parse_queue, outcomes))
+                           for _ in range(self._readers)]
+                # Twice as many tasks as processes, so that a process never waits for its next document
+                parsers = [asyncio.create_task(self._parse(parse_queue, write_queue, executor, outcomes))
+                           for _ in range(self._parsers * 2)]
+                writers = [asyncio.create_task(self._write(write_queue, template_factory, db_handler, outcomes))
+                           for _ in range(self._writers)]
+
+                await self._scan(file_paths, read_queue)
+                for queue, tasks in ((read_queue, readers), (parse_queue, parsers), (write_queue, writers)):
+                    for _ in tasks:
+                        await queue.put(_STOP)
+                    await asyncio.gather(*tasks)
+        finally:
+            await asyncio.to_thread(db_handler.close)
+        return outcomes
+
+    @staticmethod
+    async def _scan(file_paths: Iterator[Path], read_queue: asyncio.Queue):
+        # The folder walk blocks on the file system, it runs in a thread a batch at a time
+        while True:
+            batch = await asyncio.to_thread(list, itertools.islice(file_paths, _SCAN_BATCH_SIZE))
+            if not batch:
+                return
+            for file_path in batch:
+                await read_queue.put(file_path)
+
+    @staticmethod
+    async def _read(read_queue: asyncio.Queue, parse_queue: asyncio.Queue, outcomes: dict):
+        while (file_path := await read_queue.get()) is not _STOP:
+            try:
+                if common.run_summary.sampled(file_path.name):
+                    logging.info(f"Start processing {file_path.name}")
+                content = await asyncio.to_thread(AsyncPipeline._read_file, file_path)
+            except Exception as e:
+                logging.error(f"Failed to read {file_path}: {e}")
+                outcomes[ProcessingOutcome.FAILED] += 1
+                continue
+            await parse_queue.put((file_path, content))
+
+    @staticmethod
+    def _read_file(file_path: Path) -> bytes:
+        with metrics.stage_timer("read"):
+            return file_path.read_bytes()
+
+    @staticmethod
+    async def _parse(parse_queue: asyncio.Queue, write_queue: asyncio.Queue, executor: ProcessPoolExecutor,
+                     outcomes: dict):
+        loop = asyncio.get_running_loop()
+        while (item := await parse_queue.get()) is not _STOP:
+            file_path, content = item
+            try:
+                result = await loop.run_in_executor(executor, _parse_document, file_path, content)
+            except Exception as e:
+                logging.error(f"Error processing {file_path}: {e}")
+                outcomes[ProcessingOutcome.FAILED] += 1
+                continue
+            await write_queue.put((file_path, *result))
+
+    @staticmethod
+    async def _write(write_queue: asyncio.Queue, template_factory: factory.TemplateFactory,
+                     db_handler: db_handlers.AbstractDatabaseHandler, outcomes: dict):
+        while (item := await write_queue.get()) is not _STOP:
+            file_path, template_name, field_values, status, discrepancies = item
+            template = template_factory.get_template_by_class_name(template_name) if template_name else None
+            validator = DocumentValidator(file_path, template, db_handler, field_values)
+            try:
+                await asyncio.to_thread(validator.save, status, discrepancies)
+            except Exception as e:
+                logging.error(f"Failed to save {file_path}: {e}")
+                outcomes[ProcessingOutcome.FAILED] += 1
+                continue
+            outcomes[ProcessingOutcome.PROCESSED] += 1
@@ -0,0 +1,56 @@
+import cProfile
+import heapq
+import itertools
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Callable, List, Tuple
+
+PROFILE_GLOB = "*us-*.prof"
+
+
+class SlowestDocumentsProfiler:
+    """Profiles every document with cProfile and keeps the profiles of the slowest ones.
+
+    The profiles are dumped as <microseconds>us-<pid>-<document>.prof files, so that the ones of all the processes
+    sort together by duration.
+    """
+
+    def __init__(self, count: int, profile_dir: str):
+        self._count = count
+        self._folder = Path(profile_dir)
+        self._slowest: List[Tuple[float, int, str, cProfile.Profile]] = []  # Min-heap on the duration
+        self._sequence = itertools.count()  # Tie breaker, profiles don't compare
+
+    def run(self, name: str, func: Callable, *args):
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            entry = (time.perf_counter() - start, next(self._sequence), name, profile)
+            if len(self._slowest) < self._count:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def dump(self):
+        self._folder.mkdir(parents=True, exist_ok=True)
+        for elapsed, _, name, profile in self._slowest:
+            profile.dump_stats(self._folder / f"{int(elapsed * 1e6):012d}us-{os.getpid()}-{name}.prof")
+        self._slowest = []
+
+
+def clear_profiles(profile_dir: str):
+    for profile_path in Path(profile_dir).glob(PROFILE_GLOB):
+        profile_path.unlink(missing_ok=True)
+
+
+def keep_slowest_profiles(profile_dir: str, count: int):
+    """Keeps the profiles of the count slowest documents over all the processes."""
+    profile_paths = sorted(Path(profile_dir).glob(PROFILE_GLOB), reverse=True)
+    for profile_path in profile_paths[count:]:
+        profile_path.unlink(missing_ok=True)
+    if profile_paths:
+        logging.info(f"Profiles of the {min(count, len(profile_paths))} slowest document(s) saved to {profile_dir}")
@@ -0,0 +1,125 @@
+import logging
+import os
+from pathlib import Path
+import tarfile
+from typing import Iterator, List, Optional, Pattern, Tuple
+import zipfile
+import zlib
+
+import common
+from processing import sources
+from processing.sources import Document
+
+
+def compile_name_masks(document_types: common.DocumentTypes) -> List[Pattern]:
+    return [document_type.name_mask for document_type in common.compile_document_types(document_types)]
+
+
+def shard_of(relative_path: str, shard_count: int) -> int:
+    # A stable hash of the path relative to the scanned folder, the same on every host and in every run
+    return zlib.crc32(relative_path.encode("utf-8", "surrogateescape")) % shard_count
+
+
+class Scanner:
+    """Walks a folder tree with os.scandir and yields the documents lazily.
+
+    The entry types come from the directory listing (d_type), and the file names are matched against the
+    name masks of the document types before any other system call. Files no mask matches are skipped,
+    unless record_unmatched is set (they are then saved with the ERROR status).
+    The members of the archives (.zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz) and the gzip'd files (.gz) are
+    matched by their member name, without the .gz suffix, and yielded as ArchiveMember descriptors.
+    With a shard (index, count), 0 <= index < count, only the files of that shard are yielded. Several hosts
+    can split one tree that way without overlap. The archives are split by member, except the compressed tars,
+    which are read sequentially and so are not split. Without compressed_tars, they are skipped with an error
+    (e.g. when queueing jobs, a job of a member would decompress the archive up to it).
+    """
+
+    def __init__(self, document_types: common.DocumentTypes, shard: Optional[Tuple[int, int]] = None,
+                 record_unmatched: bool = False, compressed_tars: bool = True):
+        self._name_masks: List[Pattern] = compile_name_masks(document_types)
+        self._shard = shard
+        self._record_unmatched = record_unmatched
+        self._compressed_tars = compressed_tars
+        self.unmatched: int = 0
+
+    def scan(self, folder: Path) -> Iterator[Document]:
+        folders = [os.fspath(folder)]
+        while folders:
+            current = folders.pop()
+            subfolders = []
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subfolders.append(entry.path)
+                            elif sources.container_kind(entry.name):
+                                if entry.is_file():
+                                    yield from self._container_documents(folder, entry.path)
+                            elif self._accepts_name(entry.name) and entry.is_file() and \
+                                    self._in_shard(folder, entry.path):
+                                yield Path(entry.path)
+                        except (OSError, zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+                            logging.warning(f"Failed to read the entry {entry.path}: {e}")
+            except OSError as e:
+                logging.warning(f"Failed to list the folder {current}: {e}")
+            # Visited in listing order, the listing is closed before descending
+            folders.extend(reversed(subfolders))
+
+    def documents(self, folder: Path, file_path: Path) -> Iterator[Document]:
+        """The documents of this scan in a file of the folder (e.g. reported by a watcher)."""
+        try:
+            if sources.container_kind(file_path.name):
+                yield from self._container_documents(folder, os.fspath(file_path))
+            elif self._accepts_name(file_path.name) and self._in_shard(folder, os.fspath(file_path)):
+                yield file_path
+        except (OSError, zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            logging.warning(f"Failed to read {file_path}: {e}")
+
+    def _container_documents(self, folder: Path, path: str) -> Iterator[sources.ArchiveMember]:
+        kind = sources.container_kind(path)
+        if kind == sources.GZIP:
+            name = os.path.basename(path)[:-len(".gz")]
+            if self._accepts_name(name) and self._in_shard(folder, path):
+                yield sources.gzip_member(path, os.stat(path))
+        elif kind == sources.ZIP:
+            with zipfile.ZipFile(path) as zip_file:
+                for info in zip_file.infolist():
+                    if not info.is_dir() and self._accepts_member(folder, path, info.filename):
+                        yield sources.zip_member(path, info)
+        elif kind == sources.TAR:
+            with tarfile.open(path, "r:") as tar:
+                for info in tar:
+                    if info.isfile() and self._accepts_member(folder, path, info.name):
+                        yield sources.tar_member(path, info)
+        elif self._in_shard(folder, path):
+            if not self._compressed_tars:
+                logging.error(f"Skipping {path}, the members of a compressed tar can only be read in order. "
+                              f"Use a zip file, a plain tar or gzip'd documents")
+                return
+            # Read in order in a single pass, the content of the members goes with them
+            with tarfile.open(path, "r|*") as tar:
+                for info in tar:
+                    if info.isfile() and self._accepts_name(os.path.basename(info.name)):
+                        yield sources.tar_member(path, info, tar.extractfile(info).read())
+
+    def _accepts_member(self, folder: Path, path: str, member: str) -> bool:
+        return self._accepts_name(member.rsplit("/", 1)[-1]) and self._in_shard(folder, f"{path}!{member}")
+
+    def _accepts_name(self, name: str) -> bool:
+        if any(name_mask.match(name) for name_mask in self._name_masks):
+            return True
+        self.unmatched += 1
+        if self._record_unmatched:
+            return True
+        logging.debug(f"Skipping {name}, no document type matches it")
+        return False
+
+    def _in_shard(self, folder: Path, path: str) -> bool:
+        if self._shard is None:
+            return True
+        prefix = os.path.join(os.fspath(folder), "")
+        # The paths of the walk start with the folder, relpath would call getcwd for every file
+        relative_path = path[len(prefix):] if path.startswith(prefix) else os.path.relpath(path, folder)
+        index, count = self._shard
+        return shard_of(relative_path.replace(os.sep, "/"), count) == index
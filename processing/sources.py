@@ -0,0 +1,178 @@
+import gzip
+import io
+import os
+from pathlib import Path
+import posixpath
+import struct
+import tarfile
+import threading
+import time
+from typing import BinaryIO, Dict, NamedTuple, Optional, Union
+import zipfile
+
+# The kinds of the document containers, by file name suffix
+ZIP = "zip"
+TAR = "tar"
+COMPRESSED_TAR = "compressed tar"
+GZIP = "gzip"
+_SUFFIXES = ((".zip", ZIP), (".tar", TAR), (".tar.gz", COMPRESSED_TAR), (".tgz", COMPRESSED_TAR),
+             (".tar.bz2", COMPRESSED_TAR), (".tar.xz", COMPRESSED_TAR), (".gz", GZIP))
+
+MAX_OPEN_ZIP_FILES = 8  # Per process, their central directories are read once
+
+
+def container_kind(name: str) -> Optional[str]:
+    """The kind of the archive or compressed file, None for other files."""
+    name = name.lower()
+    for suffix, kind in _SUFFIXES:
+        if name.endswith(suffix):
+            return kind
+    return None
+
+
+class MemberStat(NamedTuple):
+    st_size: int
+    st_mtime_ns: int
+
+
+class ArchiveMember:
+    """A document inside an archive, or a gzip'd document, which stands in for the Path of a plain document.
+
+    It is matched against the name masks by its member name (without the .gz suffix for a gzip'd document), and
+    open() returns a stream decompressed on the fly, so that nothing is unpacked to disk. It is a small picklable
+    descriptor that the pool workers open themselves, except for the members of compressed tars, which can only be
+    read in order: the scanner reads them and the descriptor carries their content.
+    """
+
+    __slots__ = ("archive", "member", "size", "mtime_ns", "offset", "content")
+
+    def __init__(self, archive: str, member: str, size: int, mtime_ns: int, offset: Optional[int] = None,
+                 content: Optional[bytes] = None):
+        self.archive = archive
+        self.member = member
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.offset = offset  # The data offset of the member of an uncompressed tar
+        self.content = content
+
+    @property
+    def name(self) -> str:
+        return posixpath.basename(self.member)
+
+    def open(self, mode: str = "rb") -> BinaryIO:
+        if mode != "rb":
+            raise ValueError(f"{self} can only be opened in binary mode")
+        if self.content is not None:
+            return io.BytesIO(self.content)
+        kind = container_kind(self.archive)
+        if kind == GZIP:
+            return gzip.open(self.archive, "rb")
+        if kind == ZIP:
+            return _zip_file(self.archive).open(self.member)
+        if kind == TAR and self.offset is not None:
+            f = open(self.archive, "rb")
+            f.seek(self.offset)
+            return io.BufferedReader(_Section(f, self.size))
+        # A member of a compressed tar referred to by name (e.g. by a job): the archive is read up to the member
+        with tarfile.open(self.archive, "r:*") as tar:
+            return io.BytesIO(tar.extractfile(self.member).read())
+
+    def read_bytes(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def stat(self) -> MemberStat:
+        return MemberStat(self.size, self.mtime_ns)
+
+    def resolve(self) -> "ArchiveMember":
+        return ArchiveMember(os.path.abspath(self.archive), self.member, self.size, self.mtime_ns, self.offset,
+                             self.content)
+
+    def __str__(self) -> str:
+        return self.archive if container_kind(self.archive) == GZIP else f"{self.archive}!{self.member}"
+
+    def __repr__(self) -> str:
+        return f"ArchiveMember({str(self)!r})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ArchiveMember) and (self.archive, self.member) == (other.archive, other.member)
+
+    def __hash__(self) -> int:
+        return hash((self.archive, self.member))
+
+
+Document = Union[Path, ArchiveMember]
+
+
+def gzip_member(path: str, stat: os.stat_result) -> ArchiveMember:
+    # The size is the uncompressed one, from the gzip trailer (modulo 2^32)
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        size = struct.unpack("<I", f.read(4))[0]
+    return ArchiveMember(path, os.path.basename(path)[:-len(".gz")], size, stat.st_mtime_ns)
+
+
+def zip_member(path: str, info: zipfile.ZipInfo) -> ArchiveMember:
+    return ArchiveMember(path, info.filename, info.file_size, int(time.mktime(info.date_time + (0, 0, -1)) * 1e9))
+
+
+def tar_member(path: str, info: tarfile.TarInfo, content: Optional[bytes] = None) -> ArchiveMember:
+    return ArchiveMember(path, info.name, info.size, int(info.mtime * 1e9),
+                         info.offset_data if content is None else None, content)
+
+
+def parse_document(document: str) -> Document:
+    """The document of its str(), e.g. the path of a job of the job queue."""
+    archive, separator, member = document.partition("!")
+    if separator and container_kind(archive) in (ZIP, TAR, COMPRESSED_TAR) and os.path.isfile(archive):
+        if container_kind(archive) == ZIP:
+            return zip_member(archive, _zip_file(archive).getinfo(member))
+        with tarfile.open(archive, "r:*") as tar:
+            return tar_member(archive, tar.getmember(member))
+    if container_kind(document) == GZIP:
+        return gzip_member(document, os.stat(document))
+    return Path(document)
+
+
+class _Section(io.RawIOBase):
+    """The bytes of a file from its current position, up to a size."""
+
+    def __init__(self, f: BinaryIO, size: int):
+        self._f = f
+        self._remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        read = self._f.readinto(memoryview(buffer)[:self._remaining])
+        self._remaining -= read
+        return read
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+_zip_files: Dict[str, zipfile.ZipFile] = {}
+_zip_files_lock = threading.Lock()
+
+def _zip_file(path: str) -> zipfile.ZipFile:
+    # Reading several members of one ZipFile at a time is safe, closing it lets the open members finish
+    with _zip_files_lock:
+        zip_file = _zip_files.get(path)
+        if zip_file is None:
+            if len(_zip_files) >= MAX_OPEN_ZIP_FILES:
+                _zip_files.pop(next(iter(_zip_files))).close()
+            zip_file = _zip_files[path] = zipfile.ZipFile(path)
+        return zip_file
+
+def _forget_zip_files():
+    # A forked worker must not share the file positions of the zip files of its parent
+    global _zip_files_lock
+    _zip_files.clear()
+    _zip_files_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_forget_zip_files)
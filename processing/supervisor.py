@@ -0,0 +1,162 @@
+import logging
+from multiprocessing.connection import Connection
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+from typing import Optional
+
+import common
+import metrics
+from processing.sources import Document
+from templates import factory
+from validation.validation_rules import Discrepancy
+
+# The discrepancy types of the documents over their budgets
+TIME_BUDGET_EXCEEDED = "time_budget_exceeded"
+MEMORY_BUDGET_EXCEEDED = "memory_budget_exceeded"
+
+_HELPER_EXIT_TIMEOUT = 5  # Seconds a helper gets to exit on close before it is killed
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, discrepancy_type: str, message: str):
+        super().__init__(message)
+        self.discrepancy_type = discrepancy_type
+
+    def discrepancy(self) -> dict:
+        return Discrepancy(self.discrepancy_type, None, str(self)).to_dict()
+
+
+class ExtractionSupervisor:
+    """Extracts the field values of the documents in a helper process, under per-document time and memory budgets.
+
+    The helper is started on the first document and serves the next ones with warm templates, its startup doesn't
+    count against the budgets. A document that runs over its time budget gets the helper killed (the next document
+    gets a new one), one that runs over its memory budget (the address space the helper may add to its own) fails
+    with MemoryError in the helper. Both raise BudgetExceeded. The helper is a plain subprocess, as the pool workers are daemons that can't have children.
+    """
+
+    def __init__(self, document_types: common.DocumentTypes, params: dict, time_budget: Optional[float] = None,
+                 memory_budget: Optional[int] = None):
+        self._setup = (document_types, params, memory_budget)
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget
+        self._helper: Optional[subprocess.Popen] = None
+        self._requests: Optional[Connection] = None
+        self._results: Optional[Connection] = None
+        self._lock = threading.Lock()
+
+    def extract(self, template: factory.Template, document: Document, content: bytes = None) -> dict:
+        with self._lock:
+            if self._helper is None:
+                self._start_helper()
+            self._requests.send((template.name, document, content))
+            if not self._results.poll(self.time_budget):
+                self._stop_helper(kill=True)
+                metrics.registry.increment("budget_exceeded_total", type=TIME_BUDGET_EXCEEDED)
+                raise BudgetExceeded(TIME_BUDGET_EXCEEDED,
+                                     f"The extraction took longer than the time budget of {self.time_budget} s")
+            try:
+                outcome, value = self._results.recv()
+            except EOFError:
+                exit_code = self._stop_helper(kill=True)
+                raise RuntimeError(f"The extraction process died (exit code {exit_code})")
+        if outcome == MEMORY_BUDGET_EXCEEDED:
+            metrics.registry.increment("budget_exceeded_total", type=MEMORY_BUDGET_EXCEEDED)
+            raise BudgetExceeded(MEMORY_BUDGET_EXCEEDED, f"The extraction needed more than the memory budget of "
+                                                         f"{self.memory_budget / 2 ** 20:.0f} MiB")
+        if outcome == "error":
+            raise value
+        return value
+
+    def close(self):
+        with self._lock:
+            if self._helper is not None:
+                self._stop_helper()
+
+    def _start_helper(self):
+        # The helper imports the modules of this process, wherever it was started from
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(os.path.abspath(path) for path in sys.path))
+        self._helper = subprocess.Popen([sys.executable, "-m", "processing.supervisor"], env=env,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._requests = Connection(os.dup(self._helper.stdin.fileno()), readable=False)
+        self._results = Connection(os.dup(self._helper.stdout.fileno()), writable=False)
+        self._helper.stdin.close()
+        self._helper.stdout.close()
+        self._requests.send(self._setup)
+        # Waited for here, the startup of the helper doesn't count against the time budget of the document
+        try:
+            self._results.recv()
+        except EOFError:
+            exit_code = self._stop_helper(kill=True)
+            raise RuntimeError(f"The extraction process failed to start (exit code {exit_code})")
+
+    def _stop_helper(self, kill: bool = False) -> int:
+        self._requests.close()  # The helper exits at the end of its requests
+        self._results.close()
+        try:
+            if kill:
+                self._helper.kill()
+            exit_code = self._helper.wait(_HELPER_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._helper.kill()
+            exit_code = self._helper.wait()
+        self._helper = self._requests = self._results = None
+        return exit_code
+
+
+def _address_space() -> int:
+    # The virtual memory size of this process (Linux), RLIMIT_AS applies to it
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+def serve():
+    """The helper: extracts the field values of the requested documents until the requests end."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent decides when to stop
+    requests = Connection(os.dup(sys.stdin.fileno()), writable=False)
+    results = Connection(os.dup(sys.stdout.fileno()), readable=False)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())  # Stray prints must not mix with the results
+
+    document_types, params, memory_budget = requests.recv()
+    template_factory = factory.TemplateFactory(document_types, **params)
+    template_factory.templates()  # The template modules are imported before the first document
+    results.send(("ready", None))
+    memory_limited = False
+    while True:
+        try:
+            template_name, document, content = requests.recv()
+        except EOFError:
+            break
+        try:
+            template = template_factory.get_template_by_class_name(template_name)
+            if memory_budget and not memory_limited:
+                # Once the template modules are imported, the budget is on top of what the helper needs to run
+                limit = _address_space() + memory_budget
+                hard_limit = resource.getrlimit(resource.RLIMIT_AS)[1]
+                if hard_limit != resource.RLIM_INFINITY:
+                    limit = min(limit, hard_limit)
+                resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+                memory_limited = True
+            result = ("ok", template.extract_required_fields(document, content))
+        except MemoryError:
+            result = (MEMORY_BUDGET_EXCEEDED, None)
+        except Exception as e:
+            result = ("error", e)
+        try:
+            results.send(result)
+        except MemoryError:
+            results.send((MEMORY_BUDGET_EXCEEDED, None))
+        except Exception as e:
+            # An exception that can't be pickled
+            results.send(("error", RuntimeError(str(e))))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    serve()
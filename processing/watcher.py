@@ -0,0 +1,169 @@
+from abc import ABC, abstractmethod
+import ctypes
+import ctypes.util
+import logging
+import os
+from pathlib import Path
+import select
+import struct
+import time
+from typing import Dict, List, Tuple
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, followed by the name
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+
+class FolderWatcher(ABC):
+    """Reports the files of a folder tree that were created or changed, once they are completely written."""
+
+    def __init__(self, folder: Path):
+        self._folder = folder
+
+    @abstractmethod
+    def changes(self, timeout: float) -> List[Path]:
+        """Waits up to timeout seconds for changes and returns the changed files (possibly none)."""
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InotifyWatcher(FolderWatcher):
+    """Linux inotify through ctypes: a file is reported when it is closed after writing or moved into the tree."""
+
+    def __init__(self, folder: Path):
+        super().__init__(folder)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        self._folders: Dict[int, Path] = {}  # watch descriptor -> folder
+        try:
+            self._add_tree(folder)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def changes(self, timeout: float) -> List[Path]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        changed: Dict[Path, None] = {}  # Ordered and without duplicates
+        try:
+            data = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + name_length].rstrip(b"\0")
+            offset += _EVENT.size + name_length
+
+            if mask & IN_Q_OVERFLOW:
+                logging.warning(f"Too many changes in {self._folder}, rescanning it")
+                changed.update(dict.fromkeys(_files(self._folder)))
+                continue
+            if mask & IN_IGNORED:
+                self._folders.pop(wd, None)
+                continue
+            folder = self._folders.get(wd)
+            if folder is None or not name:
+                continue
+            path = folder / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files written to a new folder before it was watched are reported too
+                    try:
+                        self._add_tree(path)
+                    except OSError as e:
+                        logging.error(f"Failed to watch {path}: {e}")
+                    changed.update(dict.fromkeys(_files(path)))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed[path] = None
+        return list(changed)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_tree(self, folder: Path):
+        for current, _, _ in os.walk(folder):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), _WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch failed for {current}: {os.strerror(errno)}")
+            self._folders[wd] = Path(current)
+
+
+class PollingWatcher(FolderWatcher):
+    """Compares the size and modification time of the files at every poll.
+
+    A changed file is reported once its size and modification time stayed the same for one poll interval, so that
+    files still being written are not reported.
+    """
+
+    def __init__(self, folder: Path, poll_interval: float = 1.0):
+        super().__init__(folder)
+        self._poll_interval = poll_interval
+        self._reported: Dict[Path, Tuple[int, int]] = self._snapshot()
+        self._previous: Dict[Path, Tuple[int, int]] = dict(self._reported)
+        self._last_poll: float = time.monotonic()
+
+    def changes(self, timeout: float) -> List[Path]:
+        wait = self._last_poll + self._poll_interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, wait))
+        self._last_poll = time.monotonic()
+
+        current = self._snapshot()
+        changed = [path for path, stat in current.items()
+                   if stat == self._previous.get(path) and stat != self._reported.get(path)]
+        for path in changed:
+            self._reported[path] = current[path]
+        for path in list(self._reported):
+            if path not in current:
+                del self._reported[path]
+        self._previous = current
+        return changed
+
+    def _snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for path in _files(self._folder):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # Removed meanwhile
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+
+def _files(folder: Path) -> List[Path]:
+    return [Path(current) / name for current, _, names in os.walk(folder) for name in names]
+
+
+def create_watcher(folder: Path, poll_interval: float = 1.0, polling: bool = False) -> FolderWatcher:
+    """An inotify watcher where available, a polling one otherwise (or if polling is set)."""
+    if not polling:
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:  # AttributeError: no inotify functions in the C library
+            logging.warning(f"inotify is not available ({e}), polling {folder} every {poll_interval} second(s)")
+    return PollingWatcher(folder, poll_interval)
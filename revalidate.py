@@ -0,0 +1,79 @@
+import argparse
+import logging
+from pathlib import Path
+
+import common
+from db.db_handlers import create_db_handler
+from main import add_template_arguments
+from processing.extraction_cache import ExtractionCache
+from templates import factory
+from validation.doc_validator import DocumentValidator, ValidationStatus
+
+# Number of documents of the same template validated together (column by column)
+BATCH_SIZE = 1000
+
+def parse_arguments(document_types: common.DocumentTypes) -> dict:
+    parser = argparse.ArgumentParser(description="Re-validates the cached documents with new template parameters")
+
+    parser.add_argument("cache", type=str, help="The path to the extraction cache file written by main.py --cache")
+    parser.add_argument("--template", dest="template", type=str, default=None,
+                        help="Re-validate only the documents of this template class")
+
+    add_template_arguments(parser, document_types)
+
+    return vars(parser.parse_args())
+
+def revalidate(cache: ExtractionCache, template_factory: factory.TemplateFactory, db_handler,
+               template_name: str = None, batch_size: int = BATCH_SIZE) -> dict:
+    # Only the validation rules run, the documents are neither read nor parsed
+    statuses = {status: 0 for status in ValidationStatus}
+    batches = {}
+    for name, template_class_name, field_values in cache.entries(template_name):
+        batch = batches.setdefault(template_class_name, [])
+        batch.append((name, field_values))
+        if len(batch) >= batch_size:
+            _revalidate_batch(template_factory.get_template_by_class_name(template_class_name), batch, db_handler,
+                              statuses)
+            batch.clear()
+
+    for template_class_name, batch in batches.items():
+        if batch:
+            _revalidate_batch(template_factory.get_template_by_class_name(template_class_name), batch, db_handler,
+                              statuses)
+    return statuses
+
+def _revalidate_batch(template: factory.Template, batch: list, db_handler, statuses: dict):
+    if template is None:
+        return
+    results = DocumentValidator.validate_batch(template, [field_values for _, field_values in batch])
+    for (name, field_values), (status, result) in zip(batch, results):
+        try:
+            DocumentValidator(Path(name), template, db_handler, field_values).save(status, result["discrepancies"])
+            statuses[status] += 1
+        except Exception as e:
+            logging.error(f"Failed to save the result of {name}: {e}")
+            statuses[ValidationStatus.NOT_PROCESSED] += 1
+
+
+if __name__ == "__main__":
+    config = common.ConfigLoader("config.json")
+
+    common.setup_logging(config.get_logging_config())
+
+    params = parse_arguments(config.document_types)
+
+    cache_path = params.pop("cache")
+    template_name = params.pop("template")
+
+    logging.info(f"Re-validating cached documents of {cache_path}. Template parameters - {params}")
+
+    cache = ExtractionCache(cache_path)
+    db_handler = create_db_handler(config.get_db_config())
+    try:
+        statuses = revalidate(cache, factory.TemplateFactory(config.document_types, **params), db_handler,
+                              template_name)
+    finally:
+        db_handler.close()
+        cache.close()
+
+    logging.info("Cached documents re-validated: " + ", ".join(f"{s.value}: {n}" for s, n in statuses.items()))
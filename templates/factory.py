@@ -1,11 +1,48 @@
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
 import logging
 from pathlib import Path
-from typing import List, Union
-import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
 
 import common
-from common import FatalError
+
+
+MISSING = object()  # Returned by a field extractor when the document has no such field
+
+
+class LazyFieldValues(Mapping):
+    """The field values of a document, each one computed by its extractor on first access and memoized."""
+
+    def __init__(self, extractors: Dict[str, Callable[[Any], Any]], document):
+        self._extractors = extractors
+        self._document = document  # The per-document state the extractors share, e.g. the parsed document
+        self._values: dict = {}
+
+    def __getitem__(self, field_name: str):
+        if field_name in self._values:
+            value = self._values[field_name]
+        else:
+            value = self._values[field_name] = self._extractors[field_name](self._document)
+        if value is MISSING:
+            raise KeyError(field_name)
+        return value
+
+    def __contains__(self, field_name) -> bool:
+        try:
+            self[field_name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return (field_name for field_name in self._extractors if field_name in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def computed(self) -> dict:
+        """The field values computed so far."""
+        return {k: v for k, v in self._values.items() if v is not MISSING}
 
 
 class Template(ABC):
@@ -16,32 +53,89 @@ class Template(ABC):
 
     @abstractmethod
     def extract_field_values(self, file_path: Path) -> dict:
+        """The field values of the document. file_path is a Path or an archive member (processing/sources.py), both
+        are read with file_path.open('rb')."""
         pass
 
+    def extract_field_values_from_bytes(self, file_path: Path, content: bytes) -> dict:
+        """Extracts the field values from the document content read beforehand."""
+        raise NotImplementedError(f"{type(self).__name__} does not support extraction from bytes")
+
+    def field_extractors(self) -> Dict[str, Callable[[Any], Any]]:
+        """Per-field extractors for lazy extraction: field name -> function of the document opened by open_document.
+
+        Templates without field extractors are extracted eagerly with extract_field_values.
+        """
+        return {}
+
+    def open_document(self, file_path: Path, content: Optional[bytes], field_names: Optional[Set[str]]):
+        """The per-document state of the field extractors, field_names are the fields that will be requested."""
+        raise NotImplementedError(f"{type(self).__name__} does not support lazy extraction")
+
+    def extract_fields(self, file_path: Path, field_names: Iterable[str] = None,
+                       content: bytes = None) -> Mapping:
+        """The field values of the document, computed on demand when the template declares field extractors."""
+        extractors = self.field_extractors()
+        if not extractors:
+            if content is None:
+                return self.extract_field_values(file_path)
+            return self.extract_field_values_from_bytes(file_path, content)
+        field_names = set(field_names) if field_names is not None else None
+        return LazyFieldValues(extractors, self.open_document(file_path, content, field_names))
+
+    def extract_required_fields(self, file_path: Path, content: bytes = None) -> dict:
+        """Extracts the fields the rules and the DB projection need (all the fields if that is not known)."""
+        field_names = self.required_fields()
+        field_values = self.extract_fields(file_path, field_names, content)
+        if field_names is None:
+            return dict(field_values)
+        return {name: field_values[name] for name in (self.field_extractors() or field_values)
+                if name in field_names and name in field_values}
+
+    def required_fields(self) -> Optional[Set[str]]:
+        """The fields used by the validation rules and saved to the DB, None if a rule may use any field."""
+        field_names = set(self.field_validation_rules) | set(self.fields_to_save_to_db())
+        for rule in self.doc_validation_rules:
+            rule_field_names = getattr(rule, "field_names", None)
+            if rule_field_names is None:
+                return None
+            field_names.update(rule_field_names)
+        return field_names
+
     @abstractmethod
     def fields_to_save_to_db(self) -> List[str]:
         pass
 
+    def field_layouts(self) -> Dict[str, str]:
+        """The storage layout of the saved fields (see db/payloads.py), text for the fields not listed."""
+        return {}
+
 
 class TemplateFactory:
-    def __init__(self, document_types: List[dict], **kwargs):
-        self._document_types: List[dict] = document_types
+    def __init__(self, document_types: common.DocumentTypes, **kwargs):
+        self._document_types: common.DocumentTypes = document_types
         self._templates: dict = {}
         self._kwargs: dict = kwargs
+        self._compiled_types: Optional[List[common.DocumentType]] = None
 
-    def _get_template_class_name(self, file_path: Path) -> str:
-        file_name = file_path.name
+    @property
+    def _types(self) -> List[common.DocumentType]:
+        # Validated and compiled once, on the first document
+        if self._compiled_types is None:
+            self._compiled_types = common.compile_document_types(self._document_types)
+        return self._compiled_types
 
-        if not self._document_types or not isinstance(self._document_types, dict):
-            raise FatalError("Document types not configured properly")
+    def templates(self) -> List[Template]:
+        """The templates of all the document types, their modules are imported."""
+        templates = (self.get_template_by_class_name(template_class)
+                     for template_class in dict.fromkeys(document_type.template_class for document_type in self._types))
+        return [template for template in templates if template is not None]
 
-        for _, type_params in self._document_types.items():
-            if (not type_params or not isinstance(type_params, dict) or
-                    not ("name_mask" in type_params) or (not "template_class" in type_params)):
-                raise FatalError("Document type params not configured properly")
-
-            if re.match(type_params["name_mask"], file_name):  # Compare against the regular expression mask
-                return type_params["template_class"]
+    def _get_template_class_name(self, file_path: Path) -> str:
+        file_name = file_path.name
+        for document_type in self._types:
+            if document_type.name_mask.match(file_name):  # Compare against the regular expression mask
+                return document_type.template_class
 
         logging.warning(f"No template found for the document: {file_path}")
         return ""
@@ -51,15 +145,25 @@ class TemplateFactory:
         if not template_class_name:
             return None
 
+        return self.get_template_by_class_name(template_class_name)
+
+    def get_template_by_class_name(self, template_class_name: str) -> Union[Template, None]:
         if template_class_name in self._templates:
             return self._templates[template_class_name]
 
+        # The template module is imported here, on the first document of its type
         template_class = common.get_class(template_class_name)
         if not template_class:
             logging.error(f"Template class '{template_class_name}' not found.")
             return None
 
-        new_template = template_class(template_class_name, **self._kwargs)
+        new_template = template_class(template_class_name, **self._template_options(template_class_name), **self._kwargs)
         self._templates[template_class_name] = new_template
         return new_template
 
+    def _template_options(self, template_class_name: str) -> dict:
+        # The "options" of the document type in the configuration, e.g. {"body_mode": "summary"}
+        for document_type in self._types:
+            if document_type.template_class == template_class_name:
+                return {k: v for k, v in document_type.options.items() if k not in self._kwargs}
+        return {}
@@ -0,0 +1,167 @@
+from html.parser import HTMLParser
+import re
+from typing import Callable, Dict, List, Optional
+
+
+class HTMLTableExtractor(HTMLParser):
+    """Event-driven extraction of the caption, header, body rows and footer of an HTML table in one pass.
+
+    No document tree is built: only the text of the table parts is collected. The text of an element is the
+    concatenation of its stripped text nodes, like BeautifulSoup's get_text(strip=True). As with soup.find(),
+    only the first caption, thead, tbody and tfoot of the document are used.
+    With parse_body=False only the first body row is kept: the rest of the body is skipped with a plain text search
+    for the closing </tbody> tag, and the parsing stops at the end of the table.
+    With an on_row callback every body row is passed to it and only the first one is kept, so that the memory used
+    depends on the row width and not on the number of rows.
+    """
+
+    _SECTIONS = ("caption", "thead", "tbody", "tfoot")
+    _BODY_END = re.compile(r"</tbody", re.IGNORECASE)
+
+    def __init__(self, parse_body: bool = True, on_row: Callable[[List[str]], None] = None):
+        super().__init__(convert_charrefs=True)
+        self.parse_body: bool = parse_body
+        self.on_row: Optional[Callable[[List[str]], None]] = on_row
+        self.caption: Optional[str] = None
+        self.header: List[str] = []
+        self.body: List[List[str]] = []
+        self.footer: Optional[str] = None
+        self.has_body: bool = False
+        self.done: bool = False
+
+        self._open_sections: Dict[str, int] = {}  # section tag -> nesting depth
+        self._found_sections: set = set()
+        self._section_text: Dict[str, List[str]] = {"caption": [], "tfoot": []}
+        self._pending_text: List[str] = []
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+        self._cell_target: Optional[List[str]] = None
+        self._table_depth: int = 0
+        self._skipping_body: bool = False
+        self._skipped_tail: str = ""
+
+    def feed(self, data: str):
+        if self._skipping_body:
+            data = self._skip_body(data)
+            if not data:
+                return
+        super().feed(data)
+        if self._skipping_body:
+            # Whatever the parser buffered is part of the body being skipped
+            self._skipped_tail, self.rawdata = self.rawdata, ""
+            self._pending_text = []
+
+    def handle_starttag(self, tag: str, attrs):
+        if self.done:
+            return
+        self._flush_text()
+        if tag == "table":
+            self._table_depth += 1
+        elif tag in self._SECTIONS:
+            if tag in self._open_sections:
+                self._open_sections[tag] += 1
+            elif tag not in self._found_sections:
+                self._open_sections[tag] = 1
+                self._found_sections.add(tag)
+                self.has_body = self.has_body or tag == "tbody"
+        elif tag == "th" and "thead" in self._open_sections:
+            self._start_cell(self.header)
+        elif tag == "tr" and "tbody" in self._open_sections:
+            self._end_row()
+            self._row = []
+        elif tag == "td" and self._row is not None:
+            self._start_cell(self._row)
+
+    def handle_endtag(self, tag: str):
+        if self.done:
+            return
+        self._flush_text()
+        if tag == "table":
+            self._table_depth -= 1
+            if self._table_depth <= 0 and not self.parse_body and self.body:
+                self._finish()
+        elif tag in self._open_sections:
+            self._open_sections[tag] -= 1
+            if self._open_sections[tag] == 0:
+                self._close_section(tag)
+        elif tag in ("th", "td"):
+            self._end_cell()
+        elif tag == "tr":
+            self._end_row()
+
+    def handle_data(self, data: str):
+        # A text node can be split across several calls when the input is fed in chunks
+        self._pending_text.append(data)
+
+    def close(self):
+        super().close()
+        self._finish()
+
+    def _flush_text(self):
+        if not self._pending_text:
+            return
+        text = "".join(self._pending_text).strip()
+        self._pending_text = []
+        if not text or self.done:
+            return
+        if self._cell is not None:
+            self._cell.append(text)
+        for section, texts in self._section_text.items():
+            if section in self._open_sections:
+                texts.append(text)
+
+    def _start_cell(self, target: List[str]):
+        self._end_cell()
+        self._cell = []
+        self._cell_target = target
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._cell_target.append("".join(self._cell))
+            self._cell = self._cell_target = None
+
+    def _end_row(self):
+        if self._row is None:
+            return
+        if self._cell_target is self._row:
+            self._end_cell()
+        if self.on_row is not None:
+            self.on_row(self._row)
+        if not self.body or (self.parse_body and self.on_row is None):
+            self.body.append(self._row)
+        self._row = None
+        if not self.parse_body and self._open_sections.get("tbody") == 1:
+            self._skipping_body = True
+
+    def _close_section(self, tag: str):
+        del self._open_sections[tag]
+        if tag == "caption":
+            self.caption = "".join(self._section_text["caption"])
+        elif tag == "tfoot":
+            self.footer = "".join(self._section_text["tfoot"])
+        elif tag == "thead":
+            self._end_cell()
+        elif tag == "tbody":
+            self._end_row()
+            self._skipping_body = False
+
+    def _skip_body(self, data: str) -> str:
+        data = self._skipped_tail + data
+        body_end = self._BODY_END.search(data)
+        if not body_end:
+            # Keep enough characters to find a closing tag split between two chunks
+            self._skipped_tail = data[-len("</tbody"):]
+            return ""
+        self._skipping_body = False
+        self._skipped_tail = ""
+        return data[body_end.start():]
+
+    def _finish(self):
+        if self.done:
+            return
+        self._flush_text()
+        self._end_row()
+        self._end_cell()
+        for tag in list(self._open_sections):
+            self._close_section(tag)
+        self.done = True
@@ -1,28 +1,70 @@
-from bs4 import BeautifulSoup
 from datetime import datetime
+from functools import cached_property
+import hashlib
+import io
 from pathlib import Path
 import re
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Set, TextIO
 
 from common import TemplateError, FatalError
+from db import payloads
 from templates import factory
+from templates.html_table_extractor import HTMLTableExtractor
 from validation.validation_rules import DocRuleBuilder, FieldRuleBuilder
 
+class BodySummary:
+    """The row count and the SHA-256 of str(body) of a table body, computed row by row."""
+
+    def __init__(self):
+        self.rows: int = 0
+        self._digest = hashlib.sha256(b"[")
+
+    def add_row(self, row: List[str]):
+        self._digest.update(((", " if self.rows else "") + str(row)).encode("utf-8"))
+        self.rows += 1
+
+    def hexdigest(self) -> str:
+        digest = self._digest.copy()
+        digest.update(b"]")
+        return digest.hexdigest()
+
+
 class HTMLTableTemplate(factory.Template):
+    READ_CHUNK_SIZE = 8 * 1024
+    # How the table body is saved: as a whole, as a row count and digest (bounded memory) or not at all
+    BODY_MODES = ("full", "summary", "none")
+    FIELDS_TO_SAVE = ("title", "header", "body", "body_rows", "body_digest", "footer", "creation_country", "creation_date")
+
     def __init__(self, name: str, **kwargs):
         try:
             super().__init__(name, **kwargs)
 
+            # The body is only needed to be saved to the DB, validation uses the first row only
+            self.body_mode: str = kwargs.get("body_mode") or ("full" if kwargs.get("parse_body", True) else "none")
+            if self.body_mode not in self.BODY_MODES:
+                raise FatalError(f"Invalid body mode '{self.body_mode}', expected one of {self.BODY_MODES}")
+            # Documents bigger than this (in bytes) are saved with a body summary even in the full mode
+            self.stream_threshold: Optional[int] = kwargs.get("stream_threshold")
+            # The fields saved to the DB, the ones not saved nor validated are not extracted (e.g. the body). Either a
+            # list of names or a dict of the storage layout of each field
+            fields_to_save = kwargs.get("fields_to_save") or self.FIELDS_TO_SAVE
+            self.fields_to_save: List[str] = list(fields_to_save)
+            self.layouts: Dict[str, str] = dict(fields_to_save) if isinstance(fields_to_save, dict) else {}
+            for field_name, layout in self.layouts.items():
+                if layout not in payloads.LAYOUTS:
+                    raise FatalError(f"Invalid layout '{layout}' of the field '{field_name}', "
+                                     f"expected one of {payloads.LAYOUTS}")
+
             if not ("N" in kwargs and "D" in kwargs and "SUM" in kwargs):
                 raise FatalError("Missing template parameter(s)")
 
             self.field_validation_rules = {
                 "title":
-                    FieldRuleBuilder().add_mandatory_check().add_min_length_check(kwargs["N"]).get_validation_rules(),
+                    FieldRuleBuilder().add_mandatory_check().add_min_length_check(kwargs["N"]).compile(),
                 "creation_date":
-                    FieldRuleBuilder().add_mandatory_check().add_type_check("date%d%b%Y").add_max_check(kwargs["D"]).get_validation_rules(),
+                    FieldRuleBuilder().add_mandatory_check().add_type_check("date%d%b%Y").add_max_check(kwargs["D"]).compile(),
                 "first_row_sum":
-                    FieldRuleBuilder().add_mandatory_check().add_type_check("int").add_max_check(kwargs["SUM"]).get_validation_rules()
+                    FieldRuleBuilder().add_mandatory_check().add_type_check("int").add_max_check(kwargs["SUM"]).compile()
             }
 
             self.doc_validation_rules = {}
@@ -30,37 +72,31 @@ class HTMLTableTemplate(factory.Template):
             raise TemplateError from e
 
     def extract_field_values(self, file_path: Path) -> dict:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        return dict(self.extract_fields(file_path))
 
-        soup = BeautifulSoup(html_content, 'html.parser')
+    def extract_field_values_from_bytes(self, file_path: Path, content: bytes) -> dict:
+        return dict(self.extract_fields(file_path, content=content))
 
-        # Extract title from the <caption> tag
-        title = soup.find('caption').get_text(strip=True) if soup.find('caption') else None
+    def field_extractors(self) -> Dict[str, Callable[["_TableDocument"], Any]]:
+        return self._FIELD_EXTRACTORS
 
-        # Extract header from the <thead> tag
-        header = [th.get_text(strip=True) for th in soup.find('thead').find_all('th')] if soup.find('thead') else []
+    def open_document(self, file_path: Path, content: Optional[bytes],
+                      field_names: Optional[Set[str]]) -> "_TableDocument":
+        body_mode = self.body_mode
+        if field_names is not None and not field_names & self._BODY_FIELDS:
+            body_mode = "none"  # The body is not needed, it is skipped
+        return _TableDocument(self, file_path, content, body_mode)
 
-        # Extract body from the <tbody> tag (row data)
-        body = []
-        for row in soup.find('tbody').find_all('tr'):
-            cells = [td.get_text(strip=True) for td in row.find_all('td')]
-            body.append(cells)
+    def fields_to_save_to_db(self) -> List[str]:
+        return self.fields_to_save
 
-        # Extract footer from the <tfoot> tag
-        footer = soup.find('tfoot').get_text(strip=True) if soup.find('tfoot') else ""
-
-        # Parse footer to extract creation date and country
-        creation_info = re.search(r'Creation: (\d+\w+\d{4}) (.+)$', footer)
-        if creation_info:
-            creation_date = creation_info.group(1)  # E.g., "10Mar2010"
-            creation_country = creation_info.group(2)  # E.g., "Cayman Islands"
-        else:
-            creation_date = None
-            creation_country = None
+    def field_layouts(self) -> Dict[str, str]:
+        return self.layouts
 
+    @staticmethod
+    def _first_row_sum(document: "_TableDocument") -> str:
         # Extract and sum the first row of numeric values in the body
-        first_row = body[0][1:]  # Skipping the first column (it’s likely a name/label)
+        first_row = document.table.body[0][1:]  # Skipping the first column (it’s likely a name/label)
         first_row_sum = 0
         for value in first_row:
             try:
@@ -70,17 +106,79 @@ class HTMLTableTemplate(factory.Template):
             except ValueError:
                 # Skip values that are not convertible to integers
                 pass
-
-        return {
-            "title": title,
-            "header": str(header),
-            "body": str(body),
-            "footer": footer,
-            "creation_date": creation_date,
-            "creation_country": creation_country,
-            "first_row_sum": str(first_row_sum)
-        }
-
-    def fields_to_save_to_db(self) -> List[str]:
-        return ["title", "header", "body", "footer", "creation_country", "creation_date"]
-
+        return str(first_row_sum)
+
+    _BODY_FIELDS = frozenset(("body", "body_rows", "body_digest"))
+    _FIELD_EXTRACTORS = {
+        "title": lambda document: document.table.caption,
+        "header": lambda document: document.table.header,
+        "body": lambda document: document.body,
+        "footer": lambda document: document.footer,
+        "creation_date": lambda document: document.creation_info[0],
+        "creation_country": lambda document: document.creation_info[1],
+        "first_row_sum": lambda document: HTMLTableTemplate._first_row_sum(document),
+        "body_rows": lambda document: document.summary.rows if document.summary else factory.MISSING,
+        "body_digest": lambda document: document.summary.hexdigest() if document.summary else factory.MISSING,
+    }
+
+
+class _TableDocument:
+    """An HTML table document, parsed on first use in the body mode the requested fields need."""
+
+    def __init__(self, template: HTMLTableTemplate, file_path: Path, content: Optional[bytes], body_mode: str):
+        self._template = template
+        self._file_path = file_path
+        self._content = content
+        self.body_mode = body_mode  # Set to "summary" when parsing a document above the stream threshold
+        self._body_summary: Optional[BodySummary] = None
+
+    @cached_property
+    def table(self) -> HTMLTableExtractor:
+        if self._content is not None:
+            return self._parse(io.TextIOWrapper(io.BytesIO(self._content), encoding='utf-8'), len(self._content))
+        # A Path or an archive member, decompressed on the fly
+        with io.TextIOWrapper(self._file_path.open('rb'), encoding='utf-8') as f:
+            return self._parse(f, self._file_path.stat().st_size)
+
+    @property
+    def body(self) -> Optional[List[List[str]]]:
+        table = self.table
+        return table.body if self.body_mode == "full" else None
+
+    @property
+    def summary(self) -> Optional[BodySummary]:
+        _ = self.table
+        return self._body_summary
+
+    @cached_property
+    def footer(self) -> str:
+        return self.table.footer if self.table.footer is not None else ""
+
+    @cached_property
+    def creation_info(self) -> tuple:
+        # Parse footer to extract creation date and country
+        creation_info = re.search(r'Creation: (\d+\w+\d{4}) (.+)$', self.footer)
+        if creation_info:
+            return creation_info.group(1), creation_info.group(2)  # E.g., "10Mar2010", "Cayman Islands"
+        return None, None
+
+    def _parse(self, f: TextIO, size: int) -> HTMLTableExtractor:
+        threshold = self._template.stream_threshold
+        if self.body_mode == "full" and threshold is not None and size > threshold:
+            self.body_mode = "summary"
+        self._body_summary = BodySummary() if self.body_mode == "summary" else None
+        extractor = HTMLTableExtractor(parse_body=self.body_mode != "none",
+                                       on_row=self._body_summary.add_row if self._body_summary else None)
+        # Without the body the parsing stops at the end of the table, the rest of the file is not read
+        while not extractor.done:
+            chunk = f.read(self._template.READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            extractor.feed(chunk)
+        extractor.close()
+
+        if not extractor.has_body:
+            raise ValueError("The table body (<tbody>) is missing")
+        if not extractor.body:
+            raise ValueError("The table body has no rows")
+        return extractor
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The tests import the project modules as the entry points do, from the project root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
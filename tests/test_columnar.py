@@ -0,0 +1,91 @@
+"""The batch (columnar) validation must give the same results as the per-document validation, with and without
+NumPy."""
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from templates.html_table_template import HTMLTableTemplate
+from validation import columnar
+from validation.doc_validator import DocumentValidator
+from validation.validation_rules import FieldRuleBuilder
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+
+DOCUMENTS = {
+    "valid": [
+        {"title": "Annual revenue report", "creation_date": "10Mar2010", "first_row_sum": "1000"},
+        {"title": "Balance", "creation_date": "10Mar2020", "first_row_sum": "-20"},
+    ],
+    "invalid": [
+        {"title": "Q1", "creation_date": "11Mar2020", "first_row_sum": "1001"},
+        {"title": "Quarterly figures", "creation_date": "1Jan2030", "first_row_sum": "99999999999999999999999"},
+    ],
+    "missing": [
+        {"title": None, "creation_date": None, "first_row_sum": None},
+        {"title": "", "creation_date": "", "first_row_sum": ""},
+        {},
+    ],
+    "mistyped": [
+        {"title": 7, "creation_date": "not a date", "first_row_sum": "12a"},
+        {"title": "Annual revenue report", "creation_date": "10Mar2010", "first_row_sum": 12},
+        {"title": ["a", "list"], "creation_date": "31Feb2010", "first_row_sum": "1.5"},
+    ],
+}
+
+
+@pytest.fixture(params=["numpy", "no numpy"])
+def numpy_mode(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        assert columnar._load_numpy()
+    else:
+        monkeypatch.setattr(columnar, "np", None)
+        monkeypatch.setattr(columnar, "_numpy_loaded", True)
+    return request.param
+
+
+@pytest.fixture
+def template():
+    return HTMLTableTemplate("HTMLTableTemplate", **PARAMS)
+
+
+@pytest.mark.parametrize("kind", [*DOCUMENTS, "all"])
+def test_batch_matches_scalar(numpy_mode, template, kind):
+    documents = [document for documents in DOCUMENTS.values() for document in documents] if kind == "all" \
+        else DOCUMENTS[kind]
+    expected = [DocumentValidator(Path("1_table.html"), template, None, dict(document)).validate()
+                for document in documents]
+    assert DocumentValidator.validate_batch(template, [dict(document) for document in documents]) == expected
+
+
+@pytest.mark.parametrize("rules, values", [
+    (FieldRuleBuilder().add_type_check("int").add_min_check(0).add_max_check(10),
+     ["-1", "0", "5", "10", "11", None, "x", "99999999999999999999999"]),
+    (FieldRuleBuilder().add_type_check("date%d%b%Y").add_min_check(datetime(2010, 1, 1))
+     .add_max_check(datetime(2020, 1, 1)), ["31Dec2009", "1Jan2010", "1Jan2020", "2Jan2020", None, "someday"]),
+    (FieldRuleBuilder().add_mandatory_check().add_min_length_check(2).add_max_length_check(3),
+     ["a", "ab", "abc", "abcd", "", None, 5]),
+])
+def test_column_matches_scalar(numpy_mode, rules, values):
+    pipeline = rules.compile()
+    expected_discrepancies = [[] for _ in values]
+    expected_errors = [not pipeline("field", value, expected_discrepancies[i]) for i, value in enumerate(values)]
+    discrepancies = [[] for _ in values]
+    errors = [False] * len(values)
+    columnar.validate_column("field", pipeline, values, discrepancies, errors)
+    assert (discrepancies, errors) == (expected_discrepancies, expected_errors)
+
+
+def test_thresholds_compared_as_native_arrays():
+    np = pytest.importorskip("numpy")
+    columnar._load_numpy()
+    for param, typed_values, dtype in ((10, [1, None, 30], np.int64),
+                                       (datetime(2020, 1, 1), [datetime(2019, 1, 1), None], np.dtype("datetime64[us]")),
+                                       ("b", ["a", "c"], object)):
+        column = columnar._Column("field", typed_values)
+        column.typed_values = typed_values
+        present, array, threshold = columnar._typed_array(column, param)
+        assert array.dtype == dtype
+        assert list(present) == [value is not None for value in typed_values]
+        assert list(array > threshold) == [value is not None and value > param for value in typed_values]
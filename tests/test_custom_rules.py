@@ -0,0 +1,39 @@
+"""The custom rules accept only the whitelisted expressions and can't exhaust the memory."""
+import pytest
+
+from common import TemplateError
+from validation.custom_rules import MAX_REPEAT_LENGTH, CustomRule
+
+
+@pytest.mark.parametrize("rule_code", [
+    "title.upper()", "__import__('os')", "_secret", "open('x')", "2 ** 100000",
+    '"x" * 10000000000', "10000000000 * 'x'", "[0] * 10000000000", "(1, 2) * N", "[x for x in title] * N",
+    "len('%0200000000d' % N) > 0", "len(b'%0200000000d' % N) > 0",
+])
+def test_rejected(rule_code):
+    with pytest.raises(TemplateError):
+        CustomRule(rule_code, {"N": 10})
+
+
+@pytest.mark.parametrize("rule_code, params, field_values, expected", [
+    ("len(title) >= N", {"N": 5}, {"title": "Annual report"}, True),
+    ("first_row_sum * 2 <= SUM", {"SUM": 1000}, {"first_row_sum": 600}, False),
+    ("len(title * N) == 6", {"N": 2}, {"title": "abc"}, True),
+    ("sum(x * 2 for x in values) == 12", {}, {"values": [1, 2, 3]}, True),
+    ('fields["first row"] * 1.5 > 2', {}, {"first row": 2}, True),
+    ("first_row_sum % N == 1", {"N": 2}, {"first_row_sum": 7}, True),
+])
+def test_evaluated(rule_code, params, field_values, expected):
+    assert CustomRule(rule_code, params)(field_values) is expected
+
+
+def test_repetition_limited_at_run_time():
+    rule = CustomRule("len(title * N) > 0", {"N": MAX_REPEAT_LENGTH})
+    with pytest.raises(ValueError):
+        rule({"title": "ab"})
+    assert CustomRule("len(title * N) > 0", {"N": MAX_REPEAT_LENGTH})({"title": "a"})
+
+
+def test_formatting_rejected_at_run_time():
+    with pytest.raises(ValueError):
+        CustomRule("len(title % N) > 0", {"N": 1})({"title": "%0200000000d"})
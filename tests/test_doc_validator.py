@@ -0,0 +1,65 @@
+"""The documents and discrepancies are counted (run summary and metrics) once they are saved, not when saving
+fails."""
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import common
+from db.memory_handler import InMemoryDbHandler
+import metrics
+from templates.html_table_template import HTMLTableTemplate
+from validation import doc_validator
+from validation.doc_validator import DocumentValidator
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+INVALID = {"title": "Q1", "creation_date": "11Mar2020", "first_row_sum": "1001"}
+
+
+class RecordingSummary(common.RunSummary):
+    def __init__(self):
+        super().__init__()
+        self.statuses = []
+
+    def record(self, status: str, discrepancies: list):
+        self.statuses.append(status)
+
+
+class FailingDbHandler(InMemoryDbHandler):
+    def insert_document(self, document_info: dict) -> str:
+        raise ConnectionError("The database is gone")
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    registry = metrics.MetricsRegistry()
+    registry.enabled = True
+    monkeypatch.setattr(metrics, "registry", registry)
+    monkeypatch.setattr(doc_validator, "run_summary", RecordingSummary())
+
+    def totals() -> dict:
+        # Summed over the labels
+        values = {}
+        for counter in registry.snapshot()["counters"]:
+            values[counter["name"]] = values.get(counter["name"], 0) + counter["value"]
+        return values
+    return totals
+
+
+@pytest.fixture
+def template():
+    return HTMLTableTemplate("HTMLTableTemplate", **PARAMS)
+
+
+def test_saved_documents_are_counted(counters, template):
+    db_handler = InMemoryDbHandler()
+    status = DocumentValidator(Path("1_table.html"), template, db_handler, dict(INVALID)).process()
+    assert status == doc_validator.ValidationStatus.INVALID
+    assert counters() == {"documents_total": 1, "discrepancies_total": len(db_handler.discrepancies)}
+    assert doc_validator.run_summary.statuses == ["INVALID"]
+
+
+def test_failed_saves_are_not_counted(counters, template):
+    assert DocumentValidator(Path("1_table.html"), template, FailingDbHandler(), dict(INVALID)).process() is None
+    assert counters() == {}
+    assert doc_validator.run_summary.statuses == []
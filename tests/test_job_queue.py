@@ -0,0 +1,162 @@
+"""The job queue of the distributed mode: claims, leases, releases, attempts and the records of the documents
+processed again, on the in-memory stand-in and on SQLite."""
+from datetime import datetime
+from pathlib import Path
+import time
+import zipfile
+
+import pytest
+
+import common
+from benchmarks.corpus import write_table
+from db.db_handlers import JOB_DONE, JOB_FAILED, JOB_LEASED, JOB_QUEUED
+from db.memory_handler import InMemoryDbHandler
+from db.sqlite_handler import SQLiteDbHandler
+from processing import job_queue
+from processing.document_processor import DocumentProcessor, ProcessingOutcome
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+CONFIG = Path(__file__).resolve().parent.parent / "config.json"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db_handler(request, tmp_path):
+    handler = InMemoryDbHandler() if request.param == "memory" else \
+        SQLiteDbHandler({"path": str(tmp_path / "queue.db")})
+    yield handler
+    handler.close()
+
+
+class RecordingProcessor:
+    """Records the documents it is asked to process."""
+
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+        self.processed = []
+
+    def process_file(self, file_path: Path, document_id: str = None) -> ProcessingOutcome:
+        self.processed.append(str(file_path))
+        return ProcessingOutcome.PROCESSED
+
+    def flush(self):
+        pass
+
+
+def test_enqueue_is_idempotent(db_handler):
+    assert db_handler.enqueue_jobs(["/a", "/b"], ["1-1", "1-1"]) == 2
+    assert db_handler.enqueue_jobs(["/a", "/b", "/c"], ["1-1", "1-1", "1-1"]) == 1
+    assert db_handler.job_counts() == {JOB_QUEUED: 3}
+
+
+def test_enqueue_requeues_changed_documents(db_handler):
+    db_handler.enqueue_jobs(["/a", "/b"], ["1-1", "1-1"])
+    jobs = db_handler.claim_jobs("w1", 2, 60)
+    assert db_handler.release_jobs("w1", [job["_id"] for job in jobs]) == 2
+
+    assert db_handler.enqueue_jobs(["/a", "/b"], ["1-1", "1-1"]) == 0
+    assert db_handler.job_counts() == {JOB_DONE: 2}
+    assert db_handler.enqueue_jobs(["/a", "/b"], ["1-1", "2-2"]) == 1
+    assert db_handler.job_counts() == {JOB_DONE: 1, JOB_QUEUED: 1}
+    assert db_handler.claim_jobs("w2", 2, 60) == [{"_id": "/b", "path": "/b", "attempts": 1}]
+
+
+def test_enqueue_without_versions(db_handler):
+    db_handler.enqueue_jobs(["/a"])
+    db_handler.release_jobs("w1", [job["_id"] for job in db_handler.claim_jobs("w1", 1, 60)])
+    assert db_handler.enqueue_jobs(["/a"]) == 0
+    # A job queued without a version takes the first one given as it is, the next change queues it again
+    assert db_handler.enqueue_jobs(["/a"], ["1-1"]) == 0
+    assert db_handler.enqueue_jobs(["/a"], ["2-2"]) == 1
+
+
+def test_claim(db_handler):
+    db_handler.enqueue_jobs(["/a", "/b", "/c"])
+    first = db_handler.claim_jobs("w1", 2, 60)
+    second = db_handler.claim_jobs("w2", 2, 60)
+    assert len(first) == 2 and len(second) == 1
+    assert {job["_id"] for job in first + second} == {"/a", "/b", "/c"}
+    assert all(job["attempts"] == 1 for job in first + second)
+    assert db_handler.claim_jobs("w3", 2, 60) == []
+    assert db_handler.job_counts() == {JOB_LEASED: 3}
+
+
+def test_lease_expiry(db_handler):
+    db_handler.enqueue_jobs(["/a"])
+    [job] = db_handler.claim_jobs("w1", 1, 0.05)
+    assert db_handler.claim_jobs("w2", 1, 60) == []
+    time.sleep(0.1)
+    assert db_handler.job_counts() == {JOB_QUEUED: 1}
+
+    assert db_handler.claim_jobs("w2", 1, 60) == [{"_id": "/a", "path": "/a", "attempts": 2}]
+    # The first worker lost the lease, its renewals and releases are ignored
+    assert db_handler.renew_leases("w1", [job["_id"]], 60) == 0
+    assert db_handler.release_jobs("w1", [job["_id"]]) == 0
+    assert db_handler.job_counts() == {JOB_LEASED: 1}
+    assert db_handler.renew_leases("w2", [job["_id"]], 60) == 1
+    assert db_handler.release_jobs("w2", [job["_id"]]) == 1
+    assert db_handler.job_counts() == {JOB_DONE: 1}
+
+
+def test_release_hands_jobs_back(db_handler):
+    db_handler.enqueue_jobs(["/a"])
+    [job] = db_handler.claim_jobs("w1", 1, 60)
+    assert db_handler.release_jobs("w1", [job["_id"]], JOB_QUEUED) == 1
+    assert db_handler.claim_jobs("w2", 1, 60) == [{"_id": "/a", "path": "/a", "attempts": 2}]
+
+
+def test_max_attempts(db_handler, tmp_path):
+    paths = [str(tmp_path / "1_table.html"), str(tmp_path / "2_table.html")]
+    # The first job was claimed by two workers that died
+    db_handler.enqueue_jobs(paths[:1])
+    for _ in range(2):
+        assert db_handler.claim_jobs("dead", 1, 0)
+    db_handler.enqueue_jobs(paths[1:])
+    processor = RecordingProcessor(db_handler)
+    outcomes = job_queue.QueueWorker(processor, max_attempts=2).run()
+
+    assert processor.processed == paths[1:]
+    assert outcomes[ProcessingOutcome.FAILED] == 1 and outcomes[ProcessingOutcome.PROCESSED] == 1
+    assert db_handler.job_counts() == {JOB_FAILED: 1, JOB_DONE: 1}
+
+
+def test_vanished_documents_fail(db_handler, tmp_path):
+    file_path = tmp_path / "1_table.html"
+    file_path.write_text("<html></html>")
+    with zipfile.ZipFile(tmp_path / "documents.zip", "w") as zip_file:
+        zip_file.writestr("2_table.html", "<html></html>")
+    gone = [str(tmp_path / "3_table.html.gz"), f"{tmp_path / 'documents.zip'}!4_table.html"]
+    db_handler.enqueue_jobs([*gone, str(file_path)])
+    processor = RecordingProcessor(db_handler)
+    outcomes = job_queue.QueueWorker(processor).run()
+
+    assert processor.processed == [str(file_path)]
+    assert outcomes[ProcessingOutcome.FAILED] == 2 and outcomes[ProcessingOutcome.PROCESSED] == 1
+    assert db_handler.job_counts() == {JOB_FAILED: 2, JOB_DONE: 1}
+
+
+def test_processed_again_replaces_records(db_handler, tmp_path):
+    processor = DocumentProcessor(common.ConfigLoader(str(CONFIG)).get_document_types(), {}, PARAMS,
+                                  db_handler=db_handler)
+    file_path = tmp_path / "1_table.html"
+    with open(file_path, "w", encoding="utf-8") as f:
+        # Too short title, too late creation date and too big first row
+        write_table(f, 3, 4, title="Q1", creation="1Jan2030 Cayman Islands", row_values=lambda r: [900, 900, 900])
+    assert job_queue.enqueue(db_handler, [file_path]) == (1, 1)
+    [job] = db_handler.claim_jobs("w1", 1, 0)
+    document_id = job_queue.document_id(job["_id"])
+
+    # Processed again after its lease expired, the records are the same
+    for _ in range(2):
+        assert processor.process_file(file_path, document_id) == ProcessingOutcome.PROCESSED
+        processor.flush()
+        assert len(db_handler.find_documents()) == 1
+        assert len(db_handler.document_discrepancies(document_id)) == 3
+
+    # Corrected and dropped again: queued again, the former discrepancies are gone
+    with open(file_path, "w", encoding="utf-8") as f:
+        write_table(f, 3, 4, title="Quarterly revenue report", row_values=lambda r: [1, 2, 3])
+    assert job_queue.enqueue(db_handler, [file_path]) == (1, 1)
+    assert job_queue.QueueWorker(processor).run()[ProcessingOutcome.PROCESSED] == 1
+    [document] = db_handler.find_documents()
+    assert document["_id"] == document_id and document["status"] == "ValidationStatus.VALID"
+    assert db_handler.document_discrepancies(document_id) == []
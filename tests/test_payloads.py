@@ -0,0 +1,69 @@
+"""The payload store of the blob layout on the JSON lines handler, and the startup check of the handlers without
+one."""
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import common
+from common import FatalError
+from db import db_handlers
+from db.jsonl_handler import JsonlDbHandler
+from db.memory_handler import InMemoryDbHandler
+from processing.document_processor import check_layouts
+from templates import factory
+from validation.doc_validator import DocumentValidator
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+CONFIG = Path(__file__).resolve().parent.parent / "config.json"
+BODY = [["Row 0", "1", "2"], ["Row 1", "3", "4"]]
+
+
+class NoPayloadsDbHandler(InMemoryDbHandler):
+    insert_payloads = db_handlers.AbstractDatabaseHandler.insert_payloads
+    get_payload = db_handlers.AbstractDatabaseHandler.get_payload
+
+
+@pytest.fixture
+def template_factory():
+    return factory.TemplateFactory(common.ConfigLoader(str(CONFIG)).get_document_types(), **PARAMS)
+
+
+def test_jsonl_payloads(tmp_path, template_factory):
+    config = {"path": str(tmp_path), "batch_size": 1}
+    writer = JsonlDbHandler(config)
+    template = template_factory.get_template(Path("1_table.html"))
+    field_values = {"title": "Quarterly revenue report", "creation_date": "10Mar2010", "first_row_sum": "3",
+                    "body": BODY}
+    for name in ("1_table.html", "2_table.html"):
+        DocumentValidator(Path(name), template, writer, dict(field_values)).process()
+    writer.close()
+    # The body of both documents is stored once
+    assert len(list(writer.records("payloads"))) == 1
+
+    # Read by another process
+    reader = JsonlDbHandler(config)
+    documents = list(reader.records())
+    assert len(documents) == 2 and all(document["body"]["payload"] for document in documents)
+    assert all(reader.load_payloads(document)["body"] == BODY for document in documents)
+    assert reader.get_payload("0" * 64) is None
+
+    # Payloads written after the index was built are found too
+    writer = JsonlDbHandler(config)
+    writer.insert_payloads({"1" * 64: b"[1,2]"})
+    writer.close()
+    assert reader.get_payload("1" * 64) == [1, 2]
+
+
+def test_layouts_checked(template_factory):
+    assert db_handlers.supports_payloads(InMemoryDbHandler())
+    assert not db_handlers.supports_payloads(NoPayloadsDbHandler())
+    check_layouts(template_factory, InMemoryDbHandler())
+    with pytest.raises(FatalError, match="body"):
+        check_layouts(template_factory, NoPayloadsDbHandler())
+
+
+def test_text_layouts_need_no_payloads():
+    check_layouts(factory.TemplateFactory({"HTML Table": {
+        "name_mask": r"\d+_table\.html", "template_class": "templates.html_table_template.HTMLTableTemplate",
+        "options": {"fields_to_save": {"title": "text", "body": "array"}}}}, **PARAMS), NoPayloadsDbHandler())
@@ -0,0 +1,33 @@
+"""The flushes of the SQLite handler when other processes write to the same database file."""
+from datetime import datetime, timezone
+
+from db.sqlite_handler import SQLiteDbHandler
+
+
+class InterleavedDbHandler(SQLiteDbHandler):
+    """Another connection commits while this one looks up its payloads, as another worker process would."""
+
+    def __init__(self, config: dict, other: SQLiteDbHandler):
+        super().__init__(config)
+        self._other = other
+
+    def _new_payloads(self):
+        new_payloads = super()._new_payloads()
+        self._other.insert_document({"name": "2_table.html", "processed_at": datetime.now(timezone.utc)})
+        self._other.flush()
+        return new_payloads
+
+
+def test_flush_after_another_commit(tmp_path):
+    config = {"path": str(tmp_path / "documents.db")}
+    other = SQLiteDbHandler(config)
+    handler = InterleavedDbHandler(config, other)
+    handler.insert_payloads({"0" * 64: b"[1,2]"})
+    handler.insert_document({"name": "1_table.html", "processed_at": datetime.now(timezone.utc)})
+    handler.delete_document_discrepancies("1")
+    handler.flush()
+
+    assert sorted(document["name"] for document in other.find_documents()) == ["1_table.html", "2_table.html"]
+    assert other.get_payload("0" * 64) == [1, 2]
+    handler.close()
+    other.close()
@@ -0,0 +1,28 @@
+"""The time budget of the extractions covers the documents, not the startup of the helper process."""
+from datetime import datetime
+from pathlib import Path
+
+import common
+from benchmarks.corpus import write_table
+from processing import sources
+from processing.supervisor import ExtractionSupervisor
+from templates import factory
+
+PARAMS = {"N": 5, "D": datetime(2020, 3, 10), "SUM": 1000}
+CONFIG = Path(__file__).resolve().parent.parent / "config.json"
+
+
+def test_helper_startup_not_budgeted(tmp_path):
+    # Compiled, the types are pickled to the helper
+    document_types = common.ConfigLoader(str(CONFIG)).document_types
+    template = factory.TemplateFactory(document_types, **PARAMS).get_template(Path("1_table.html"))
+    file_path = tmp_path / "1_table.html"
+    with open(file_path, "w", encoding="utf-8") as f:
+        write_table(f, 3, 4, title="Quarterly revenue report")
+    # Shorter than the startup of a Python process with the template modules
+    supervisor = ExtractionSupervisor(document_types, PARAMS, time_budget=0.01)
+    try:
+        field_values = supervisor.extract(template, sources.parse_document(str(file_path)))
+    finally:
+        supervisor.close()
+    assert field_values["title"] == "Quarterly revenue report"
@@ -0,0 +1,119 @@
+from datetime import datetime
+from typing import List, Union
+
+from validation.validation_rules import FieldContext, FieldRulePipeline, convert_value
+
+np = None  # NumPy, imported on the first batch since it is slow to import and only batches use it
+_numpy_loaded = False
+
+
+def _load_numpy() -> bool:
+    global np, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:  # NumPy is optional, without it the batch validation runs the scalar rules
+            pass
+    return np is not None
+
+_COLUMNAR_RULES = {"mandatory_check", "type_check", "min_length_check", "max_length_check", "min_check", "max_check"}
+
+
+class _Column:
+    # The state the scalar rules keep in FieldContext, for all the documents of a batch
+    def __init__(self, field_name: str, values: list):
+        self.field_name = field_name
+        self.values = values
+        self.count = len(values)
+        self.not_null = np.fromiter((value is not None for value in values), dtype=bool, count=self.count)
+        self.data_type = None
+        self.typed_values = [None] * self.count
+
+    def context(self, i: int) -> FieldContext:
+        field_context = FieldContext(self.field_name, self.values[i])
+        if self.not_null[i]:
+            field_context.data_type = self.data_type
+            field_context.typed_value = self.typed_values[i]
+        return field_context
+
+
+def validate_column(field_name: str, field_rules: FieldRulePipeline, values: list,
+                    discrepancies: List[List[dict]], errors: List[bool]):
+    """Validates the values of one field of many documents (discrepancies and errors are per document).
+
+    The checks are evaluated over the whole column, the length and threshold ones as array operations. The scalar
+    rule is called for every failing document only, so that the discrepancies are exactly the same as with the
+    scalar validation. Fields with other rules (e.g. format checks) are validated document by document.
+    """
+    if not _load_numpy() or any(rule.__name__ not in _COLUMNAR_RULES for rule in field_rules.rules):
+        for i, value in enumerate(values):
+            if not field_rules(field_name, value, discrepancies[i]):
+                errors[i] = True
+        return
+
+    column = _Column(field_name, values)
+    for rule in field_rules.rules:
+        failed = _check_column(rule, column)
+        indices = range(column.count) if failed is None else np.flatnonzero(failed)
+        for i in indices:
+            if not FieldRulePipeline.run_rule(rule, column.context(i), discrepancies[i]):
+                errors[i] = True
+
+
+def _check_column(rule, column: _Column) -> Union["np.ndarray", None]:
+    # Returns the mask of the documents failing the rule (to be run per document), None to run it for all of them
+    name = rule.__name__
+    param = getattr(rule, "param", None)
+    values = column.values
+
+    if name == "mandatory_check":
+        return ~column.not_null | np.fromiter((value == '' for value in values), dtype=bool, count=column.count)
+
+    if name == "type_check":
+        failed = np.zeros(column.count, dtype=bool)
+        for i in np.flatnonzero(column.not_null):
+            try:
+                column.typed_values[i] = convert_value(param, values[i])
+            except Exception:
+                failed[i] = True  # The scalar rule reports the mismatch (or the error)
+        column.data_type = param
+        return failed
+
+    if name in ("min_length_check", "max_length_check"):
+        try:
+            lengths = np.fromiter((len(value) if value is not None else 0 for value in values), dtype=np.int64,
+                                  count=column.count)
+        except TypeError:
+            return None
+        return column.not_null & (lengths < param if name == "min_length_check" else lengths > param)
+
+    if name in ("min_check", "max_check"):
+        if column.data_type is None and column.not_null.any():
+            return None  # The scalar rule raises the missing type check error
+        present, typed_values, threshold = _typed_array(column, param)
+        try:
+            return present & (typed_values < threshold if name == "min_check" else typed_values > threshold)
+        except TypeError:
+            return None  # Values not comparable with the threshold, the scalar rule reports the error
+
+    return None
+
+
+def _typed_array(column: _Column, param) -> tuple:
+    # The typed values as a native array (int64, datetime64) compared with the threshold in C, and the threshold of
+    # the array. The missing values are replaced by the threshold itself so that they never fail. The other values
+    # (e.g. strings, aware datetimes, huge ints) stay an object array, compared element by element in Python
+    present = column.not_null & np.fromiter((value is not None for value in column.typed_values), dtype=bool,
+                                            count=column.count)
+    values = [value if value is not None else param for value in column.typed_values]
+    if type(param) is int and all(type(value) is int for value in values):
+        try:
+            return present, np.array(values, dtype=np.int64), np.int64(param)
+        except OverflowError:
+            pass
+    elif isinstance(param, datetime) and param.tzinfo is None and \
+            all(isinstance(value, datetime) and value.tzinfo is None for value in values):
+        return present, np.array(values, dtype="datetime64[us]"), np.datetime64(param, "us")
+    return present, np.fromiter(values, dtype=object, count=column.count), param
@@ -0,0 +1,151 @@
+import ast
+from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Tuple
+
+from common import TemplateError
+
+# The functions custom rules can call
+FUNCTIONS = {
+    "abs": abs, "all": all, "any": any, "bool": bool, "float": float, "int": int, "len": len, "list": list,
+    "max": max, "min": min, "round": round, "set": set, "sorted": sorted, "str": str, "sum": sum, "tuple": tuple,
+    "date": lambda value, date_format: datetime.strptime(value, date_format),
+}
+# The read-only view of all the field values, for names that are not identifiers, e.g. fields["first row"]
+FIELDS_NAME = "fields"
+# The longest string or sequence a rule can build by repetition, e.g. "x" * N
+MAX_REPEAT_LENGTH = 1_000_000
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.Load, ast.Store,
+    ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+    ast.IfExp, ast.Call, ast.Name, ast.Constant, ast.Tuple, ast.List, ast.Set, ast.Dict, ast.Subscript, ast.Slice,
+    ast.GeneratorExp, ast.ListComp, ast.SetComp, ast.comprehension,
+)
+
+
+_SEQUENCE_NODES = (ast.List, ast.Tuple, ast.Set, ast.ListComp, ast.SetComp, ast.GeneratorExp)
+_MULTIPLY = "__multiply"
+_MODULO = "__modulo"
+
+
+def _multiply(left, right):
+    # The products of the rules, a sequence repeated too many times would exhaust the memory
+    for sequence, count in ((left, right), (right, left)):
+        if isinstance(sequence, (str, bytes, list, tuple)) and isinstance(count, int) and \
+                len(sequence) * count > MAX_REPEAT_LENGTH:
+            raise ValueError(f"a sequence repeated {count} times is longer than {MAX_REPEAT_LENGTH}")
+    return left * right
+
+
+def _modulo(left, right):
+    # printf-style formatting, e.g. "%0200000000d" % N, would build strings of any length
+    if isinstance(left, (str, bytes)):
+        raise ValueError("strings can't be formatted with %")
+    return left % right
+
+
+class _RepeatGuard(ast.NodeTransformer):
+    # Turns the products into _multiply calls and the remainders into _modulo calls
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Mult):
+            name = _MULTIPLY
+        elif isinstance(node.op, ast.Mod):
+            name = _MODULO
+        else:
+            return node
+        return ast.copy_location(ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[node.left, node.right],
+                                          keywords=[]), node)
+
+
+class _MissingField:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+@lru_cache(maxsize=1024)
+def compile_rule(rule_code: str) -> Tuple[Callable, Tuple[str, ...]]:
+    """Compiles a custom rule expression once into a function of the names it uses.
+
+    Only a whitelist of expressions is accepted: no attribute access, no names starting with an underscore and no
+    calls other than the FUNCTIONS, so that a rule can't reach the interpreter internals. Repeating a string or a
+    sequence (e.g. "x" * 10000000000) can't exhaust the memory: literal ones are rejected, the others are limited
+    to MAX_REPEAT_LENGTH when the rule runs. For the same reason, strings can't be formatted with %
+    (e.g. "%0200000000d" % N).
+    """
+    try:
+        tree = ast.parse(rule_code.strip(), mode="eval")
+    except SyntaxError as e:
+        raise TemplateError(f"Invalid custom rule '{rule_code}': {e}") from e
+
+    loaded, stored = set(), set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise TemplateError(f"Invalid custom rule '{rule_code}': {type(node).__name__} is not allowed")
+        if isinstance(node, ast.Name):
+            if node.id.startswith("_"):
+                raise TemplateError(f"Invalid custom rule '{rule_code}': the name '{node.id}' is not allowed")
+            (stored if isinstance(node.ctx, ast.Store) else loaded).add(node.id)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult) and any(
+                isinstance(operand, _SEQUENCE_NODES) or
+                (isinstance(operand, ast.Constant) and isinstance(operand.value, (str, bytes)))
+                for operand in (node.left, node.right)):
+            raise TemplateError(f"Invalid custom rule '{rule_code}': strings and sequences can't be repeated")
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod) and \
+                isinstance(node.left, ast.Constant) and isinstance(node.left.value, (str, bytes)):
+            raise TemplateError(f"Invalid custom rule '{rule_code}': strings can't be formatted with %")
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise TemplateError(f"Invalid custom rule '{rule_code}': only the functions "
+                                    f"{', '.join(sorted(FUNCTIONS))} can be called")
+
+    # The names become the parameters of a lambda, so that comprehensions see them as closure variables
+    names = tuple(sorted(loaded - stored))
+    arguments = ast.arguments(posonlyargs=[], args=[ast.arg(arg=name) for name in names], kwonlyargs=[],
+                              kw_defaults=[], defaults=[])
+    body = _RepeatGuard().visit(tree.body)
+    function_tree = ast.fix_missing_locations(ast.Expression(body=ast.Lambda(args=arguments, body=body)))
+    function = eval(compile(function_tree, "<custom rule>", "eval"),
+                    {"__builtins__": {}, _MULTIPLY: _multiply, _MODULO: _modulo})
+    return function, names
+
+
+class CustomRule:
+    """A compiled custom document rule, the arguments (rule parameters, functions) are bound once."""
+    __slots__ = ("rule_code", "field_names", "_function", "_arguments", "_field_names")
+
+    def __init__(self, rule_code: str, params: dict):
+        self.rule_code = rule_code
+        self._function, names = compile_rule(rule_code)
+        # The rule parameters take precedence over the field values, the field values over the functions
+        self._arguments = []
+        self._field_names = []
+        for name in names:
+            if name in params:
+                self._arguments.append(params[name])
+            elif name == FIELDS_NAME:
+                self._arguments.append(None)
+                self._field_names.append((len(self._arguments) - 1, None))
+            else:
+                self._arguments.append(FUNCTIONS.get(name, _MissingField(name)))
+                self._field_names.append((len(self._arguments) - 1, name))
+        # The fields the rule uses, None if it may use any of them
+        field_names = [name for _, name in self._field_names]
+        self.field_names = None if None in field_names else frozenset(field_names)
+
+    def __call__(self, field_values: dict):
+        arguments = list(self._arguments)
+        for i, name in self._field_names:
+            if name is None:
+                arguments[i] = MappingProxyType(field_values)
+            elif name in field_values:
+                arguments[i] = field_values[name]
+            elif isinstance(arguments[i], _MissingField):
+                raise NameError(f"name '{name}' is not defined")
+        return self._function(*arguments)
@@ -1,12 +1,15 @@
+from datetime import datetime, timezone
 from enum import Enum
 import logging
 from pathlib import Path
-from typing import Tuple, List
+from typing import Tuple, List, Union
 
-from common import TemplateError, FatalError
-from db import db_handlers
+from common import TemplateError, FatalError, run_summary
+from db import db_handlers, payloads
+import metrics
 from templates import factory
-from validation.validation_rules import Discrepancy, FieldContext
+from validation import columnar
+from validation.validation_rules import Discrepancy
 
 
 class ValidationStatus(Enum):
@@ -17,86 +20,144 @@ class ValidationStatus(Enum):
 
 
 class DocumentValidator:
-    def __init__(self, file_path: Path, doc_template: factory.Template, db_handler: db_handlers.AbstractDatabaseHandler):
+    def __init__(self, file_path: Path, doc_template: factory.Template, db_handler: db_handlers.AbstractDatabaseHandler,
+                 field_values: dict = None, document_id: str = None):
         self._file_path: Path = file_path
         self._db_handler: db_handlers.AbstractDatabaseHandler = db_handler
         self._doc_template: factory.Template = doc_template
-        self._field_values = {}
-
-    def process(self):
+        # Field values extracted beforehand (e.g. cached) are validated without extracting them again
+        self._extracted: bool = field_values is not None
+        self._field_values = field_values if field_values is not None else {}
+        # A given ID (e.g. derived from a job) makes saving idempotent, the records of a second run replace the first
+        self._document_id = document_id
+
+    @property
+    def field_values(self) -> dict:
+        return self._field_values
+
+    def process(self) -> Union[ValidationStatus, None]:
+        """Validates the document and saves the result, returns the final status (None if processing failed)."""
         try:
             if self._doc_template is None:
                 self._save_to_db(ValidationStatus.ERROR, [])
-                logging.info(f"End processing {self._file_path.name}, Status: {ValidationStatus.ERROR}, Template not found")
+                self._log_result(ValidationStatus.ERROR, [], ", Template not found")
+                return ValidationStatus.ERROR
             else:
-                self._field_values = self._doc_template.extract_field_values(self._file_path)
+                if not self._extracted:
+                    with metrics.stage_timer("extract"):
+                        self._field_values = self._doc_template.extract_required_fields(self._file_path)
                 status, result = self.validate()
                 self._save_to_db(status, result["discrepancies"])
-                logging.info(f"End processing {self._file_path.name}, Status: {status.value}")
+                self._log_result(status, result["discrepancies"])
+                return status
         except (TemplateError, FatalError):
             raise
         except Exception as e:
             logging.error(f"Error processing {self._file_path}: {e}")
+            return None
 
     def validate(self) -> Tuple[ValidationStatus, dict]:
-        discrepancies = []
-        status = ValidationStatus.NOT_PROCESSED
-
-        for field_name, rules in self._doc_template.field_validation_rules.items():
-            value = self._field_values.get(field_name, None)
-            field_context = FieldContext(field_name, value)
-
-            for rule in rules:
-                valid = False
-                discrepancy = Discrepancy(f"{rule.__name__} error", field_context.field_name)
-                try:
-                    valid, discrepancy = rule(field_context)
-                except TemplateError:
-                    raise
-                except Exception as e:
-                    status = ValidationStatus.ERROR
-                    discrepancy.message = str(e)
-
-                if not valid:
-                    logging.warning(f"Discrepancy: {discrepancy.__dict__}")
-                    discrepancies.append(discrepancy.__dict__) # append discrepancy object as a dictionary
-                    if status == ValidationStatus.NOT_PROCESSED:
-                        status = ValidationStatus.INVALID
-
-        for rule in self._doc_template.doc_validation_rules:
-            valid = False
-            discrepancy = Discrepancy(f"{rule.__name__} error")
+        with metrics.stage_timer("validate"):
+            discrepancies = []
+            error = False
+
+            for field_name, field_rules in self._doc_template.field_validation_rules.items():
+                if not field_rules(field_name, self._field_values.get(field_name, None), discrepancies):
+                    error = True
+
+            return self._finish_validation(self._doc_template, self._field_values, discrepancies, error)
+
+    @staticmethod
+    def validate_batch(doc_template: factory.Template, field_values_batch: List[dict]) -> List[Tuple[ValidationStatus, dict]]:
+        """Validates many documents at once, evaluating the field rules column by column.
+
+        The result is the same as calling validate() for each document.
+        """
+        with metrics.stage_timer("validate_batch"):
+            discrepancies = [[] for _ in field_values_batch]
+            errors = [False] * len(field_values_batch)
+
+            for field_name, field_rules in doc_template.field_validation_rules.items():
+                columnar.validate_column(field_name, field_rules,
+                                         [field_values.get(field_name, None) for field_values in field_values_batch],
+                                         discrepancies, errors)
+
+            return [DocumentValidator._finish_validation(doc_template, field_values, doc_discrepancies, error)
+                    for field_values, doc_discrepancies, error in zip(field_values_batch, discrepancies, errors)]
+
+    def save(self, status: ValidationStatus, discrepancies: List[dict]):
+        """Saves a validation result computed beforehand (e.g. by validate_batch)."""
+        self._save_to_db(status, discrepancies)
+        self._log_result(status, discrepancies)
+
+    @staticmethod
+    def _finish_validation(doc_template: factory.Template, field_values: dict, discrepancies: List[dict],
+                           error: bool) -> Tuple[ValidationStatus, dict]:
+        # Runs the document rules on top of the field rule results and sets the final status
+        for rule in doc_template.doc_validation_rules:
             try:
-                valid, discrepancy = rule(self._field_values)
+                with metrics.registry.timer("rule_seconds", field="", rule=rule.__name__):
+                    valid, discrepancy = rule(field_values)
             except TemplateError:
                 raise
             except Exception as e:
-                status = ValidationStatus.ERROR
-                discrepancy.message = str(e)
+                error = True
+                valid, discrepancy = False, Discrepancy(f"{rule.__name__} error", message=str(e))
             if not valid:
-                logging.warning(f"Discrepancy: {discrepancy}")
-                discrepancies.append(discrepancy.__dict__) # append discrepancy object as a dictionary
-                if status == ValidationStatus.NOT_PROCESSED:
-                    status = ValidationStatus.INVALID
+                discrepancies.append(discrepancy.to_dict())
 
-        if status == ValidationStatus.NOT_PROCESSED:
+        if error:
+            status = ValidationStatus.ERROR
+        elif discrepancies:
+            status = ValidationStatus.INVALID
+        else:
             status = ValidationStatus.VALID
 
         return status, {"discrepancies": discrepancies}
 
+    def _log_result(self, status: ValidationStatus, discrepancies: List[dict], details: str = ""):
+        # The per-document lines of a sample of the documents, the others are counted in the run summary only
+        if run_summary.sampled(self._file_path.name):
+            for discrepancy in discrepancies:
+                logging.warning("Discrepancy: %s", discrepancy)  # Formatted only if the record is emitted
+            logging.info(f"End processing {self._file_path.name}, Status: {status.value}{details}")
 
     def _save_to_db(self, status: ValidationStatus, discrepancies: List[dict]):
+        with metrics.stage_timer("save"):
+            self._insert(status, discrepancies)
+        # Counted once saved, a failed save counts as a failed document
+        run_summary.record(status.value, discrepancies)
+        metrics.registry.increment("documents_total", status=status.value)
+        for discrepancy in discrepancies:
+            metrics.registry.increment("discrepancies_total", type=discrepancy.get("discrepancy_type"))
+
+    def _insert(self, status: ValidationStatus, discrepancies: List[dict]):
+        document_id = {"_id": self._document_id} if self._document_id is not None else {}
+        if self._document_id is not None:
+            # The document may have been processed before (its job claimed again), with other discrepancies
+            self._db_handler.delete_document_discrepancies(self._document_id)
+        # The time windows of the reporting queries are on processed_at
+        processed_at = datetime.now(timezone.utc)
         if self._doc_template is None:
-            self._db_handler.insert_document({"name": self._file_path.name, "status": status})
+            self._db_handler.insert_document({**document_id, "name": self._file_path.name, "status": str(status),
+                                              "processed_at": processed_at})
             return
 
-        doc_field_values_to_be_saved = \
-            {k: v for k, v in self._field_values.items() if k in self._doc_template.fields_to_save_to_db()}
+        doc_field_values_to_be_saved, blobs = payloads.encode_fields(
+            {k: v for k, v in self._field_values.items() if k in self._doc_template.fields_to_save_to_db()},
+            self._doc_template.field_layouts())
+        if blobs:
+            self._db_handler.insert_payloads(blobs)
         document_id = self._db_handler.insert_document({
+            **document_id,
             "name": self._file_path.name,
             "template": self._doc_template.name,
-            **doc_field_values_to_be_saved, "status": str(status)})
+            **doc_field_values_to_be_saved, "status": str(status), "processed_at": processed_at})
         if discrepancies:
-            for discrepancy in discrepancies:
-                self._db_handler.insert_discrepancy({"document_id": document_id, **discrepancy})
+            records = [{"document_id": document_id, "template": self._doc_template.name, "processed_at": processed_at,
+                        **discrepancy} for discrepancy in discrepancies]
+            if self._document_id is not None:
+                for i, record in enumerate(records):
+                    record["_id"] = f"{self._document_id}-{i}"
+            self._db_handler.insert_discrepancies(records)
 
@@ -1,22 +1,94 @@
 from datetime import datetime
+from functools import lru_cache
 import re
-from typing import Union
+from typing import List, Union
 
 from common import TemplateError
+import metrics
+from validation.custom_rules import CustomRule
 
 class Discrepancy:
+    __slots__ = ("discrepancy_type", "location", "message")
+
     def __init__(self, discrepancy_type: str = None, location: str = None, message: str = None):
         self.discrepancy_type = discrepancy_type
         self.location = location
         self.message = message
 
+    def to_dict(self) -> dict:
+        return {"discrepancy_type": self.discrepancy_type, "location": self.location, "message": self.message}
+
 class FieldContext:
+    __slots__ = ("field_name", "value", "data_type", "typed_value")
+
     def __init__(self, field_name: str, value: str):
         self.field_name = field_name
         self.value = value
         self.data_type: Union[str, None] = None
         self.typed_value = None  # Will store the value after type conversion
 
+@lru_cache(maxsize=16384)
+def convert_value(expected_type: str, value: str):
+    # Values repeat a lot across documents (dates, small numbers), the conversions are cached
+    if expected_type == "int":
+        return int(value)
+    elif expected_type.startswith("date"):
+        date_format = expected_type[len("date"):]
+        return datetime.strptime(value, date_format)  # Try to parse the string into a date
+    return value
+
+class FieldRulePipeline:
+    """The rule chain of one field compiled into a single validator.
+
+    The rules run in order on one FieldContext, a discrepancy is allocated only when a rule fails.
+    """
+    __slots__ = ("rules",)
+
+    def __init__(self, rules: list):
+        self.rules = tuple(rules)
+
+    def __call__(self, field_name: str, value, discrepancies: List[dict]) -> bool:
+        """Appends the discrepancies of the field value to discrepancies, returns False if a rule raised an error."""
+        if metrics.registry.enabled:
+            return self._call_timed(field_name, value, discrepancies)
+        field_context = FieldContext(field_name, value)
+        succeeded = True
+        for rule in self.rules:
+            try:
+                valid, discrepancy = rule(field_context)
+            except TemplateError:
+                raise
+            except Exception as e:
+                succeeded = False
+                discrepancies.append(Discrepancy(f"{rule.__name__} error", field_name, str(e)).to_dict())
+                continue
+            if not valid:
+                discrepancies.append(discrepancy.to_dict())
+        return succeeded
+
+    def _call_timed(self, field_name: str, value, discrepancies: List[dict]) -> bool:
+        # The same as __call__, the duration of every rule is recorded
+        field_context = FieldContext(field_name, value)
+        succeeded = True
+        for rule in self.rules:
+            with metrics.registry.timer("rule_seconds", field=field_name, rule=rule.__name__):
+                succeeded = self.run_rule(rule, field_context, discrepancies) and succeeded
+        return succeeded
+
+    @staticmethod
+    def run_rule(rule, field_context: FieldContext, discrepancies: List[dict]) -> bool:
+        """Runs a single rule of the chain, the same way as the pipeline does."""
+        try:
+            valid, discrepancy = rule(field_context)
+        except TemplateError:
+            raise
+        except Exception as e:
+            discrepancies.append(Discrepancy(f"{rule.__name__} error", field_context.field_name, str(e)).to_dict())
+            return False
+        if not valid:
+            discrepancies.append(discrepancy.to_dict())
+        return True
+
 class ValidationRuleBuilder:
     def __init__(self):
         self.rules = []
@@ -25,27 +97,28 @@ class ValidationRuleBuilder:
         return self.rules
 
 class FieldRuleBuilder(ValidationRuleBuilder):
+    def compile(self) -> FieldRulePipeline:
+        return FieldRulePipeline(self.rules)
+
+    def _add_rule(self, rule, param=None):
+        rule.param = param  # The rule parameter is used by the batch (columnar) validation
+        self.rules.append(rule)
+        return self
+
     def add_type_check(self, expected_type: str):
         def type_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
             if field_context.value is None:
                 return True, None
             try:
                 field_context.data_type = expected_type
-                if expected_type == "int":
-                    field_context.typed_value = int(field_context.value)
-                elif expected_type.startswith("date"):
-                    date_format = expected_type[len("date"):]
-                    field_context.typed_value = datetime.strptime(field_context.value, date_format)  # Try to parse the string into a date
-                else:
-                    field_context.typed_value = field_context.value
+                field_context.typed_value = convert_value(expected_type, field_context.value)
             except ValueError:
                 return False, Discrepancy("type_check", f"{field_context.field_name}",
                         f"Type mismatch for the value '{field_context.value}'. Expected {expected_type}.")
 
             return True, None
 
-        self.rules.append(type_check)
-        return self
+        return self._add_rule(type_check, expected_type)
 
     def add_mandatory_check(self):
         def mandatory_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
@@ -54,8 +127,7 @@ class FieldRuleBuilder(ValidationRuleBuilder):
                                           f"Missing value for the field.")
             return True, None
 
-        self.rules.append(mandatory_check)
-        return self
+        return self._add_rule(mandatory_check)
 
     def add_format_check(self, format_mask: str):
         def format_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
@@ -66,8 +138,7 @@ class FieldRuleBuilder(ValidationRuleBuilder):
                         f"Type mismatch for the value '{field_context.value}'. Expected format '{format_mask}'.")
             return True, None
 
-        self.rules.append(format_check)
-        return self
+        return self._add_rule(format_check, format_mask)
 
     def add_max_length_check(self, max_length: int):
         def max_length_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
@@ -78,8 +149,7 @@ class FieldRuleBuilder(ValidationRuleBuilder):
                         f"Field value '{field_context.value}' is too long. Maximum length is {max_length}.")
             return True, None
 
-        self.rules.append(max_length_check)
-        return self
+        return self._add_rule(max_length_check, max_length)
 
     def add_min_length_check(self, min_length: int):
         def min_length_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
@@ -90,8 +160,7 @@ class FieldRuleBuilder(ValidationRuleBuilder):
                         f"Field value '{field_context.value}' is too short. Minimum length is {min_length}.")
             return True, None
 
-        self.rules.append(min_length_check)
-        return self
+        return self._add_rule(min_length_check, min_length)
 
     def add_max_check(self, max_val):
         def max_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
@@ -107,8 +176,7 @@ class FieldRuleBuilder(ValidationRuleBuilder):
                         f"Field value '{field_context.value}' is more than the maximum value {max_val}.")
             return True, None
 
-        self.rules.append(max_check)
-        return self
+        return self._add_rule(max_check, max_val)
 
     def add_min_check(self, min_val):
         def min_check(field_context: FieldContext) -> (bool, Union[Discrepancy, None]):
@@ -124,14 +192,21 @@ class FieldRuleBuilder(ValidationRuleBuilder):
                         f"Field value '{field_context.value}' is less than the minimum value {min_val}.")
             return True, None
 
-        self.rules.append(min_check)
-        return self
+        return self._add_rule(min_check, min_val)
 
 class DocRuleBuilder(ValidationRuleBuilder):
     def add_custom_rule(self, rule_code: str, **kwargs):
+        """Adds a cross-field rule given as an expression of the field values and kwargs, e.g. "len(title) < N".
+
+        The expression is parsed, checked and compiled once here, the document is valid if it evaluates to true.
+        """
+        custom_rule = CustomRule(rule_code, kwargs)
+
         def custom_rule_check(field_values: dict) -> (bool, Union[Discrepancy, None]):
-            return eval(rule_code, field_values.update(kwargs))
+            if custom_rule(field_values):
+                return True, None
+            return False, Discrepancy("custom_rule", None, f"The document does not satisfy the rule '{rule_code}'.")
 
+        custom_rule_check.field_names = custom_rule.field_names  # Lets the template extract only the needed fields
         self.rules.append(custom_rule_check)
         return self
-